@@ -1,11 +1,16 @@
 import json
 import os
+import time
 from collections import Counter
 from api_client import GenericClient
+import result_store
+import rollups
+import blob_store
+from result_db import open_result_db
 
 # Load config
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, "data")
+DATA_DIR = result_store.data_dir_for(BASE_DIR)
 CONFIG_PATH = os.path.join(BASE_DIR, "config.json")
 
 def load_config():
@@ -36,21 +41,19 @@ class DeepInsightEngine:
         
         return None
 
-    def load_latest_data(self):
-        if not os.path.exists(DATA_DIR):
+    def latest_day(self):
+        days = result_store.list_days(DATA_DIR)
+        return days[-1] if days else None
+
+    def load_latest_data(self, intent=None):
+        # Latest day bucket (legacy file and/or append-only log)
+        latest_day = self.latest_day()
+        if not latest_day:
             return []
         
-        files = [f for f in os.listdir(DATA_DIR) if f.endswith('_results.json')]
-        if not files:
-            return []
-            
-        # Sort by date, latest first
-        files.sort(reverse=True)
-        latest_file = files[0]
-        
-        print(f"📂 加载最新数据文件: {latest_file}")
-        with open(os.path.join(DATA_DIR, latest_file), 'r', encoding='utf-8') as f:
-            return json.load(f)
+        print(f"📂 加载最新数据: {latest_day}" + (f" | {intent}" if intent else ""))
+        # Indexed day/intent lookup instead of parsing the whole day
+        return open_result_db(DATA_DIR).query(day=latest_day, intent=intent)
 
     def analyze_gap(self, intent, records):
         """
@@ -70,7 +73,8 @@ class DeepInsightEngine:
         for r in gap_records:
             all_comps.extend(r.get('competitors', []))
             if len(sample_answers) < 3: # Take top 3 examples
-                sample_answers.append(f"Q: {r['question']}\nA: {r['answer'][:200]}...")
+                answer = blob_store.get_field(DATA_DIR, r, 'answer') or ''
+                sample_answers.append(f"Q: {r['question']}\nA: {answer[:200]}...")
 
         top_competitors = [c[0] for c in Counter(all_comps).most_common(5)]
         
@@ -108,8 +112,13 @@ class DeepInsightEngine:
             print("❌ 无法启动分析引擎：未配置有效的 API Key。")
             return
 
-        data = self.load_latest_data()
-        if not data:
+        latest_day = self.latest_day()
+        # Per-intent stats come from the day's rollup; raw records are only
+        # loaded for intents that need a gap analysis
+        intent_stats = rollups.summarize(
+            rollups.load_buckets(DATA_DIR, start_day=latest_day, end_day=latest_day), group_by='intent'
+        ) if latest_day else {}
+        if not intent_stats:
             print("❌ 未找到监测数据，请先运行监测任务。")
             return
 
@@ -118,16 +127,12 @@ class DeepInsightEngine:
         
         report_content = f"# GEO 深度洞察报告 (v2.3)\n生成时间: {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
         
-        # Group by intent
-        intents = set(r['intent'] for r in data)
-        
-        for intent in intents:
+        for intent, stats in intent_stats.items():
             print(f"\n📂 正在分析意图板块: {intent}")
-            intent_records = [r for r in data if r['intent'] == intent]
             
             # 1. Basic Stats
-            total = len(intent_records)
-            mentioned = sum(1 for r in intent_records if r['is_mentioned'])
+            total = stats.total
+            mentioned = stats.mentioned
             stats_line = f"   - 数据量: {total} 条 | 联想提及率: {mentioned/total:.1%}"
             print(stats_line)
             
@@ -135,7 +140,7 @@ class DeepInsightEngine:
             
             # 2. Gap Analysis
             if mentioned / total < 0.8: # If mention rate is below 80%, analyze gap
-                analysis = self.analyze_gap(intent, intent_records)
+                analysis = self.analyze_gap(intent, self.load_latest_data(intent=intent))
                 
                 if analysis:
                     print(f"\n💡 【深度洞察报告】")
@@ -1,20 +1,514 @@
+import asyncio
+import contextlib
+import email.utils
+import functools
+import hashlib
 import json
+import os
+import random
 import urllib.request
-import urllib.error
+import urllib.parse
+import http.client
+import socket
+import sqlite3
+import threading
 import time
 import ssl
 
+import latency_stats
+import provider_health
+import result_store
+import usage_ledger
+
+# SSL Context that ignores certificate verification (fixes common local Python issues)
+SSL_CTX = ssl.create_default_context()
+SSL_CTX.check_hostname = False
+SSL_CTX.verify_mode = ssl.CERT_NONE
+
+# Base URL of a mock_provider.py server; when set, every provider's requests
+# go there instead (network-free runs and benchmarks), and every store moves
+# to data/mock/run (see result_store.data_dir_for)
+MOCK_PROVIDER_ENV = result_store.MOCK_PROVIDER_ENV
+
+# Errors that mean an idle keep-alive connection was closed by the server;
+# the request is retried once on a fresh connection
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, BrokenPipeError, ConnectionResetError)
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP(S) connections to one host, shared by every client whose
+    base_url points there. Thread-safe: each request checks out its own
+    connection, so concurrent runners reuse idle ones instead of opening a
+    new TCP + TLS handshake per call. Honours HTTP(S)_PROXY like urllib.
+    """
+
+    def __init__(self, scheme, host, port, max_idle=8):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self.handshakes = 0
+        self.reused = 0
+        self.requests = 0
+        self._idle = []
+        self._lock = threading.Lock()
+        proxy = None if urllib.request.proxy_bypass(host) else urllib.request.getproxies().get(scheme)
+        self.proxy = urllib.parse.urlsplit(proxy) if proxy else None
+
+    def _connect(self, timeout):
+        target_host, target_port = self.host, self.port
+        if self.proxy:
+            target_host, target_port = self.proxy.hostname, self.proxy.port or (443 if self.proxy.scheme == 'https' else 80)
+        if self.scheme == 'https':
+            conn = http.client.HTTPSConnection(target_host, target_port, timeout=timeout, context=SSL_CTX)
+        else:
+            conn = http.client.HTTPConnection(target_host, target_port, timeout=timeout)
+        if self.proxy:
+            conn.set_tunnel(self.host, self.port)
+        with self._lock:
+            self.handshakes += 1
+        return conn
+
+    def _checkout(self, timeout):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            return self._connect(timeout), False
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def _checkin(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, path, body=None, headers=None, timeout=120):
+        """Send a request and return (status, response_headers, body_bytes)."""
+        with self.stream(method, path, body, headers, timeout) as (status, resp_headers, response):
+            return status, resp_headers, response.read()
+
+    @contextlib.contextmanager
+    def stream(self, method, path, body=None, headers=None, timeout=120):
+        """
+        Send a request and yield (status, response_headers, response) for
+        incremental reading, e.g. of a server-sent event stream. The
+        connection goes back to the pool only if the body was read to the
+        end; a caller that stops early gets it closed instead.
+        """
+        with self._lock:
+            self.requests += 1
+        conn, reused = self._checkout(timeout)
+        try:
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                conn.close()
+                conn, reused = self._connect(timeout), False
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+            if reused:
+                with self._lock:
+                    self.reused += 1
+            yield response.status, response.headers, response
+        except BaseException:
+            conn.close()
+            raise
+        if response.isclosed() and not response.will_close:
+            self._checkin(conn)
+        else:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "handshakes": self.handshakes, "reused": self.reused, "idle": len(self._idle)}
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(url):
+    """Process-wide pool for the scheme/host/port of `url`."""
+    parts = urllib.parse.urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    key = (parts.scheme, parts.hostname, port)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = _POOLS[key] = ConnectionPool(parts.scheme, parts.hostname, port)
+        return pool
+
+
+def pool_stats():
+    """{host: {requests, handshakes, reused, idle}} for every pool used so far."""
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    return {pool.host: pool.stats() for pool in pools}
+
+
+def format_pool_stats():
+    stats = pool_stats()
+    if not stats:
+        return "🔌 连接复用: 暂无请求"
+    parts = [f"{host} 请求 {s['requests']} 次 / 新建连接 {s['handshakes']} 次 / 复用 {s['reused']} 次" for host, s in sorted(stats.items())]
+    return "🔌 连接复用: " + "; ".join(parts)
+
+
+# HTTP statuses that mean "slow down / try again" rather than a bad request
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 4
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 120.0
+# Connection-level failures (refused, DNS, reset) get a small fixed retry
+# budget of their own; they say nothing about the provider's quota
+CONNECT_RETRIES = 2
+CONNECT_RETRY_DELAY = 1.0
+
+
+def backoff_delay(streak):
+    """Exponential delay with jitter for the `streak`-th retry, at most BACKOFF_MAX."""
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** min(streak - 1, 16) * random.uniform(0.5, 1.5))
+
+
+class RateLimiter:
+    """
+    Pacing for one provider: token buckets for requests per minute ("rpm")
+    and tokens per minute ("tpm") from the provider's config, plus adaptive
+    backoff. A 429 (or any answer with Retry-After) halves the refill rate
+    and blocks the provider for an exponential, jittered delay (or the
+    server's Retry-After); each success
+    ramps the rate back up towards the configured quota. Limits left unset
+    are not enforced, so only backoff applies.
+    """
+
+    def __init__(self, rpm=None, tpm=None):
+        self.rpm = float(rpm) if rpm else None
+        self.tpm = float(tpm) if tpm else None
+        self.rate_factor = 1.0
+        self.throttled = 0
+        self.waited = 0.0
+        self._requests = self.rpm or 0.0
+        self._tokens = self.tpm or 0.0
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._streak = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60 * self.rate_factor)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60 * self.rate_factor)
+
+    def acquire(self, tokens=0):
+        """Block until one request of about `tokens` tokens may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._blocked_until - now
+                if wait <= 0:
+                    # A request bigger than the whole bucket is let through once it is full
+                    need_tokens = min(tokens, self.tpm) if self.tpm else 0
+                    wait_req = (1 - self._requests) * 60 / (self.rpm * self.rate_factor) if self.rpm and self._requests < 1 else 0
+                    wait_tok = (need_tokens - self._tokens) * 60 / (self.tpm * self.rate_factor) if self.tpm and self._tokens < need_tokens else 0
+                    wait = max(wait_req, wait_tok)
+                    if wait <= 0:
+                        if self.rpm:
+                            self._requests -= 1
+                        if self.tpm:
+                            self._tokens -= tokens
+                        return
+                self.waited += wait
+            time.sleep(wait)
+
+    def record_usage(self, estimated, actual):
+        """Correct the token bucket once the real usage of a request is known."""
+        if self.tpm and actual:
+            with self._lock:
+                self._tokens -= actual - estimated
+
+    def on_success(self):
+        with self._lock:
+            self._streak = 0
+            self.rate_factor = min(1.0, self.rate_factor + 0.1)
+
+    def on_throttle(self, retry_after=None):
+        """Back off after a 429; returns the delay applied."""
+        with self._lock:
+            self.throttled += 1
+            self._streak += 1
+            self.rate_factor = max(0.1, self.rate_factor / 2)
+            if retry_after is not None:
+                delay = min(BACKOFF_MAX, retry_after)
+            else:
+                delay = backoff_delay(self._streak)
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+            return delay
+
+
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def get_rate_limiter(provider_name, config):
+    """Process-wide limiter per provider, shared by all of its clients."""
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(provider_name)
+        if limiter is None:
+            limiter = _LIMITERS[provider_name] = RateLimiter(config.get('rpm'), config.get('tpm'))
+        return limiter
+
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(messages):
+    # Rough upper bound: CJK text is about one token per character
+    return sum(len(m.get('content') or '') for m in messages)
+
+
+# Batched enrichment: several answers are analysed in one request. Batch
+# size is planned from the provider's context window and output limit.
+DEFAULT_CONTEXT_WINDOW = 32000
+DEFAULT_MAX_OUTPUT_TOKENS = 4096
+ENRICH_PROMPT_TOKENS = 600
+# Output budget per answer: strategy bullet points plus its source list
+ENRICH_OUTPUT_TOKENS = 500
+MAX_ENRICH_BATCH = 20
+
+
+def plan_enrichment_batches(answers, context_window=DEFAULT_CONTEXT_WINDOW,
+                            max_output_tokens=DEFAULT_MAX_OUTPUT_TOKENS, max_batch=MAX_ENRICH_BATCH):
+    """
+    Split answers into batches (lists of indexes, in order) that fit one
+    request: prompt, answers and the expected output within the context
+    window, and the output within the model's output limit. An answer too
+    long to share a request gets a batch of its own.
+    """
+    per_batch = max(1, min(max_batch, max_output_tokens // ENRICH_OUTPUT_TOKENS))
+    budget = context_window - ENRICH_PROMPT_TOKENS
+    batches, current, used = [], [], 0
+    for i, answer in enumerate(answers):
+        cost = len(answer or '') + ENRICH_OUTPUT_TOKENS
+        if current and (len(current) >= per_batch or used + cost > budget):
+            batches.append(current)
+            current, used = [], 0
+        current.append(i)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def parse_enrichment_output(content, count):
+    """
+    Split a batched enrichment reply into per-answer results: a list of
+    `count` entries, each {"sources": [...], "strategy": str} or None where
+    the item is missing or malformed. Complete items before a truncated
+    tail are still used.
+    """
+    results = [None] * count
+    start = (content or '').find('[')
+    if start == -1:
+        return results
+    decoder = json.JSONDecoder()
+    pos = start + 1
+    while pos < len(content):
+        while pos < len(content) and content[pos] in ' \t\r\n,':
+            pos += 1
+        if pos >= len(content) or content[pos] != '{':
+            break
+        try:
+            item, pos = decoder.raw_decode(content, pos)
+        except ValueError:
+            break  # Truncated or broken item; everything after it is lost
+        index = item.get('index')
+        strategy = item.get('strategy')
+        sources = item.get('sources')
+        if not isinstance(index, int) or not 0 <= index < count or results[index] is not None:
+            continue
+        if not isinstance(strategy, str) or not strategy.strip() or not isinstance(sources, list):
+            continue
+        results[index] = {
+            "sources": [src for src in sources if isinstance(src, dict) and (src.get('url') or src.get('media'))],
+            "strategy": strategy.strip()
+        }
+    return results
+
+
+# Disk-backed cache of chat responses, next to the results
+CACHE_PATH = os.path.join(result_store.data_dir_for(os.path.dirname(os.path.abspath(__file__))), "llm_cache.db")
+DEFAULT_CACHE_TTL = 30 * 86400
+DEFAULT_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+
+class ResponseCache:
+    """
+    SQLite-backed cache of chat responses keyed on (provider, model,
+    messages, temperature). Entries expire after `ttl` seconds; when the
+    stored payload exceeds `max_bytes` the least recently used entries are
+    evicted. Safe to share between threads and processes.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=DEFAULT_CACHE_TTL, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def make_key(provider, model, messages, temperature, base_url=""):
+        # The endpoint is part of the key, so answers of a mock server are
+        # never served to a client of the real provider
+        raw = json.dumps([provider, model, messages, temperature, base_url], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    conn.commit()
+                self.misses += 1
+                return None
+            conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        payload = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, len(payload.encode('utf-8')), now, now)
+            )
+            self.stores += 1
+            self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Evict least recently used entries down to 90% of the budget
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        stale = []
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            stale.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "stores": self.stores,
+                    "hit_rate": (self.hits / total * 100) if total else 0}
+
+
+_CACHE = None
+_CACHE_ENABLED = True
+_CACHE_LOCK = threading.Lock()
+
+
+def configure_response_cache(options=None):
+    """Apply the "llm_cache" config section: enabled, ttl_days, max_mb, path."""
+    global _CACHE, _CACHE_ENABLED
+    options = options or {}
+    with _CACHE_LOCK:
+        _CACHE_ENABLED = options.get('enabled', True)
+        _CACHE = ResponseCache(
+            options.get('path') or CACHE_PATH,
+            ttl=float(options.get('ttl_days', DEFAULT_CACHE_TTL / 86400)) * 86400,
+            max_bytes=int(float(options.get('max_mb', DEFAULT_CACHE_MAX_BYTES / 1024 / 1024)) * 1024 * 1024)
+        )
+
+
+def get_response_cache():
+    """The process-wide response cache, or None when disabled."""
+    global _CACHE
+    with _CACHE_LOCK:
+        if not _CACHE_ENABLED:
+            return None
+        if _CACHE is None:
+            _CACHE = ResponseCache()
+        return _CACHE
+
+
+def format_cache_stats():
+    cache = get_response_cache()
+    if cache is None:
+        return "🗃️ 响应缓存: 已关闭"
+    s = cache.stats()
+    return f"🗃️ 响应缓存: 命中 {s['hits']} 次 / 未命中 {s['misses']} 次 (命中率 {s['hit_rate']:.0f}%)"
+
+
 class GenericClient:
     def __init__(self, provider_name, config):
         self.provider_name = provider_name
         self.api_key = config.get('api_key', '')
         self.base_url = config.get('base_url', '')
         self.model = config.get('model', '')
-        
-        # SSL Context that ignores certificate verification (fixes common local Python issues)
-        self.ssl_ctx = ssl.create_default_context()
-        self.ssl_ctx.check_hostname = False
-        self.ssl_ctx.verify_mode = ssl.CERT_NONE
+        mock_url = os.environ.get(MOCK_PROVIDER_ENV)
+        if mock_url:
+            # The mock tells providers apart by model; the real base_url stays in
+            # the config, where a recording mock server looks it up
+            self.base_url = mock_url
+            self.api_key = self.api_key or "mock"
         
         # Adjust base_url if needed (append /chat/completions if not present and not ending with v1/v3 root)
         # Most providers expect base_url to be the root, and client appends /chat/completions
@@ -24,18 +518,110 @@ class GenericClient:
              self.endpoint = f"{self.base_url.rstrip('/')}/chat/completions"
         else:
              self.endpoint = self.base_url
+        
+        self.stream = bool(config.get('stream', False))
+        self.context_window = int(config.get('context_window') or DEFAULT_CONTEXT_WINDOW)
+        self.max_output_tokens = int(config.get('max_output_tokens') or DEFAULT_MAX_OUTPUT_TOKENS)
+        self.rate_limiter = get_rate_limiter(provider_name, config)
+        # Health of the provider, shared by every client and loop in the process
+        self.breaker = provider_health.get_breaker(provider_name, config)
+        self.latency = latency_stats.get_latency_stats()
+        self.usage = usage_ledger.get_ledger()
+        self.usage.set_price(provider_name, config)
+        
+        # Requests reuse keep-alive connections shared by all clients of this host
+        self.pool = get_pool(self.endpoint) if self.base_url else None
+        parts = urllib.parse.urlsplit(self.endpoint)
+        self.path = parts.path + (f"?{parts.query}" if parts.query else "")
 
     def is_configured(self):
         return bool(self.api_key) and bool(self.base_url)
 
-    def chat(self, messages, temperature=1.0):
+    def chat(self, messages, temperature=1.0, stream=None, on_progress=None, stop_after_chars=None, cache=None,
+             max_tokens=None, call_type="chat"):
         """
         Send a chat request to OpenAI-compatible API.
+        
+        With `stream` (default: the provider's "stream" config flag) the
+        answer is read as server-sent events, so DeepSeek reasoning and
+        answer text arrive incrementally; `on_progress(progress)` is called
+        as deltas come in and `stop_after_chars` ends the request early
+        once that much answer text has arrived. The returned dict carries
+        'metrics': latency, time to first token and tokens per second.
+        
+        `cache` opts in or out of the response cache; by default only
+        calls below temperature 1.0 (analysis, extraction) are cached, so
+        monitoring answers are always fresh. `max_tokens` caps the reply
+        length (default: the provider's own limit).
+
+        The socket timeout adapts to this provider's observed latency for
+        `call_type` (chat, generate, analysis, extract, enrich_batch): p99
+        of the time to first token with head-room, 120s until calibrated.
         """
         if not self.is_configured():
             print(f"      ⚠️ {self.provider_name} 配置不完整")
             return None
 
+        response_cache = get_response_cache() if (temperature < 1.0 if cache is None else cache) else None
+        cache_key = None
+        if response_cache is not None:
+            cache_key = ResponseCache.make_key(self.provider_name, self.model, messages, temperature, self.base_url)
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                cached['metrics'] = {"cached": True, "streamed": False, "latency": 0.0, "ttft": None,
+                                     "completion_tokens": None, "tokens_per_s": None, "truncated": False}
+                return cached
+
+        # Over budget: enrichment is deferred first, then every call refused
+        if not self.usage.allows(call_type):
+            print(f"      💰 本次任务预算已用尽，跳过 {self.provider_name} 的 {call_type} 请求")
+            return None
+        # An open circuit fails fast instead of waiting out timeouts
+        if not self.breaker.allow():
+            print(f"      ⛔ {self.provider_name} 已熔断，{self.breaker.retry_in():.0f}s 后再试探，跳过请求")
+            return None
+        started = time.monotonic()
+        try:
+            # Failed attempts are recorded by _send itself, one by one
+            result = self._send(messages, temperature, stream, on_progress, stop_after_chars, max_tokens,
+                                response_cache, cache_key, call_type)
+        except Exception:
+            self.breaker.record_failure(time.monotonic() - started)
+            raise
+        if result is not None:
+            metrics = result['metrics']
+            self.breaker.record_success(metrics['latency'])
+            # What the socket timeout has to cover: the wait for the first byte of the answer
+            wait = metrics['ttft'] if metrics.get('ttft') is not None else metrics['latency']
+            self.latency.record(self.provider_name, call_type, wait)
+            # Without a usage block (e.g. a stream stopped early) tokens are estimated
+            prompt_tokens = metrics.get('prompt_tokens')
+            completion_tokens = metrics.get('completion_tokens')
+            estimated = prompt_tokens is None or completion_tokens is None or metrics.get('usage_estimated')
+            if prompt_tokens is None:
+                prompt_tokens = estimate_tokens(messages)
+            if completion_tokens is None:
+                completion_tokens = estimate_tokens([{"content": result.get('content')}, {"content": result.get('reasoning')}])
+            self.usage.record(self.provider_name, call_type, prompt_tokens, completion_tokens, estimated)
+        return result
+
+    def _may_retry(self):
+        """Whether the circuit still lets a retry through; stops retrying a provider that just tripped."""
+        if self.breaker.allow():
+            return True
+        print(f"      ⛔ {self.provider_name} 已熔断，停止重试")
+        return False
+
+    def _send(self, messages, temperature, stream, on_progress, stop_after_chars, max_tokens, response_cache, cache_key,
+              call_type):
+        """
+        The request itself, with retries; returns the result dict or None.
+        Every failed attempt goes to the circuit breaker at once, and no
+        retry is made once the circuit is open, so a dead provider trips
+        within a few attempts instead of after the whole retry loop.
+        """
+        stream = self.stream if stream is None else stream
+        timeout = self.latency.timeout(self.provider_name, call_type)
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"
@@ -50,40 +636,178 @@ class GenericClient:
             "model": self.model,
             "messages": messages,
             "temperature": temperature,
-            "stream": False
+            "stream": bool(stream)
         }
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+        if stream:
+            # Ask for the usage block in the last event, for cost accounting
+            payload["stream_options"] = {"include_usage": True}
         
         data = json.dumps(payload).encode('utf-8')
-        req = urllib.request.Request(self.endpoint, data=data, headers=headers, method="POST")
+        estimated = estimate_tokens(messages)
+        connect_failures = 0
         
-        try:
-            # 增加超时时间至 120s，以适配 Deepseek R1 等推理模型
-            with urllib.request.urlopen(req, context=self.ssl_ctx, timeout=120) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                if 'choices' in result and len(result['choices']) > 0:
-                    message = result['choices'][0]['message']
-                    content = message.get('content', '')
-                    reasoning = message.get('reasoning_content', '') # Capture Deepseek reasoning
-                    return {'content': content, 'reasoning': reasoning}
+        for attempt in range(MAX_RETRIES + 1):
+            self.rate_limiter.acquire(estimated)
+            started = time.monotonic()
+            streamed = None
+            try:
+                # 超时按该平台该类调用的历史 p99 自适应 (流式模式下为两次数据之间的最长间隔)
+                with self.pool.stream("POST", self.path, body=data, headers=headers, timeout=timeout) as (status, resp_headers, response):
+                    if stream and status == 200:
+                        streamed = self._read_stream(response, started, on_progress, stop_after_chars)
+                    else:
+                        body = response.read()
+            except socket.timeout:
+                # A timed-out call still counts, so a too-tight timeout widens itself
+                self.latency.record(self.provider_name, call_type, timeout)
+                self.breaker.record_failure(timeout)
+                print(f"      ❌ {self.provider_name} 请求超时 ({timeout:.0f}s)，自动跳过。")
+                return None
+            except (OSError, http.client.HTTPException) as e:
+                # Not a throttle: a fixed short pause, and the provider's pacing is left alone
+                connect_failures += 1
+                self.breaker.record_failure(time.monotonic() - started)
+                if attempt < MAX_RETRIES and connect_failures <= CONNECT_RETRIES and self._may_retry():
+                    print(f"      ⚠️ {self.provider_name} 连接失败: {str(e)}，{CONNECT_RETRY_DELAY:.1f}s 后重试")
+                    time.sleep(CONNECT_RETRY_DELAY)
+                    continue
+                print(f"      ❌ {self.provider_name} 连接失败: {str(e)}")
+                return None
+            
+            if status in RETRYABLE_STATUSES:
+                self.breaker.record_failure(time.monotonic() - started)
+            if status in RETRYABLE_STATUSES and attempt < MAX_RETRIES and self._may_retry():
+                retry_after = parse_retry_after(resp_headers.get('Retry-After'))
+                if status == 429 or retry_after is not None:
+                    # Quota pressure: the whole provider slows down
+                    delay = self.rate_limiter.on_throttle(retry_after)
+                    print(f"      ⚠️ {self.provider_name} 限流 (HTTP {status})，{delay:.1f}s 后重试")
                 else:
-                    print(f"      ⚠️ {self.provider_name} 返回格式异常: {result}")
-                    return None
-        except urllib.error.URLError as e:
-            # 处理超时错误
-            if isinstance(e.reason, time.socket.timeout) or "timed out" in str(e.reason):
-                print(f"      ❌ {self.provider_name} 请求超时 (120s)，自动跳过。")
-            else:
-                print(f"      ❌ {self.provider_name} 连接失败: {str(e.reason)}")
-            return None
-        except urllib.error.HTTPError as e:
-            error_body = e.read().decode('utf-8')
-            print(f"      ❌ {self.provider_name} API 错误 (HTTP {e.code}):")
-            print(f"         内容: {error_body}") 
+                    # A 5xx only delays this request's retry
+                    delay = backoff_delay(attempt + 1)
+                    print(f"      ⚠️ {self.provider_name} 服务繁忙 (HTTP {status})，{delay:.1f}s 后重试")
+                    time.sleep(delay)
+                continue
+            break
+        
+        if status >= 400:
+            if status not in RETRYABLE_STATUSES:
+                self.breaker.record_failure(time.monotonic() - started)
+            print(f"      ❌ {self.provider_name} API 错误 (HTTP {status}):")
+            print(f"         内容: {body.decode('utf-8', errors='replace')}")
             return None
+        self.rate_limiter.on_success()
+        
+        if streamed is not None:
+            self.rate_limiter.record_usage(estimated, streamed['usage'].get('total_tokens'))
+            if not streamed['content'] and not streamed['reasoning']:
+                self.breaker.record_failure(time.monotonic() - started)
+                print(f"      ⚠️ {self.provider_name} 流式返回为空")
+                return None
+            result = {'content': streamed['content'], 'reasoning': streamed['reasoning'], 'metrics': streamed['metrics']}
+            if response_cache is not None and not streamed['metrics']['truncated']:
+                response_cache.put(cache_key, {'content': result['content'], 'reasoning': result['reasoning']})
+            return result
+        
+        try:
+            result = json.loads(body.decode('utf-8'))
+            usage = result.get('usage') or {}
+            self.rate_limiter.record_usage(estimated, usage.get('total_tokens'))
+            if 'choices' in result and len(result['choices']) > 0:
+                message = result['choices'][0]['message']
+                content = message.get('content', '')
+                reasoning = message.get('reasoning_content', '') # Capture Deepseek reasoning
+                latency = time.monotonic() - started
+                metrics = {
+                    "streamed": False,
+                    "latency": latency,
+                    "ttft": None,
+                    "prompt_tokens": usage.get('prompt_tokens'),
+                    "completion_tokens": usage.get('completion_tokens'),
+                    "usage_estimated": not usage,
+                    "tokens_per_s": (usage['completion_tokens'] / latency) if usage.get('completion_tokens') and latency > 0 else None,
+                    "truncated": False
+                }
+                if response_cache is not None:
+                    response_cache.put(cache_key, {'content': content, 'reasoning': reasoning})
+                return {'content': content, 'reasoning': reasoning, 'metrics': metrics}
+            else:
+                self.breaker.record_failure(time.monotonic() - started)
+                print(f"      ⚠️ {self.provider_name} 返回格式异常: {result}")
+                return None
         except Exception as e:
+            self.breaker.record_failure(time.monotonic() - started)
             print(f"      ❌ {self.provider_name} 未知错误: {str(e)}")
             return None
 
+    def _read_stream(self, response, started, on_progress=None, stop_after_chars=None):
+        """Parse an OpenAI-compatible SSE stream (incl. reasoning_content deltas)."""
+        content, reasoning = [], []
+        content_len = reasoning_len = chunks = 0
+        first_token = None
+        usage = {}
+        truncated = False
+        for raw in iter(response.readline, b''):
+            line = raw.decode('utf-8', errors='replace').strip()
+            if not line.startswith('data:'):
+                continue  # blank separators, ": keep-alive" comments, event names
+            data = line[len('data:'):].strip()
+            if data == '[DONE]':
+                response.read()  # Consume the end of the body so the connection can be reused
+                break
+            try:
+                event = json.loads(data)
+            except ValueError:
+                continue
+            usage = event.get('usage') or usage
+            for choice in event.get('choices') or []:
+                # Some providers attach usage to the final choice instead
+                usage = choice.get('usage') or usage
+                delta = choice.get('delta') or {}
+                piece = delta.get('content') or ''
+                thought = delta.get('reasoning_content') or ''
+                if not piece and not thought:
+                    continue
+                if first_token is None:
+                    first_token = time.monotonic() - started
+                chunks += 1
+                content.append(piece)
+                reasoning.append(thought)
+                content_len += len(piece)
+                reasoning_len += len(thought)
+            if on_progress:
+                on_progress({
+                    "provider": self.provider_name,
+                    "content_chars": content_len,
+                    "reasoning_chars": reasoning_len,
+                    "elapsed": time.monotonic() - started,
+                    "ttft": first_token
+                })
+            if stop_after_chars and content_len >= stop_after_chars:
+                truncated = True
+                break
+        latency = time.monotonic() - started
+        # Most providers send one token per delta; prefer real usage when reported
+        completion_tokens = usage.get('completion_tokens') or chunks
+        generating = latency - (first_token or 0)
+        return {
+            "content": ''.join(content),
+            "reasoning": ''.join(reasoning),
+            "usage": usage,
+            "metrics": {
+                "streamed": True,
+                "latency": latency,
+                "ttft": first_token,
+                "prompt_tokens": usage.get('prompt_tokens'),
+                "completion_tokens": completion_tokens,
+                "usage_estimated": not usage,
+                "tokens_per_s": (completion_tokens / generating) if generating > 0 else None,
+                "truncated": truncated
+            }
+        }
+
     def generate_questions(self, intent_label, keywords, count=5):
         """
         Generate diverse questions based on intent.
@@ -102,7 +826,7 @@ class GenericClient:
         """
         
         messages = [{"role": "user", "content": prompt}]
-        response = self.chat(messages, temperature=1.0)
+        response = self.chat(messages, temperature=1.0, call_type="generate")
         
         if response and response.get('content'):
             raw_text = response['content']
@@ -112,7 +836,7 @@ class GenericClient:
             return questions[:count]
         return []
 
-    def analyze_geo_strategy(self, intent_label, answer, competitors):
+    def analyze_geo_strategy(self, intent_label, answer, competitors, cache=None):
         """
         Analyze the answer and provide GEO optimization strategy.
         """
@@ -135,12 +859,12 @@ class GenericClient:
         """
         
         messages = [{"role": "user", "content": prompt}]
-        response = self.chat(messages, temperature=0.7)
+        response = self.chat(messages, temperature=0.7, cache=cache, call_type="analysis")
         if isinstance(response, dict):
             return response.get('content', '')
         return response
 
-    def extract_structured_sources(self, answer):
+    def extract_structured_sources(self, answer, cache=None):
         """
         Use LLM to extract structured sources (Title, URL, Media).
         """
@@ -160,7 +884,7 @@ class GenericClient:
         """
         
         messages = [{"role": "user", "content": prompt}]
-        response = self.chat(messages, temperature=0.3)
+        response = self.chat(messages, temperature=0.3, cache=cache, call_type="extract")
         
         content = ""
         if isinstance(response, dict):
@@ -178,3 +902,95 @@ class GenericClient:
             except:
                 pass
         return []
+
+    def plan_enrichment_batches(self, answers):
+        return plan_enrichment_batches(answers, self.context_window, self.max_output_tokens)
+
+    def enrich_batch_request(self, items):
+        """
+        Chat request body for a batched enrichment of `items` (dicts with
+        intent, answer and competitors): model, messages, temperature and
+        max_tokens. Shared by enrich_batch and offline batch jobs.
+        """
+        blocks = []
+        for i, item in enumerate(items):
+            blocks.append(f"""
+        ===== 回答 #{i} =====
+        意图：{item.get('intent')}
+        提及的竞对：{', '.join(item.get('competitors') or []) or '无'}
+        回答内容：
+        {item.get('answer')}
+        """)
+        prompt = f"""
+        你是一个 GEO (生成式引擎优化) 专家。下面有 {len(items)} 条大模型回答，编号 0 到 {len(items) - 1}。
+        请对每条回答分别完成两项任务：
+        1. 提取回答中引用的所有信源 (标题、完整链接、媒体名称/域名)，没有则为空数组。
+        2. 给出简短、尖锐的 GEO 实战建议：联想为何未被提及/提及权重不足的原因分析、内容优化建议、针对竞对的竞争占位策略。
+        {''.join(blocks)}
+        请只返回一个 JSON 数组，每条回答对应一个元素，不要任何解释：
+        [
+        {{ "index": 回答编号, "sources": [{{ "title": "文章标题或描述", "url": "完整链接", "media": "媒体名称/域名" }}], "strategy": "GEO 建议 (Markdown 要点)" }}
+        ]
+        """
+        return {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": 0.3,
+            "max_tokens": min(self.max_output_tokens, len(items) * ENRICH_OUTPUT_TOKENS * 2)
+        }
+
+    def enrich_batch(self, items, cache=None):
+        """
+        Source extraction and GEO strategy for several answers in one
+        request. `items` are dicts with intent, answer and competitors.
+        Returns a list aligned with `items` of {"sources", "strategy"}, with
+        None for items the reply did not cover validly (retry those with
+        the single-answer methods).
+        """
+        request = self.enrich_batch_request(items)
+        response = self.chat(request["messages"], temperature=request["temperature"], cache=cache,
+                             call_type="enrich_batch", max_tokens=request["max_tokens"])
+        content = response.get('content', '') if isinstance(response, dict) else (response or '')
+        return parse_enrichment_output(content, len(items))
+
+
+class AsyncGenericClient:
+    """
+    asyncio counterpart of GenericClient with the same methods. Each call
+    runs the blocking request on `executor` over the shared keep-alive
+    pool, so coroutines for every provider wait on the network concurrently
+    without an extra HTTP dependency.
+    """
+
+    def __init__(self, provider_name, config, executor=None):
+        self.provider_name = provider_name
+        self.client = GenericClient(provider_name, config)
+        self.executor = executor
+
+    def is_configured(self):
+        return self.client.is_configured()
+
+    async def _call(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(method, *args, **kwargs))
+
+    async def chat(self, messages, temperature=1.0, stream=None, on_progress=None, stop_after_chars=None, cache=None,
+                   max_tokens=None, call_type="chat"):
+        return await self._call(self.client.chat, messages, temperature=temperature, stream=stream,
+                                on_progress=on_progress, stop_after_chars=stop_after_chars, cache=cache,
+                                max_tokens=max_tokens, call_type=call_type)
+
+    async def generate_questions(self, intent_label, keywords, count=5):
+        return await self._call(self.client.generate_questions, intent_label, keywords, count=count)
+
+    async def analyze_geo_strategy(self, intent_label, answer, competitors, cache=None):
+        return await self._call(self.client.analyze_geo_strategy, intent_label, answer, competitors, cache=cache)
+
+    async def extract_structured_sources(self, answer, cache=None):
+        return await self._call(self.client.extract_structured_sources, answer, cache=cache)
+
+    def plan_enrichment_batches(self, answers):
+        return self.client.plan_enrichment_batches(answers)
+
+    async def enrich_batch(self, items, cache=None):
+        return await self._call(self.client.enrich_batch, items, cache=cache)
@@ -4,7 +4,20 @@ import os
 import pandas as pd
 import plotly.express as px
 from datetime import datetime, timedelta
-from api_client import GenericClient
+from api_client import GenericClient, format_pool_stats, format_cache_stats, configure_response_cache
+import result_writer
+import rollups
+import blob_store
+import result_store
+import run_manifest
+import enrichment
+import provider_health
+import usage_ledger
+import question_bank
+import entity_matcher
+import functools
+import uuid
+from columnar_store import open_columnar_store
 import time
 import re
 from collections import Counter
@@ -12,7 +25,7 @@ from collections import Counter
 # --- Configuration ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CONFIG_PATH = os.path.join(BASE_DIR, "config.json")
-DATA_DIR = os.path.join(BASE_DIR, "data")
+DATA_DIR = result_store.data_dir_for(BASE_DIR)
 
 if not os.path.exists(DATA_DIR):
     os.makedirs(DATA_DIR)
@@ -53,60 +66,6 @@ def save_config(config):
         with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
             json.dump(config, f, ensure_ascii=False, indent=2)
 
-def extract_competitors(answer):
-    competitors = ["华为", "小米", "阿里", "腾讯", "百度", "字节", "京东", "海尔", "美的", "比亚迪", "大疆", "宁德时代", "联想"]
-    found = []
-    for c in competitors:
-        if c.lower() in answer.lower():
-            found.append(c)
-    return list(set(found))
-
-def extract_sources_v2(answer):
-    # 提取链接
-    urls = re.findall(r'(https?://[^\s\)]+)', answer)
-    
-    # 媒体名称映射
-    media_map = {
-        "36kr.com": "36氪",
-        "huxiu.com": "虎嗅",
-        "sina.com": "新浪",
-        "163.com": "网易",
-        "sohu.com": "搜狐",
-        "caixin.com": "财新",
-        "thepaper.cn": "澎湃",
-        "jiemian.com": "界面",
-        "zhihu.com": "知乎",
-        "wikipedia.org": "维基百科"
-    }
-    
-    sources = []
-    for url in urls:
-        media_name = "其他媒体"
-        for domain, name in media_map.items():
-            if domain in url:
-                media_name = name
-                break
-        
-        # 尝试从 URL 前后提取“标题” (启发式：取链接前 15 个字或后 15 个字作为上下文)
-        # 这里为了演示，我们先提取媒体名和链接
-        sources.append({
-            "media": media_name,
-            "url": url,
-            "title": "相关新闻/报告" # 简化处理，因为大模型回答中标题提取较难
-        })
-        
-    # 如果没有链接但提到了媒体名
-    media_keywords = ["36氪", "虎嗅", "财新", "澎湃", "界面", "晚点", "知乎", "维基百科"]
-    for m in media_keywords:
-        if m in answer and not any(s['media'] == m for s in sources):
-            sources.append({
-                "media": m,
-                "url": "参考回答文本",
-                "title": f"关于{m}的相关报道"
-            })
-            
-    return sources
-
 def format_strategy_text(text):
     if not text: return ""
     # 1. Handle Headers (### Title) -> <h4>Title</h4>
@@ -127,30 +86,32 @@ def get_beijing_time():
     """Get current time in Beijing (UTC+8)"""
     return datetime.utcnow() + timedelta(hours=8)
 
-def save_result(intent_name, platform, question, answer, timestamp, strategy_analysis=None, structured_sources=None):
-    # Use Beijing time for filename to ensure correct "day" bucket
-    filename = f"{get_beijing_time().strftime('%Y%m%d')}_results.json"
-    filepath = os.path.join(DATA_DIR, filename)
-    data = []
-    if os.path.exists(filepath):
-        with open(filepath, 'r', encoding='utf-8') as f:
-            try: data = json.load(f)
-            except: data = []
-    is_mentioned = "联想" in answer or "Lenovo" in answer or "lenovo" in answer
+def save_result(intent_name, platform, question, answer, timestamp, strategy_analysis=None, structured_sources=None, on_commit=None,
+                entities=None):
+    # Use Beijing time for the day bucket
+    day = get_beijing_time().strftime('%Y%m%d')
+    # Brand, competitors and media from one scan of the answer (unless the caller has it already)
+    entities = entities or entity_matcher.analyze(answer)
+    is_mentioned = entities["mentioned"]
     
     # 竞对提取
-    competitors = extract_competitors(answer)
+    competitors = entities["competitors"]
     
     record = {
+        "record_id": uuid.uuid4().hex,
         "timestamp": timestamp, "intent": intent_name, "platform": platform,
-        "question": question, "answer": answer, "is_mentioned": is_mentioned,
+        "question": question, "question_id": question_bank.question_id(question),
+        "answer": answer, "is_mentioned": is_mentioned,
         "competitors": competitors, 
-        "sources_v2": structured_sources if structured_sources else extract_sources_v2(answer),
+        "sources_v2": structured_sources if structured_sources else entities["sources"],
         "geo_strategy": strategy_analysis
     }
-    data.append(record)
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    if strategy_analysis is None:
+        # Regex sources for now; the enrichment worker fills in the LLM analysis
+        record["enrichment"] = enrichment.PENDING
+    # Bulky text goes to the content-addressed blob store; the record keeps refs
+    record = blob_store.externalize(DATA_DIR, record)
+    result_writer.get_writer(DATA_DIR).write(record, day, on_commit=on_commit)
     return is_mentioned
 
 # --- Streamlit UI ---
@@ -362,11 +323,22 @@ with st.sidebar:
     st.markdown(f"**当前状态:** {status_text}")
 
     if not st.session_state.is_running:
+        refresh_questions = st.checkbox("🔄 重新生成问题集", value=False,
+                                        help="默认复用问题库中的问题集 (便于按天对比)，勾选后生成新版本")
         if st.button("🚀 开启全自动监测", use_container_width=True, type="primary"):
             if not active_providers:
                 st.error("请先设置 API 密钥！")
             else:
                 st.session_state.is_running = True
+                st.session_state.resume_run = False
+                st.session_state.refresh_questions = refresh_questions
+                st.rerun()
+        # Offer to continue a run that was stopped or died part-way
+        unfinished = run_manifest.find_resumable(DATA_DIR, kind='dashboard')
+        if unfinished and active_providers:
+            if st.button(f"♻️ 继续未完成的监测 ({unfinished.completed_count()}/{unfinished.total_units()})", use_container_width=True):
+                st.session_state.is_running = True
+                st.session_state.resume_run = True
                 st.rerun()
     else:
         if st.button("🛑 停止监测任务", use_container_width=True):
@@ -389,52 +361,40 @@ st.markdown("### 📊 实时监测仪表盘")
 metrics_placeholder = st.empty()
 
 def render_dashboard(placeholder):
-    files = [f for f in os.listdir(DATA_DIR) if f.endswith('_results.json')]
-    all_data = []
+    # Commit queued results first so the dashboard shows the latest answer
+    result_writer.get_writer(DATA_DIR).flush()
     last_updated = None
 
-    # Sort files to get the latest one
-    files.sort(reverse=True)
-
-    if files:
+    # Only the latest day is read; unchanged files come from the parse cache
+    latest_ts = result_store.latest_timestamp(DATA_DIR)
+    if latest_ts:
         try:
-            # Let's read the latest file to get the last timestamp
-            with open(os.path.join(DATA_DIR, files[0]), 'r', encoding='utf-8') as f:
-                latest_file_data = json.load(f)
-                if latest_file_data:
-                    # Sort by timestamp in descending order
-                    latest_entry = sorted(latest_file_data, key=lambda x: x['timestamp'], reverse=True)[0]
-                    last_updated = datetime.fromisoformat(latest_entry['timestamp']).strftime('%Y-%m-%d %H:%M:%S')
+            last_updated = datetime.fromisoformat(latest_ts).strftime('%Y-%m-%d %H:%M:%S')
         except Exception as e:
             pass
 
-    for f in files:
-        with open(os.path.join(DATA_DIR, f), 'r', encoding='utf-8') as file:
-            try:
-                all_data.extend(json.load(file))
-            except:
-                pass # Skip bad files
+    # Headline metrics come from the per-day rollups, not from raw records
+    buckets = rollups.load_buckets(DATA_DIR)
+    overall = rollups.summarize(buckets)
 
     with placeholder.container():
         if last_updated:
             st.caption(f"🕒 数据最后更新于: {last_updated}")
 
-        if not all_data:
+        if not overall.total:
             st.info("暂无监测数据，请先在左侧启动监测任务。")
             return None
         else:
-            df = pd.DataFrame(all_data)
-            
             # Overview Cards
             # Use a 4-column layout for high-level metrics (Desktop)
             # For mobile, we use a custom HTML grid to ensure 2x2 layout
             
             # Calculate metrics first
-            total_count = len(df)
-            mention_rate = (df['is_mentioned'].sum() / len(df)) * 100
-            intent_count = df['intent'].nunique()
-            all_comps = [item for sublist in df['competitors'].tolist() if isinstance(sublist, list) for item in sublist]
-            top_comp = Counter(all_comps).most_common(1)[0][0] if all_comps else "无"
+            total_count = overall.total
+            mention_rate = overall.mention_rate
+            intent_count = len(rollups.summarize(buckets, group_by='intent'))
+            top_comps = overall.competitors.most_common(8)
+            top_comp = top_comps[0][0] if top_comps else "无"
             
             # Desktop Layout (Streamlit Native)
             st.markdown('<div class="desktop-metrics-wrapper">', unsafe_allow_html=True)
@@ -503,8 +463,10 @@ def render_dashboard(placeholder):
             c1, c2 = st.columns([3, 2])
             with c1:
                 st.subheader("📊 各平台提及率对比")
-                platform_stats = df.groupby('platform')['is_mentioned'].mean().reset_index()
-                platform_stats['is_mentioned'] *= 100
+                platform_stats = pd.DataFrame(
+                    [{'platform': p, 'is_mentioned': c.mention_rate} for p, c in rollups.summarize(buckets, group_by='platform').items()],
+                    columns=['platform', 'is_mentioned']
+                )
                 fig = px.bar(platform_stats, x='platform', y='is_mentioned', 
                                 labels={'platform': '监测平台', 'is_mentioned': '提及率 (%)'},
                                 color='is_mentioned', color_continuous_scale='Blues')
@@ -519,7 +481,7 @@ def render_dashboard(placeholder):
                 
             with c2:
                 st.subheader("🍩 热门竞品份额")
-                comp_df = pd.DataFrame(Counter(all_comps).most_common(8), columns=['公司', '次数'])
+                comp_df = pd.DataFrame(top_comps, columns=['公司', '次数'])
                 fig2 = px.pie(comp_df, values='次数', names='公司', hole=0.4)
                 # Responsive chart layout with adjusted legend
                 fig2.update_layout(
@@ -531,12 +493,35 @@ def render_dashboard(placeholder):
                 )
                 st.plotly_chart(fig2, use_container_width=True, config={'responsive': True, 'displayModeBar': False})
             
-            return df
+            # Cost of the latest run per collected answer, i.e. per mention-rate data point
+            latest_run = usage_ledger.latest_run_id(DATA_DIR)
+            if latest_run:
+                with st.expander(f"💰 监测成本 (最近一次任务 {latest_run})"):
+                    cost_df = pd.DataFrame(
+                        [{'platform': p, 'tokens': row['tokens'], 'cost': row['cost'], 'points': row['points'],
+                          'cost_per_point': row['cost_per_point']}
+                         for p, row in sorted(usage_ledger.run_costs(DATA_DIR, [latest_run]).items())],
+                        columns=['platform', 'tokens', 'cost', 'points', 'cost_per_point']
+                    )
+                    st.dataframe(
+                        cost_df,
+                        column_config={
+                            "platform": st.column_config.TextColumn("监测平台"),
+                            "tokens": st.column_config.NumberColumn("Tokens"),
+                            "cost": st.column_config.NumberColumn("费用", format="¥%.2f"),
+                            "points": st.column_config.NumberColumn("数据条数"),
+                            "cost_per_point": st.column_config.NumberColumn("每个提及率数据点", format="¥%.4f")
+                        },
+                        hide_index=True,
+                        use_container_width=True
+                    )
+            
+            return buckets
 
 # Initial Render
-df = render_dashboard(metrics_placeholder)
+buckets = render_dashboard(metrics_placeholder)
 
-if df is not None:
+if buckets is not None:
     # --- 意图深度透视 ---
     st.markdown("---")
     st.header("🎯 意图深度透视")
@@ -544,7 +529,7 @@ if df is not None:
     # Create a container for the deep dive section with a distinct background
     with st.container():
         # Replace st.pills with st.radio (horizontal) for better stability
-        all_intents = df['intent'].unique()
+        all_intents = list(rollups.summarize(buckets, group_by='intent').keys())
         # Use horizontal radio buttons to simulate tabs/pills
         selected_intent = st.radio(
             "选择要分析的意图", 
@@ -553,17 +538,25 @@ if df is not None:
             label_visibility="collapsed"
         )
             
-        intent_df = df[df['intent'] == selected_intent]
+        intent_stats = rollups.summarize(buckets, intent=selected_intent)
+        intent_platform_stats = rollups.summarize(buckets, group_by='platform', intent=selected_intent)
+        # Source and strategy columns are only needed for the selected intent
+        store = open_columnar_store(DATA_DIR)
+        intent_detail_df = store.read_frame(
+            ['timestamp', 'sources', 'sources_v2', 'geo_strategy', 'blobs'], intent=selected_intent
+        )
         
         # 1. Intent Metrics Row
         i1, i2, i3 = st.columns(3)
         with i1:
-            st.metric(f"【{selected_intent}】样本量", len(intent_df))
+            st.metric(f"【{selected_intent}】样本量", intent_stats.total)
         with i2:
-            i_mention_rate = (intent_df['is_mentioned'].sum() / len(intent_df)) * 100
+            i_mention_rate = intent_stats.mention_rate
             st.metric("该意图下曝光权重", f"{i_mention_rate:.1f}%")
         with i3:
-            p_mentions = intent_df.groupby('platform')['is_mentioned'].mean().sort_values(ascending=False)
+            p_mentions = pd.Series(
+                {p: c.mentioned / c.total for p, c in intent_platform_stats.items() if c.total}, dtype=float
+            ).sort_values(ascending=False)
             best_p = p_mentions.index[0] if not p_mentions.empty else "N/A"
             st.metric("最佳表现平台", best_p)
 
@@ -580,7 +573,7 @@ if df is not None:
         }
         
         # Grid Layout for Cards
-        unique_platforms = intent_df['platform'].unique()
+        unique_platforms = list(intent_platform_stats.keys())
         rows = [unique_platforms[i:i + 2] for i in range(0, len(unique_platforms), 2)]
         
         for row in rows:
@@ -607,9 +600,8 @@ if df is not None:
         
         with col_left:
             st.subheader("📊 细分竞对分布")
-            i_comps_all = [item for sublist in intent_df['competitors'].tolist() if isinstance(sublist, list) for item in sublist]
-            if i_comps_all:
-                i_comp_df = pd.DataFrame(Counter(i_comps_all).most_common(10), columns=['公司', '出现次数'])
+            if intent_stats.competitors:
+                i_comp_df = pd.DataFrame(intent_stats.competitors.most_common(10), columns=['公司', '出现次数'])
                 fig_i = px.bar(i_comp_df, x='公司', y='出现次数', color='出现次数', 
                                text_auto=True, color_continuous_scale='Reds')
                 fig_i.update_layout(showlegend=False, plot_bgcolor='rgba(0,0,0,0)', height=350)
@@ -620,18 +612,18 @@ if df is not None:
         with col_right:
             st.subheader("🔗 优质信源画像")
             i_srcs = []
-            for r in intent_df.to_dict('records'):
+            for r in intent_detail_df.to_dict('records'):
                 if 'sources_v2' in r and isinstance(r['sources_v2'], list):
                     i_srcs.extend(r['sources_v2'])
                 elif 'sources' in r and isinstance(r['sources'], list):
                     for s in r['sources']:
                         i_srcs.append({"media": s, "url": "-", "title": "历史数据"})
             
-            if i_srcs:
-                i_src_df = pd.DataFrame(i_srcs)
-                i_src_df['media'] = i_src_df['media'].fillna('未知信源').replace('', '未知信源')
-                media_counts = i_src_df['media'].value_counts().reset_index()
-                media_counts.columns = ['媒体名', '引用次数']
+            if intent_stats.media:
+                i_media = Counter()
+                for name, count in intent_stats.media.items():
+                    i_media[name if name else '未知信源'] += count
+                media_counts = pd.DataFrame(i_media.most_common(), columns=['媒体名', '引用次数'])
                 
                 fig_src_i = px.bar(media_counts.head(10), x='引用次数', y='媒体名', orientation='h',
                                    color='引用次数', color_continuous_scale='Viridis', text='引用次数')
@@ -645,10 +637,14 @@ if df is not None:
         st.markdown("---")
         
         # UX Improvement: Better visual hierarchy for Strategy
-        if 'geo_strategy' in intent_df.columns:
-            latest_strategy = intent_df.dropna(subset=['geo_strategy']).sort_values('timestamp', ascending=False)
-            if not latest_strategy.empty:
-                strategy_text = latest_strategy.iloc[0]['geo_strategy']
+        if 'geo_strategy' in intent_detail_df.columns:
+            # Only the newest strategy is shown, so only that one is resolved from the blob store
+            latest_strategy = sorted(
+                (r for r in intent_detail_df.to_dict('records') if blob_store.has_field(r, 'geo_strategy')),
+                key=lambda r: r['timestamp'] or '', reverse=True
+            )
+            if latest_strategy:
+                strategy_text = blob_store.get_field(DATA_DIR, latest_strategy[0], 'geo_strategy')
                 formatted_strategy = format_strategy_text(strategy_text)
                 st.markdown(f"""
                 <div class="strategy-box">
@@ -680,19 +676,14 @@ if df is not None:
         
         st.markdown("---")
         st.subheader("🔥 全平台优质信源排行榜 (全意图汇总)")
-        # 兼容处理全量信源
-        all_srcs_v2 = []
-        for r in df.to_dict('records'):
-            if 'sources_v2' in r and isinstance(r['sources_v2'], list):
-                for s in r['sources_v2']:
-                    all_srcs_v2.append(s['media'])
-            elif 'sources' in r and isinstance(r['sources'], list):
-                all_srcs_v2.extend(r['sources'])
-                
-        if all_srcs_v2:
-            # 清洗数据：处理空字符串和 None
-            cleaned_srcs = [s if s and s.strip() else "未知/通用信源" for s in all_srcs_v2]
-            src_counts = pd.DataFrame(Counter(cleaned_srcs).most_common(10), columns=['信源', '出现次数'])
+        # 全量信源计数来自每日汇总 (rollups)
+        overall_media = rollups.summarize(buckets).media
+        if overall_media:
+            # 清洗数据：处理空字符串
+            cleaned_srcs = Counter()
+            for s, count in overall_media.items():
+                cleaned_srcs[s if s and s.strip() else "未知/通用信源"] += count
+            src_counts = pd.DataFrame(cleaned_srcs.most_common(10), columns=['信源', '出现次数'])
             
             # 绘制全局信源排行图
             fig_src_global = px.bar(src_counts, x='出现次数', y='信源', orientation='h',
@@ -718,54 +709,76 @@ if st.session_state.is_running:
     st.session_state.logs.append(f"▶️ 监测任务启动时间: {get_beijing_time().strftime('%H:%M:%S')} (北京时间)")
     
     config = load_config()
+    configure_response_cache(config.get('llm_cache'))
     active_providers = [(name, cfg) for name, cfg in config['providers'].items() if cfg.get('api_key')]
+    platform_names = [name for name, _ in active_providers]
     
-    # 1. Generate Questions
-    st.session_state.logs.append("🎨 正在统一生成监测问题集...")
-    log_placeholder.code("\n".join(st.session_state.logs[-15:]))
-    
-    gen_name, gen_cfg = active_providers[0]
-    client = GenericClient(gen_name, gen_cfg)
-    intent_questions = {}
-    for intent in config['intents']:
-        # Log question generation progress
-        st.session_state.logs.append(f"   ⏳ 正在为【{intent['label']}】生成问题...")
+    manifest = run_manifest.find_resumable(DATA_DIR, kind='dashboard') if st.session_state.get('resume_run') else None
+    if manifest:
+        st.session_state.logs.append(f"♻️ 继续未完成的监测: {manifest.run_id} (已完成 {manifest.completed_count(platform_names)}/{manifest.total_units(platform_names)})")
+        log_placeholder.code("\n".join(st.session_state.logs[-15:]))
+        intent_questions = manifest.intent_questions
+    else:
+        # 1. Questions from the bank; missing or expired sets are generated concurrently
+        st.session_state.logs.append("🎨 正在准备监测问题集...")
         log_placeholder.code("\n".join(st.session_state.logs[-15:]))
         
-        qs = client.generate_questions(intent['label'], intent['keywords'], count=30)
-        
-        if qs:
-            st.session_state.logs.append(f"      ✅ 已生成 {len(qs)} 个问题")
-            # Show top 3 examples immediately
-            for idx, q_example in enumerate(qs[:3]):
-                st.session_state.logs.append(f"         • {q_example}")
-        else:
-            st.session_state.logs.append(f"      ⚠️ 生成失败，使用默认问题集")
+        client = question_bank.generator_client(config, active_providers)
+        intent_questions, report = question_bank.get_question_sets(
+            DATA_DIR, config, client, force=st.session_state.pop('refresh_questions', False))
+        for label, info in report.items():
+            if info['status'] == question_bank.GENERATED:
+                st.session_state.logs.append(f"   ✅ 【{label}】已生成 {info['count']} 个问题 (v{info['version']})")
+                # Show top 3 examples immediately
+                for q_example in intent_questions[label][:3]:
+                    st.session_state.logs.append(f"         • {q_example}")
+            elif info['status'] == question_bank.CACHED:
+                st.session_state.logs.append(f"   📚 【{label}】复用问题库 v{info['version']} ({info['count']} 个问题)")
+            else:
+                st.session_state.logs.append(f"   ⚠️ 【{label}】生成失败，使用默认问题集")
         log_placeholder.code("\n".join(st.session_state.logs[-15:]))
         
-        intent_questions[intent['label']] = qs if qs else intent.get('questions', [])[:30]
+        manifest = run_manifest.RunManifest.create(DATA_DIR, 'dashboard', platform_names, intent_questions)
+    
+    # Token usage of this run is attributed to it and checked against the budget
+    usage = usage_ledger.get_ledger()
+    usage.start_run(manifest.run_id, config)
     
     # 2. Main Loop
+    # Optional early stop of streamed answers once brand detection has enough text
+    stop_after_chars = config.get('monitoring', {}).get('stop_after_chars') or None
     total_tasks = len(active_providers) * len(intent_questions)
     task_count = 0
+    # Source extraction and strategy analysis run in a separate worker pool,
+    # so the next question is asked without waiting for them
+    enricher = enrichment.from_config(DATA_DIR, config).start()
     
     for p_name, p_config in active_providers:
         if not st.session_state.is_running: break
         
         client = GenericClient(p_name, p_config)
-        consecutive_failures = 0
         
         for intent_label, questions in intent_questions.items():
             if not st.session_state.is_running: break
-            if consecutive_failures >= 3:
-                st.session_state.logs.append(f"⚠️ {p_name} 连续失败过多，跳过该平台。")
-                break
+            # An unhealthy platform is skipped without waiting for timeouts; it is probed again after its cool-down
+            if not provider_health.is_available(p_name):
+                st.session_state.logs.append(f"⛔ {p_name} 已熔断，跳过意图【{intent_label}】(可稍后继续补齐)")
+                log_placeholder.code("\n".join(st.session_state.logs[-15:]))
+                continue
                 
             st.session_state.logs.append(f"📱 监测平台: {p_name} | 意图: {intent_label}")
             log_placeholder.code("\n".join(st.session_state.logs[-15:]))
             
             for i, q in enumerate(questions):
                 if not st.session_state.is_running: break
+                if manifest.is_done(p_name, intent_label, q): continue
+                if usage.exhausted():
+                    st.session_state.logs.append("💰 本次任务预算已用尽，停止提问")
+                    st.session_state.is_running = False
+                    break
+                if not provider_health.is_available(p_name):
+                    st.session_state.logs.append(f"⛔ {p_name} 已熔断，跳过本意图剩余问题")
+                    break
                 
                 # Update logs with current question
                 current_log = f"[{i+1}/{len(questions)}] ❓ {q[:30]}..."
@@ -776,31 +789,51 @@ if st.session_state.is_running:
                     st.session_state.logs.append(current_log)
                 log_placeholder.code("\n".join(st.session_state.logs[-15:]))
 
-                answer = client.chat([{"role": "user", "content": q}])
+                # Streamed answers update the question line live in the log panel
+                progress_state = {"last": 0.0}
+                def show_progress(progress, current_log=current_log, state=progress_state):
+                    now = time.monotonic()
+                    if now - state["last"] < 0.5:
+                        return
+                    state["last"] = now
+                    st.session_state.logs[-1] = f"{current_log} ⏳ {progress['content_chars']}字/推理{progress['reasoning_chars']}字 {progress['elapsed']:.1f}s"
+                    log_placeholder.code("\n".join(st.session_state.logs[-15:]))
+                
+                response = client.chat([{"role": "user", "content": q}], on_progress=show_progress, stop_after_chars=stop_after_chars)
+                answer = response.get('content', '') if isinstance(response, dict) else response
                 if answer:
-                    consecutive_failures = 0
-                    competitors = extract_competitors(answer)
-                    structured_srcs = client.extract_structured_sources(answer)
-                    strategy = client.analyze_geo_strategy(intent_label, answer, competitors)
+                    entities = entity_matcher.analyze(answer)
+                    competitors = entities["competitors"]
                     # Use Beijing Time for the record timestamp
-                    save_result(intent_label, p_name, q, answer, get_beijing_time().isoformat(), strategy, structured_srcs)
+                    save_result(intent_label, p_name, q, answer, get_beijing_time().isoformat(),
+                                on_commit=functools.partial(manifest.mark_done, p_name, intent_label, q),
+                                entities=entities)
                     
                     # Log success
-                    mention_status = "✅ 提及" if ("联想" in answer or "Lenovo" in answer or "lenovo" in answer) else "❌ 未提及"
+                    mention_status = "✅ 提及" if entities["mentioned"] else "❌ 未提及"
                     st.session_state.logs.append(f"   ↳ {mention_status} | 竞品: {', '.join(competitors) if competitors else '无'}")
                     log_placeholder.code("\n".join(st.session_state.logs[-15:]))
                     
                     # 关键：实时刷新 UI 展现最新数据 (不再使用 st.rerun)
                     render_dashboard(metrics_placeholder)
                 else:
-                    st.session_state.logs.append(f"   ⚠️ 请求失败，重试中...")
+                    st.session_state.logs.append(f"   ⚠️ 请求失败，跳过该问题")
                     log_placeholder.code("\n".join(st.session_state.logs[-15:]))
-                    consecutive_failures += 1
-                    if consecutive_failures >= 3: break
-                time.sleep(1.0) # Increased delay to prevent resource exhaustion
             
             task_count += 1
             
+    result_writer.get_writer(DATA_DIR).flush()
+    st.session_state.logs.append("🧩 正在补全信源与策略分析...")
+    log_placeholder.code("\n".join(st.session_state.logs[-15:]))
+    enricher.finish()
+    st.session_state.logs.append(f"🧩 已补全 {enricher.enriched} 条，失败 {enricher.failed} 条 (可运行 enrichment.py 补齐)")
+    if manifest.finish(platform_names) != 'completed':
+        st.session_state.logs.append(f"⚠️ 部分问题未成功 ({manifest.completed_count(platform_names)}/{manifest.total_units(platform_names)})，可点击「继续未完成的监测」补齐")
+    st.session_state.logs.append(format_pool_stats())
+    st.session_state.logs.append(format_cache_stats())
+    st.session_state.logs.append(provider_health.format_health_stats())
+    usage.finish_run({p: manifest.completed_count([p]) for p in platform_names})
+    st.session_state.logs.append(usage_ledger.format_run_usage(usage))
     st.session_state.is_running = False
     st.session_state.logs.append("✅ 监测任务已圆满完成！")
     # Only rerun once at the very end to reset UI state
@@ -0,0 +1,102 @@
+import os
+from datetime import datetime, timedelta
+
+import result_store
+import rollups
+import blob_store
+
+# Defaults for the "storage" section of config.json
+DEFAULT_STORAGE = {
+    "compression": "gzip",        # gzip | zstd (zstd needs the zstandard package)
+    "compress_after_days": 7,     # compress day files older than this
+    "retain_text_days": 90        # drop answer/reasoning/strategy text older than this
+}
+
+
+def storage_options(config):
+    options = dict(DEFAULT_STORAGE)
+    options.update(config.get('storage', {}))
+    return options
+
+
+def _beijing_today():
+    return (datetime.utcnow() + timedelta(hours=8)).strftime('%Y%m%d')
+
+
+def _cutoff_day(days, today=None):
+    today = datetime.strptime(today or _beijing_today(), '%Y%m%d')
+    # Never touch today's files, whatever the configuration says
+    return (today - timedelta(days=max(int(days), 1))).strftime('%Y%m%d')
+
+
+def drop_old_text(data_dir, older_than_days, today=None):
+    """
+    Strip the bulky text fields from records of days before the cutoff. The
+    metadata the rollups count (mentions, competitors, sources) is kept, so
+    rebuilt rollups come out identical. Returns the number of records stripped.
+    """
+    cutoff = _cutoff_day(older_than_days, today)
+    stripped = 0
+    for path in result_store.list_result_files(data_dir):
+        if result_store.file_day(path) >= cutoff:
+            continue
+        records = result_store.load_file(path, use_cache=False)
+        changed = 0
+        for r in records:
+            if any(r.get(f) is not None for f in blob_store.BLOB_FIELDS) or r.get('blobs'):
+                for f in blob_store.BLOB_FIELDS:
+                    r.pop(f, None)
+                r.pop('blobs', None)
+                r['text_dropped'] = True
+                changed += 1
+        if changed:
+            result_store.write_file(path, records)
+            stripped += changed
+    return stripped
+
+
+def compress_old_days(data_dir, older_than_days, codec="gzip", today=None):
+    """Compress uncompressed day files older than the cutoff. Returns the new paths."""
+    if codec == "zstd" and result_store.zstandard is None:
+        print("⚠️  未安装 zstandard，改用 gzip 压缩。")
+        codec = "gzip"
+    cutoff = _cutoff_day(older_than_days, today)
+    compressed = []
+    for path in result_store.list_result_files(data_dir):
+        if result_store.compression_of(path) or result_store.file_day(path) >= cutoff:
+            continue
+        target = path + result_store.COMPRESSION_EXTS[codec]
+        records = result_store.load_file(target) if os.path.exists(target) else []
+        records.extend(result_store.load_file(path))
+        result_store.write_file(target, records)
+        os.remove(path)
+        compressed.append(target)
+    return compressed
+
+
+def live_blob_keys(data_dir):
+    keys = set()
+    for path in result_store.list_result_files(data_dir):
+        for r in result_store.load_file(path):
+            keys.update((r.get('blobs') or {}).values())
+    return keys
+
+
+def run_archive(data_dir, options):
+    """Apply retention, then compression, then blob GC. Returns a summary dict."""
+    # Make sure every day's counts are rolled up before any text is dropped
+    for day in result_store.list_days(data_dir):
+        rollups.update_day(data_dir, day)
+
+    # Rewrites hold the directory lock so concurrent monitors wait instead of
+    # appending to a file that is about to be replaced
+    with result_store.locked(data_dir):
+        summary = {
+            "text_dropped": drop_old_text(data_dir, options["retain_text_days"]),
+            "compressed": compress_old_days(data_dir, options["compress_after_days"], options["compression"])
+        }
+        summary["blobs_removed"] = blob_store.collect_garbage(data_dir, live_blob_keys(data_dir))
+
+    for day in result_store.list_days(data_dir):
+        rollups.update_day(data_dir, day)
+    return summary
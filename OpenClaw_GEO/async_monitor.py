@@ -0,0 +1,76 @@
+import asyncio
+import concurrent.futures
+
+import provider_health
+import usage_ledger
+from api_client import AsyncGenericClient
+
+# Default number of questions in flight per provider
+DEFAULT_CONCURRENCY = 4
+
+
+class MonitorSummary:
+    def __init__(self):
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.skipped_providers = []
+
+
+async def run_units(providers, intent_questions, handle, concurrency=DEFAULT_CONCURRENCY, is_done=None):
+    """
+    Run every (provider, intent, question) unit concurrently, at most
+    `concurrency` in flight per provider.
+
+    `handle(client, platform, intent, question)` is a coroutine that does
+    the work for one unit with an AsyncGenericClient and returns True on
+    success. Units for which `is_done(platform, intent, question)` is true
+    (e.g. already checkpointed in a run manifest) are not scheduled. Units
+    of a provider whose circuit breaker is open are skipped without a
+    request; once its cool-down ends, the next unit probes it again. Once
+    the run's budget is used up, remaining units are skipped too.
+    """
+    summary = MonitorSummary()
+    # One worker thread per possible in-flight request
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(providers) * concurrency))
+    clients = {name: AsyncGenericClient(name, cfg, executor) for name, cfg in providers}
+    semaphores = {name: asyncio.Semaphore(concurrency) for name, _ in providers}
+
+    async def run_unit(platform, intent, question):
+        async with semaphores[platform]:
+            if usage_ledger.get_ledger().exhausted():
+                summary.skipped += 1
+                return
+            if not provider_health.is_available(platform):
+                summary.skipped += 1
+                if platform not in summary.skipped_providers:
+                    summary.skipped_providers.append(platform)
+                    print(f"⚠️ {platform} circuit is open, skipping its questions for now.")
+                return
+            try:
+                ok = await handle(clients[platform], platform, intent, question)
+            except Exception as e:
+                print(f"      ❌ [{platform}] Error: {e}")
+                ok = False
+            if ok:
+                summary.succeeded += 1
+            else:
+                summary.failed += 1
+
+    units = [
+        run_unit(name, intent, q)
+        for name, _ in providers
+        for intent, questions in intent_questions.items()
+        for q in questions
+        if not (is_done and is_done(name, intent, q))
+    ]
+    try:
+        await asyncio.gather(*units)
+    finally:
+        executor.shutdown(wait=True)
+    return summary
+
+
+def run(providers, intent_questions, handle, concurrency=DEFAULT_CONCURRENCY, is_done=None):
+    """Blocking entry point for scripts: runs `run_units` in a new event loop."""
+    return asyncio.run(run_units(providers, intent_questions, handle, concurrency, is_done))
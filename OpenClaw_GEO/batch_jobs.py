@@ -0,0 +1,410 @@
+import argparse
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import blob_store
+import enrichment
+import result_store
+import usage_ledger
+from api_client import GenericClient, configure_response_cache, get_pool, parse_enrichment_output
+
+# Offline enrichment: pending records are written to a JSONL file in the
+# OpenAI batch format, submitted through a provider adapter, and the
+# results merged back into the day files once the batch completes.
+JOBS_DIRNAME = enrichment.BATCH_JOBS_DIRNAME
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+DEFAULT_POLL_INTERVAL = 60
+# Where a submitter cannot be probed, a job still preparing after this long is recovered
+PREPARE_TIMEOUT = 6 * 3600
+
+# Batch states reported by the Batches API
+COMPLETED = "completed"
+FAILED_STATES = ("failed", "expired", "cancelled")
+# Local job states: saved (holding its records) before the batch is
+# created, submitted once it has a batch_id, merged when finished with
+PREPARING = "preparing"
+SUBMITTED = "submitted"
+MERGED = "merged"
+CLOSED_STATES = enrichment.BATCH_CLOSED_STATES
+
+
+def jobs_dir(data_dir):
+    path = os.path.join(data_dir, JOBS_DIRNAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class BatchAdapter:
+    """
+    How a batch input file reaches a provider and how its output comes
+    back. Subclasses implement submit(input_path, job_id) -> batch_id,
+    status(batch_id) -> (state, output_file_id) and download(file_id) ->
+    output JSONL text, and may implement find(job_id) -> batch_id or None
+    to recover the batch of a job whose submitter died before saving it.
+    `records_usage` is True when the adapter's requests already went
+    through GenericClient.chat, and so into the usage ledger.
+    """
+
+    records_usage = False
+
+    def __init__(self, provider_name, config, data_dir):
+        self.provider_name = provider_name
+        self.config = config
+        self.data_dir = data_dir
+
+    def submit(self, input_path, job_id):
+        raise NotImplementedError
+
+    def find(self, job_id):
+        return None
+
+    def status(self, batch_id):
+        raise NotImplementedError
+
+    def download(self, file_id):
+        raise NotImplementedError
+
+
+class OpenAIBatchAdapter(BatchAdapter):
+    """Files + Batches API of OpenAI-compatible providers, next to chat/completions."""
+
+    def __init__(self, provider_name, config, data_dir):
+        super().__init__(provider_name, config, data_dir)
+        client = GenericClient(provider_name, config)
+        self.api_key = client.api_key
+        self.pool = get_pool(client.endpoint)
+        # {base}/chat/completions -> {base}/files, {base}/batches
+        self.prefix = client.path.split('?')[0][:-len('/chat/completions')]
+
+    def _request(self, method, path, body=None, content_type="application/json"):
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        if body is not None:
+            headers["Content-Type"] = content_type
+        status, _, data = self.pool.request(method, self.prefix + path, body=body, headers=headers)
+        if status != 200:
+            raise RuntimeError(f"{self.provider_name} {method} {path}: HTTP {status} {data[:200]!r}")
+        return data
+
+    def submit(self, input_path, job_id):
+        boundary = uuid.uuid4().hex
+        with open(input_path, 'rb') as f:
+            content = f.read()
+        body = (f"--{boundary}\r\n"
+                f"Content-Disposition: form-data; name=\"purpose\"\r\n\r\nbatch\r\n"
+                f"--{boundary}\r\n"
+                f"Content-Disposition: form-data; name=\"file\"; filename=\"{os.path.basename(input_path)}\"\r\n"
+                f"Content-Type: application/jsonl\r\n\r\n").encode('utf-8') + content + f"\r\n--{boundary}--\r\n".encode('utf-8')
+        uploaded = json.loads(self._request("POST", "/files", body, f"multipart/form-data; boundary={boundary}"))
+        batch = json.loads(self._request("POST", "/batches", json.dumps({
+            "input_file_id": uploaded["id"],
+            "endpoint": BATCH_ENDPOINT,
+            "completion_window": COMPLETION_WINDOW,
+            "metadata": {"job_id": job_id}
+        }).encode('utf-8')))
+        return batch["id"]
+
+    def find(self, job_id):
+        batches = json.loads(self._request("GET", "/batches?limit=100")).get("data") or []
+        for batch in batches:
+            if (batch.get("metadata") or {}).get("job_id") == job_id:
+                return batch["id"]
+        return None
+
+    def status(self, batch_id):
+        batch = json.loads(self._request("GET", f"/batches/{batch_id}"))
+        return batch.get("status"), batch.get("output_file_id")
+
+    def download(self, file_id):
+        return self._request("GET", f"/files/{file_id}/content").decode('utf-8')
+
+
+class LocalBatchAdapter(BatchAdapter):
+    """
+    For providers without a Batches API: runs the input file through the
+    chat endpoint at submit time, one line after another, and keeps the
+    output next to the job in the batch output format. Jobs complete at once.
+    """
+
+    records_usage = True
+
+    def __init__(self, provider_name, config, data_dir):
+        super().__init__(provider_name, config, data_dir)
+        self.client = GenericClient(provider_name, config)
+
+    def _output_path(self, batch_id):
+        return os.path.join(jobs_dir(self.data_dir), f"{batch_id}_output.jsonl")
+
+    def submit(self, input_path, job_id):
+        batch_id = f"local-{job_id}"
+        tmp_path = self._output_path(batch_id) + ".tmp"
+        with open(input_path, 'r', encoding='utf-8') as src, open(tmp_path, 'w', encoding='utf-8') as out:
+            for line in src:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                body = request["body"]
+                response = self.client.chat(body["messages"], temperature=body.get("temperature", 1.0),
+                                            max_tokens=body.get("max_tokens"), call_type="enrich_batch")
+                entry = {"id": uuid.uuid4().hex, "custom_id": request["custom_id"], "response": None, "error": None}
+                if response is None:
+                    entry["error"] = {"message": "request failed"}
+                else:
+                    entry["response"] = {"status_code": 200, "body": {
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": response.get('content', '')}}]
+                    }}
+                out.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self._output_path(batch_id))
+        return batch_id
+
+    def find(self, job_id):
+        batch_id = f"local-{job_id}"
+        return batch_id if os.path.exists(self._output_path(batch_id)) else None
+
+    def status(self, batch_id):
+        if os.path.exists(self._output_path(batch_id)):
+            return COMPLETED, batch_id
+        return "failed", None
+
+    def download(self, file_id):
+        with open(self._output_path(file_id), 'r', encoding='utf-8') as f:
+            return f.read()
+
+
+# Adapters by name, chosen per provider with "batch_adapter" in its config
+ADAPTERS = {
+    "openai": OpenAIBatchAdapter,
+    "local": LocalBatchAdapter
+}
+DEFAULT_ADAPTER = "openai"
+
+
+def register_adapter(name, adapter_class):
+    """Make a BatchAdapter subclass available as "batch_adapter": name."""
+    ADAPTERS[name] = adapter_class
+
+
+def get_adapter(data_dir, config, provider, name=None):
+    p_config = config.get('providers', {}).get(provider) or {}
+    name = name or p_config.get('batch_adapter') or DEFAULT_ADAPTER
+    if name not in ADAPTERS:
+        raise ValueError(f"未知的批处理适配器: {name}")
+    return ADAPTERS[name](provider, p_config, data_dir)
+
+
+def _job_path(data_dir, job_id):
+    return os.path.join(jobs_dir(data_dir), f"{job_id}.json")
+
+
+def save_job(data_dir, job):
+    path = _job_path(data_dir, job["job_id"])
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(job, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+list_jobs = enrichment.list_batch_jobs
+in_flight_ids = enrichment.in_flight_ids
+
+
+def _submitter_alive(job):
+    pid = job.get("pid")
+    if not pid:
+        return False
+    if os.name == "nt":
+        # No signal-0 probe on Windows; give the submitter a generous window
+        age = datetime.now() - datetime.fromisoformat(job["created_at"])
+        return age < timedelta(seconds=PREPARE_TIMEOUT)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def submit_jobs(data_dir, config, provider=None, days=enrichment.DEFAULT_DAYS):
+    """
+    Write pending records not already in a batch to one batch file per
+    provider (each record goes to its own platform, or all to `provider`)
+    and submit them. Returns the new jobs.
+    """
+    clients = enrichment.build_clients(config, provider)
+    held = in_flight_ids(data_dir)
+    by_provider = {}
+    for day, record in enrichment.find_pending(data_dir, days):
+        rid = result_store.record_id(record)
+        name = provider or (record.get("platform") if record.get("platform") in clients else next(iter(clients), None))
+        if rid in held or name is None:
+            continue
+        by_provider.setdefault(name, []).append((day, rid, record))
+
+    jobs = []
+    for name, units in by_provider.items():
+        client = clients[name]
+        job_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{name}-{uuid.uuid4().hex[:6]}"
+        input_path = os.path.join(jobs_dir(data_dir), f"{job_id}_input.jsonl")
+        answers = [blob_store.get_field(data_dir, record, "answer") for _, _, record in units]
+        requests = {}
+        with open(input_path, 'w', encoding='utf-8') as f:
+            for n, batch in enumerate(client.plan_enrichment_batches(answers)):
+                custom_id = f"{job_id}-{n}"
+                items = [{"intent": units[i][2].get("intent"), "answer": answers[i],
+                          "competitors": units[i][2].get("competitors") or []} for i in batch]
+                f.write(json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT,
+                                    "body": client.enrich_batch_request(items)}, ensure_ascii=False) + "\n")
+                requests[custom_id] = [[units[i][0], units[i][1]] for i in batch]
+        adapter_name = config['providers'][name].get('batch_adapter') or DEFAULT_ADAPTER
+        # Saved first, so the online worker leaves these records alone while
+        # the batch is created (the local adapter runs it right here)
+        job = {
+            "job_id": job_id,
+            "provider": name,
+            "adapter": adapter_name,
+            "batch_id": None,
+            "status": PREPARING,
+            "pid": os.getpid(),
+            "created_at": datetime.now().isoformat(),
+            "records": len(units),
+            "requests": requests
+        }
+        save_job(data_dir, job)
+        try:
+            job["batch_id"] = get_adapter(data_dir, config, name, adapter_name).submit(input_path, job_id)
+            job["status"] = SUBMITTED
+        except Exception as e:
+            print(f"⚠️ {name} 批处理提交失败: {e}")
+            job["status"] = "failed"
+        job["updated_at"] = datetime.now().isoformat()
+        save_job(data_dir, job)
+        if job["status"] == SUBMITTED:
+            jobs.append(job)
+    return jobs
+
+
+def merge_output(data_dir, job, output, record_usage=True):
+    """
+    Apply a batch's output JSONL to the day files. Records whose request
+    failed or was not answered validly stay pending. Returns the number of
+    records updated.
+    """
+    provider = job["provider"]
+    usages = []
+    by_day = {}
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        units = job["requests"].get(entry.get("custom_id"))
+        response = entry.get("response") or {}
+        if not units or response.get("status_code") != 200:
+            continue
+        body = response.get("body") or {}
+        usage = body.get("usage") or {}
+        if record_usage and usage:
+            usages.append(usage)
+        try:
+            content = body["choices"][0]["message"]["content"] or ""
+        except (KeyError, IndexError, TypeError):
+            continue
+        for (day, rid), result in zip(units, parse_enrichment_output(content, len(units))):
+            if result is not None:
+                by_day.setdefault(day, {})[rid] = enrichment.make_patch(data_dir, provider, result["sources"],
+                                                                        result["strategy"])
+    merged = sum(enrichment.apply_patches(data_dir, day, patches) for day, patches in by_day.items())
+    # Only once every day is patched: a failed merge is retried by the next
+    # poll, which must not count the batch's tokens again
+    ledger = usage_ledger.get_ledger()
+    for usage in usages:
+        ledger.record(provider, "enrich_batch", usage.get("prompt_tokens"), usage.get("completion_tokens"))
+    return merged
+
+
+def poll_jobs(data_dir, config):
+    """
+    Check every unfinished job once; completed ones are merged. Returns
+    (merged_records, still_open_jobs).
+    """
+    merged = 0
+    still_open = 0
+    for job in list_jobs(data_dir):
+        if job.get("status") in CLOSED_STATES:
+            continue
+        try:
+            adapter = get_adapter(data_dir, config, job["provider"], job.get("adapter"))
+            if job.get("status") == PREPARING:
+                if _submitter_alive(job):
+                    still_open += 1
+                    continue
+                # The submitter died: adopt the batch if it got created, else release the records
+                job["batch_id"] = adapter.find(job["job_id"])
+                job["status"] = SUBMITTED if job["batch_id"] else "failed"
+                job["updated_at"] = datetime.now().isoformat()
+                save_job(data_dir, job)
+                if not job["batch_id"]:
+                    print(f"⚠️ 批处理任务 {job['job_id']} 未能提交，记录保留待补全")
+                    continue
+            state, output_file_id = adapter.status(job["batch_id"])
+            if state == COMPLETED and output_file_id:
+                count = merge_output(data_dir, job, adapter.download(output_file_id), not adapter.records_usage)
+                merged += count
+                job["merged_records"] = count
+                state = MERGED
+        except Exception as e:
+            print(f"⚠️ 批处理任务 {job['job_id']} 查询失败: {e}")
+            still_open += 1
+            continue
+        if state != job.get("status"):
+            job["status"] = state
+            job["updated_at"] = datetime.now().isoformat()
+            save_job(data_dir, job)
+        if state in FAILED_STATES:
+            print(f"⚠️ 批处理任务 {job['job_id']} 状态 {state}，记录保留待补全")
+        elif state not in CLOSED_STATES:
+            still_open += 1
+    usage_ledger.get_ledger().save()
+    return merged, still_open
+
+
+if __name__ == "__main__":
+    # Usage: python batch_jobs.py submit [--provider Kimi] [--days 7]
+    #        python batch_jobs.py poll [--wait] [--interval 60]
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(base_dir, "config.json"), 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    parser = argparse.ArgumentParser(description="以离线批处理方式补全待分析记录")
+    parser.add_argument('command', choices=["submit", "poll", "list"])
+    parser.add_argument('--provider', help="统一使用该平台做分析 (默认: 各记录所属平台)")
+    parser.add_argument('--days', type=int, help="扫描最近多少天的数据 (0 为全部)")
+    parser.add_argument('--wait', action='store_true', help="轮询直到所有批处理任务结束")
+    parser.add_argument('--interval', type=int, default=DEFAULT_POLL_INTERVAL, help="轮询间隔 (秒)")
+    args = parser.parse_args()
+
+    data_dir = result_store.data_dir_for(base_dir)
+    configure_response_cache(config.get('llm_cache'))
+    usage_ledger.get_ledger().start_run(f"batch-{datetime.now().strftime('%Y%m%d-%H%M%S')}", config)
+    if args.command == "submit":
+        days = enrichment.enrichment_options(config)["days"] if args.days is None else args.days
+        jobs = submit_jobs(data_dir, config, args.provider, days)
+        if not jobs:
+            print("ℹ️ 没有需要提交的待补全记录。")
+        for job in jobs:
+            print(f"📦 已提交 {job['job_id']}: {job['records']} 条记录 / {len(job['requests'])} 个请求 ({job['adapter']})")
+    elif args.command == "poll":
+        while True:
+            merged, still_open = poll_jobs(data_dir, config)
+            print(f"✅ 已合并 {merged} 条记录，{still_open} 个批处理任务进行中")
+            if not (args.wait and still_open):
+                break
+            time.sleep(args.interval)
+    else:
+        for job in list_jobs(data_dir):
+            print(f"{job['job_id']}  {job['status']:<10} {job['records']} 条  {job['adapter']}")
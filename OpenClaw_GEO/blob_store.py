@@ -0,0 +1,116 @@
+import functools
+import gzip
+import hashlib
+import json
+import os
+import time
+
+# Layout: data/blobs/<first 2 hex chars>/<sha256>.json.gz
+BLOB_DIRNAME = "blobs"
+
+# Bulky fields that move out of the record; the record keeps only
+# {"blobs": {field: sha256}} and all the small metadata fields.
+BLOB_FIELDS = ["answer", "reasoning", "geo_strategy", "sources_breakdown"]
+
+
+def blob_path(data_dir, key):
+    return os.path.join(data_dir, BLOB_DIRNAME, key[:2], f"{key}.json.gz")
+
+
+def put_value(data_dir, value):
+    """
+    Store a JSON-serialisable value and return its content hash. Identical
+    values (the same answer asked twice, repeated strategy text) are stored
+    once.
+    """
+    payload = json.dumps(value, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    key = hashlib.sha256(payload).hexdigest()
+    path = blob_path(data_dir, key)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        # mtime=0 keeps the gzip bytes deterministic for the same content
+        with gzip.GzipFile(tmp_path, 'wb', mtime=0) as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+    return key
+
+
+@functools.lru_cache(maxsize=512)
+def _read_blob(path):
+    with gzip.open(path, 'rb') as f:
+        return f.read().decode('utf-8')
+
+
+def get_value(data_dir, key):
+    """Load a stored value by hash; returns None if the blob is missing."""
+    path = blob_path(data_dir, key)
+    if not os.path.exists(path):
+        return None
+    return json.loads(_read_blob(path))
+
+
+def externalize(data_dir, record, fields=BLOB_FIELDS):
+    """Return a copy of `record` with non-empty bulky fields replaced by blob refs."""
+    record = dict(record)
+    refs = dict(record.get("blobs") or {})
+    for field in fields:
+        value = record.get(field)
+        if value in (None, "", [], {}):
+            continue
+        refs[field] = put_value(data_dir, value)
+        del record[field]
+    if refs:
+        record["blobs"] = refs
+    return record
+
+
+def get_field(data_dir, record, field):
+    """Value of a text field, inline or resolved from the blob store."""
+    if record.get(field) is not None:
+        return record[field]
+    key = (record.get("blobs") or {}).get(field)
+    return get_value(data_dir, key) if key else None
+
+
+def resolve(data_dir, record, fields=BLOB_FIELDS):
+    """Return a copy of `record` with the requested blob fields loaded inline."""
+    record = dict(record)
+    for field in fields:
+        if record.get(field) is None and field in (record.get("blobs") or {}):
+            record[field] = get_field(data_dir, record, field)
+    return record
+
+
+def has_field(record, field):
+    return record.get(field) is not None or field in (record.get("blobs") or {})
+
+
+def iter_blob_keys(data_dir):
+    root = os.path.join(data_dir, BLOB_DIRNAME)
+    if not os.path.exists(root):
+        return
+    for prefix in sorted(os.listdir(root)):
+        prefix_dir = os.path.join(root, prefix)
+        if not os.path.isdir(prefix_dir):
+            continue
+        for name in sorted(os.listdir(prefix_dir)):
+            if name.endswith(".json.gz"):
+                yield name[:-len(".json.gz")]
+
+
+def collect_garbage(data_dir, live_keys, min_age=3600):
+    """
+    Delete blobs not in `live_keys`. Returns the number of blobs removed.
+    Blobs younger than `min_age` seconds are kept: a writer stores the blob
+    before its record is committed, so a fresh blob may not be referenced yet.
+    """
+    removed = 0
+    now = time.time()
+    for key in list(iter_blob_keys(data_dir)):
+        path = blob_path(data_dir, key)
+        if key not in live_keys and now - os.path.getmtime(path) >= min_age:
+            os.remove(path)
+            removed += 1
+    _read_blob.cache_clear()
+    return removed
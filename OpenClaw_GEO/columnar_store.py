@@ -0,0 +1,292 @@
+import json
+import os
+import sys
+import uuid
+from urllib.parse import quote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import result_store
+import blob_store
+
+# Layout: data/columnar/day=YYYYMMDD/platform=<name>/part-<id>.parquet
+COLUMNAR_DIRNAME = "columnar"
+STATE_FILENAME = "_export_state.json"
+
+# Each export appends a part per touched partition; past this many, export merges them
+COMPACT_PARTS = 8
+
+# What the dashboards aggregate on; everything else is loaded on demand
+ANALYTICS_COLUMNS = ["platform", "intent", "is_mentioned", "competitors", "timestamp"]
+TEXT_COLUMNS = ["question", "answer", "reasoning", "geo_strategy", "sources_v2", "sources_breakdown", "blobs"]
+
+# Nested fields with a free-form shape are kept as JSON text
+JSON_COLUMNS = ["sources_v2", "sources_breakdown", "blobs"]
+
+RECORD_SCHEMA = pa.schema([
+    ("timestamp", pa.string()),
+    ("intent", pa.string()),
+    ("question", pa.string()),
+    ("answer", pa.string()),
+    ("reasoning", pa.string()),
+    ("geo_strategy", pa.string()),
+    ("is_mentioned", pa.bool_()),
+    ("mentioned_in_reasoning", pa.bool_()),
+    ("competitors", pa.list_(pa.string())),
+    ("sources", pa.list_(pa.string())),
+    ("sources_v2", pa.string()),
+    ("sources_breakdown", pa.string()),
+    ("answer_length", pa.int64()),
+    ("reasoning_length", pa.int64()),
+    ("blobs", pa.string()),
+])
+PARTITION_SCHEMA = pa.schema([("day", pa.string()), ("platform", pa.string())])
+DATASET_SCHEMA = pa.schema(list(RECORD_SCHEMA) + list(PARTITION_SCHEMA))
+
+
+def _str_list(value):
+    if not isinstance(value, list):
+        return None
+    return [str(v) for v in value if v is not None]
+
+
+def _to_row(record):
+    row = {}
+    for field in RECORD_SCHEMA:
+        value = record.get(field.name)
+        if field.name in JSON_COLUMNS:
+            value = None if value is None else json.dumps(value, ensure_ascii=False)
+        elif field.name in ("competitors", "sources"):
+            value = _str_list(value)
+        elif pa.types.is_boolean(field.type):
+            value = None if value is None else bool(value)
+        elif pa.types.is_integer(field.type):
+            value = value if isinstance(value, int) else None
+        elif value is not None and not isinstance(value, str):
+            value = str(value)
+        row[field.name] = value
+    return row
+
+
+def _decode(record):
+    for key in JSON_COLUMNS:
+        if record.get(key) is not None:
+            record[key] = json.loads(record[key])
+    return record
+
+
+class ColumnarStore:
+    """
+    Parquet copy of the day files, partitioned by day and platform, for the
+    analytics read path. Readers project columns and push filters down to
+    partition pruning and row-group statistics, so mention-rate views never
+    touch the answer/reasoning text.
+    """
+
+    def __init__(self, root, data_dir=None):
+        self.root = root
+        # Blob refs in the records resolve against the day files' directory
+        self.data_dir = data_dir or os.path.dirname(os.path.abspath(root))
+        self.state_path = os.path.join(root, STATE_FILENAME)
+
+    def _partition_dir(self, day, platform):
+        return os.path.join(self.root, f"day={day}", f"platform={quote(platform or '', safe='')}")
+
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {}
+
+    def _save_state(self, state):
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def _write_part(self, day, platform, rows):
+        part_dir = self._partition_dir(day, platform)
+        os.makedirs(part_dir, exist_ok=True)
+        table = pa.Table.from_pylist(rows, schema=RECORD_SCHEMA)
+        name = f"part-{uuid.uuid4().hex}.parquet"
+        # Write under a hidden name and rename, so readers never see half a file
+        tmp_path = os.path.join(part_dir, f".{name}.tmp")
+        pq.write_table(table, tmp_path, compression="zstd")
+        os.replace(tmp_path, os.path.join(part_dir, name))
+
+    def _drop_day(self, day):
+        day_dir = os.path.join(self.root, f"day={day}")
+        if not os.path.exists(day_dir):
+            return
+        for dirpath, _, filenames in os.walk(day_dir, topdown=False):
+            for name in filenames:
+                os.remove(os.path.join(dirpath, name))
+            os.rmdir(dirpath)
+
+    # --- Export ---
+
+    def export(self, data_dir):
+        """
+        Write new records from the day files as Parquet parts. Logs are
+        exported from their last offset; a changed legacy file re-exports its
+        whole day. Returns the number of records written.
+
+        Runs under a lock of its own in the columnar root (dashboards and
+        the bot export on every open), so concurrent exports never write
+        the same records twice; the state is read once the lock is held.
+        Partitions that grow past COMPACT_PARTS files are merged here too.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with result_store.locked(self.root):
+            return self._export(data_dir)
+
+    def _export(self, data_dir):
+        state = self._load_state()
+        paths = result_store.list_result_files(data_dir)
+        present = set(os.path.basename(p) for p in paths)
+        written = 0
+        touched = set()
+
+        # Days whose partitions no longer match their sources get rebuilt
+        stale_days = set()
+        for source in list(state):
+            if source not in present:
+                stale_days.add(result_store.file_day(source))
+        for path in paths:
+            source = os.path.basename(path)
+            prev = state.get(source)
+            st = os.stat(path)
+            if not prev:
+                continue
+            if result_store.is_appendable(path):
+                if not result_store.log_extends(path, prev["offset"], prev.get("sig"), st.st_size):
+                    stale_days.add(result_store.file_day(source))
+            elif prev["mtime"] != st.st_mtime or prev["size"] != st.st_size:
+                stale_days.add(result_store.file_day(source))
+        for day in stale_days:
+            self._drop_day(day)
+            for source in list(state):
+                if result_store.file_day(source) == day:
+                    del state[source]
+
+        for path in paths:
+            source = os.path.basename(path)
+            st = os.stat(path)
+            prev = state.get(source)
+            if prev and prev["mtime"] == st.st_mtime and prev["size"] == st.st_size:
+                continue
+            records, offset = self._read_new(path, prev, st)
+            by_platform = {}
+            for r in records:
+                by_platform.setdefault(r.get("platform") or "", []).append(_to_row(r))
+            day = result_store.file_day(source)
+            for platform, rows in by_platform.items():
+                self._write_part(day, platform, rows)
+                touched.add(self._partition_dir(day, platform))
+                written += len(rows)
+            state[source] = {"mtime": st.st_mtime, "size": st.st_size, "offset": offset}
+            if result_store.is_appendable(path):
+                state[source]["sig"] = result_store.log_signature(path, offset)
+
+        self._save_state(state)
+        for part_dir in touched:
+            self._merge_parts(part_dir, COMPACT_PARTS)
+        return written
+
+    def _read_new(self, path, prev, st):
+        if not result_store.is_appendable(path):
+            return result_store.load_file(path), st.st_size
+        return result_store.read_log_tail(path, prev["offset"] if prev else 0)
+
+    def compact(self, max_parts=1):
+        """Merge partitions holding more than `max_parts` files into one file."""
+        if not os.path.exists(self.root):
+            return 0
+        with result_store.locked(self.root):
+            return self._compact(max_parts)
+
+    def _compact(self, max_parts):
+        merged = 0
+        for dirpath, _, _ in os.walk(self.root):
+            merged += self._merge_parts(dirpath, max_parts)
+        return merged
+
+    def _merge_parts(self, part_dir, max_parts):
+        """Merge the parts in one partition directory if there are more than `max_parts`."""
+        parts = sorted(f for f in os.listdir(part_dir) if f.startswith("part-") and f.endswith(".parquet"))
+        if len(parts) <= max_parts:
+            return 0
+        paths = [os.path.join(part_dir, f) for f in parts]
+        table = pa.concat_tables([pq.read_table(p, schema=RECORD_SCHEMA) for p in paths])
+        name = f"part-{uuid.uuid4().hex}.parquet"
+        tmp_path = os.path.join(part_dir, f".{name}.tmp")
+        pq.write_table(table, tmp_path, compression="zstd")
+        os.replace(tmp_path, os.path.join(part_dir, name))
+        for p in paths:
+            os.remove(p)
+        return 1
+
+    # --- Read ---
+
+    def _filter_expr(self, filters):
+        expr = None
+        for key, value in filters.items():
+            if value is None:
+                continue
+            if key == "start_day":
+                cond = ds.field("day") >= value
+            elif key == "end_day":
+                cond = ds.field("day") <= value
+            elif key in ("day", "platform", "intent"):
+                cond = ds.field(key) == value
+            elif key == "is_mentioned":
+                cond = ds.field("is_mentioned") == bool(value)
+            else:
+                raise ValueError(f"Unknown filter: {key}")
+            expr = cond if expr is None else (expr & cond)
+        return expr
+
+    def read_table(self, columns=None, **filters):
+        """Arrow table of the projected columns for rows matching `filters`."""
+        columns = list(columns) if columns else DATASET_SCHEMA.names
+        if not os.path.exists(self.root):
+            return pa.table({c: pa.array([], type=DATASET_SCHEMA.field(c).type) for c in columns})
+        dataset = ds.dataset(
+            self.root, format="parquet", schema=DATASET_SCHEMA,
+            partitioning=ds.partitioning(PARTITION_SCHEMA, flavor="hive")
+        )
+        return dataset.to_table(columns=columns, filter=self._filter_expr(filters))
+
+    def read_records(self, columns=None, **filters):
+        return [_decode(r) for r in self.read_table(columns, **filters).to_pylist()]
+
+    def read_frame(self, columns=None, **filters):
+        # Go through Python lists so list columns stay lists (not ndarrays)
+        columns = list(columns) if columns else DATASET_SCHEMA.names
+        return pd.DataFrame(self.read_records(columns, **filters), columns=columns)
+
+    def load_text(self, columns=None, **filters):
+        """On-demand load of the bulky text columns (resolving blob refs) for a slice of records."""
+        columns = [c for c in (columns or TEXT_COLUMNS) if c != "blobs"]
+        records = self.read_records(["timestamp", "platform", "intent", "blobs"] + columns, **filters)
+        return [blob_store.resolve(self.data_dir, r, columns) for r in records]
+
+
+def open_columnar_store(data_dir, root=None):
+    """Open the Parquet store next to the day files and export new records."""
+    store = ColumnarStore(root or os.path.join(data_dir, COLUMNAR_DIRNAME), data_dir)
+    store.export(data_dir)
+    return store
+
+
+if __name__ == "__main__":
+    # Usage: python columnar_store.py [export|compact]
+    data_dir = result_store.data_dir_for(os.path.dirname(os.path.abspath(__file__)))
+    store = ColumnarStore(os.path.join(data_dir, COLUMNAR_DIRNAME))
+    if len(sys.argv) > 1 and sys.argv[1] == "compact":
+        print(f"✅ 已合并 {store.compact()} 个分区")
+    else:
+        print(f"✅ 已导出 {store.export(data_dir)} 条记录 -> {store.root}")
@@ -0,0 +1,377 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import threading
+from datetime import datetime
+
+import blob_store
+import result_store
+import rollups
+import usage_ledger
+from api_client import GenericClient, configure_response_cache
+
+# Stage 1 (collection) saves raw answers marked "enrichment": "pending";
+# stage 2 fills in sources_v2 / geo_strategy and marks them "done".
+PENDING = "pending"
+DONE = "done"
+
+DEFAULT_WORKERS = 4
+# Only recent days are scanned for pending records
+DEFAULT_DAYS = 7
+# Finished records buffered per day before its file is rewritten
+APPLY_BATCH = 20
+
+# Offline batch jobs (see batch_jobs.py) are kept here; records held by a
+# job that is not closed yet are left to it
+BATCH_JOBS_DIRNAME = "batch_jobs"
+BATCH_CLOSED_STATES = ("merged", "failed", "expired", "cancelled")
+
+
+def is_pending(record):
+    return record.get("enrichment") == PENDING
+
+
+def find_pending(data_dir, days=DEFAULT_DAYS):
+    """Yield (day, record) for pending records that still have their answer text."""
+    all_days = result_store.list_days(data_dir)
+    for day in (all_days[-days:] if days else all_days):
+        for record in result_store.iter_records(data_dir, day, day):
+            if is_pending(record) and blob_store.has_field(record, "answer"):
+                yield day, record
+
+
+def list_batch_jobs(data_dir):
+    """Every offline batch job, newest first."""
+    root = os.path.join(data_dir, BATCH_JOBS_DIRNAME)
+    if not os.path.isdir(root):
+        return []
+    jobs = []
+    for name in sorted(os.listdir(root), reverse=True):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(root, name), 'r', encoding='utf-8') as f:
+                jobs.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return jobs
+
+
+def in_flight_ids(data_dir):
+    """Record ids held by batch jobs that are not closed yet."""
+    ids = set()
+    for job in list_batch_jobs(data_dir):
+        if job.get("status") not in BATCH_CLOSED_STATES:
+            for units in job["requests"].values():
+                ids.update(rid for _, rid in units)
+    return ids
+
+
+def make_patch(data_dir, provider_name, sources, strategy):
+    """Patch for apply_patches from one record's enrichment results."""
+    return {
+        "sources_v2": sources or None,
+        "geo_strategy": blob_store.put_value(data_dir, strategy),
+        "enriched_by": provider_name
+    }
+
+
+def enrich_record(data_dir, client, record):
+    """Run the enrichment calls for one record; returns a patch, or None on failure."""
+    answer = blob_store.get_field(data_dir, record, "answer") or ""
+    sources = client.extract_structured_sources(answer)
+    strategy = client.analyze_geo_strategy(record.get("intent"), answer, record.get("competitors") or [])
+    if not strategy:
+        return None
+    return make_patch(data_dir, client.provider_name, sources, strategy)
+
+
+def _start(fn):
+    """
+    Run `fn()` on a daemon thread of its own and return a Future of it.
+    Hedged calls do not share a pool: they start at once (no queueing time
+    counted against the hedge delay) and never cap the enrichment workers.
+    """
+    future = concurrent.futures.Future()
+
+    def run():
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="hedge", daemon=True).start()
+    return future
+
+
+def hedged_call(primary, backup, delay, succeeded=lambda result: result is not None):
+    """
+    Run `primary()`; if it has not returned after `delay` seconds, also run
+    `backup()` and take whichever succeeds first. Returns (result, 0 or 1
+    for the call that produced it). The slower call is not cancelled (it
+    finishes in the background), so only hedge idempotent requests.
+    """
+    first = _start(primary)
+    try:
+        return first.result(timeout=delay), 0
+    except concurrent.futures.TimeoutError:
+        pass
+    futures = {first: 0, _start(backup): 1}
+    fallback = (None, 0)
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"      ⚠️ 补全分析失败: {e}")
+            continue
+        if succeeded(result):
+            return result, futures[future]
+        if fallback[0] is None:
+            fallback = (result, futures[future])
+    return fallback
+
+
+def enrich_batch(data_dir, client, records, hedge_client=None):
+    """
+    Enrich several records with one batched request. Records the reply
+    does not cover validly are retried one at a time. With `hedge_client`,
+    a request still running past the p95 latency of `client` is also sent
+    to the hedge provider and the first valid reply wins. Returns the
+    patches (aligned with `records`, None on failure), the number retried
+    and whether the hedge provider answered.
+    """
+    items = [{
+        "intent": record.get("intent"),
+        "answer": blob_store.get_field(data_dir, record, "answer") or "",
+        "competitors": record.get("competitors") or []
+    } for record in records]
+    delay = None
+    if hedge_client is not None and hedge_client.provider_name != client.provider_name and hedge_client.breaker.available():
+        delay = client.latency.percentile(client.provider_name, "enrich_batch", 0.95)
+    if delay is None:
+        results, winner = client.enrich_batch(items), client
+    else:
+        results, index = hedged_call(lambda: client.enrich_batch(items), lambda: hedge_client.enrich_batch(items), delay,
+                                     succeeded=lambda r: r is not None and any(x is not None for x in r))
+        results = results or [None] * len(items)
+        winner = (client, hedge_client)[index]
+    patches, retried = [], 0
+    for record, result in zip(records, results):
+        if result is not None:
+            patches.append(make_patch(data_dir, winner.provider_name, result["sources"], result["strategy"]))
+            continue
+        retried += 1
+        try:
+            patches.append(enrich_record(data_dir, winner, record))
+        except Exception as e:
+            print(f"      ⚠️ 补全分析失败: {e}")
+            patches.append(None)
+    return patches, retried, winner is not client
+
+
+def apply_patches(data_dir, day, patches):
+    """
+    Merge {record_id: patch} into the day's files. Each file is re-read and
+    atomically rewritten under the data directory lock, so records appended
+    by a concurrent collector are kept. Returns the number of records updated.
+    """
+    applied = 0
+    now = datetime.now().isoformat()
+    with result_store.locked(data_dir):
+        for path in result_store.list_result_files(data_dir):
+            if result_store.file_day(path) != day:
+                continue
+            records = result_store.load_file(path, use_cache=False)
+            changed = False
+            for record in records:
+                patch = patches.get(result_store.record_id(record))
+                if patch is None or not is_pending(record):
+                    continue
+                if patch["sources_v2"]:
+                    record["sources_v2"] = patch["sources_v2"]
+                record.pop("geo_strategy", None)
+                record["blobs"] = dict(record.get("blobs") or {}, geo_strategy=patch["geo_strategy"])
+                record["enrichment"] = DONE
+                record["enriched_by"] = patch["enriched_by"]
+                record["enriched_at"] = now
+                changed = True
+                applied += 1
+            if changed:
+                result_store.write_file(path, records)
+    # Media counts come from sources_v2; the rewritten log triggers a rebuild
+    rollups.update_day(data_dir, day)
+    return applied
+
+
+class EnrichmentWorker:
+    """
+    Stage 2 of a monitoring run: a thread pool that picks up pending records
+    and enriches them, independently of collection. Records are enriched by
+    the client of their own platform, or all by `provider` if given, several
+    per request in batches sized to that client's context window. Slow
+    batches can be hedged to `hedge_client` (see enrich_batch). Use
+    `run_once` for a single pass, or `start`/`finish` to run alongside a
+    collector.
+    """
+
+    def __init__(self, data_dir, clients, workers=DEFAULT_WORKERS, provider=None, days=DEFAULT_DAYS, hedge_client=None):
+        self.data_dir = data_dir
+        self.clients = clients
+        self.provider = provider
+        self.hedge_client = hedge_client
+        self.days = days
+        self.workers = workers
+        self.enriched = 0
+        self.failed = 0
+        # Batched requests sent, records that fell back to single calls, and
+        # batches answered by the hedge provider
+        self.batches = 0
+        self.retried = 0
+        self.hedged = 0
+        # Records tried in this session; failures are left pending for the next run
+        self._attempted = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _client_for(self, record):
+        if self.provider:
+            return self.clients.get(self.provider)
+        return self.clients.get(record.get("platform")) or next(iter(self.clients.values()), None)
+
+    def run_once(self):
+        """Enrich everything currently pending. Returns the number of records attempted."""
+        # Near the run's budget enrichment waits, leaving records pending
+        if not usage_ledger.get_ledger().allows("enrich_batch"):
+            return 0
+        # Records submitted to an offline batch are left to it
+        held = in_flight_ids(self.data_dir)
+        todo = []
+        for day, record in find_pending(self.data_dir, self.days):
+            rid = result_store.record_id(record)
+            client = self._client_for(record)
+            # Records of an unhealthy provider wait for a later pass
+            if rid in self._attempted or rid in held or client is None or not client.breaker.available():
+                continue
+            self._attempted.add(rid)
+            todo.append((day, rid, record))
+        if not todo:
+            return 0
+
+        # Batches are planned per client, from its context window
+        by_client = {}
+        for day, rid, record in todo:
+            by_client.setdefault(self._client_for(record), []).append((day, rid, record))
+
+        pending_patches = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {}
+            for client, units in by_client.items():
+                answers = [blob_store.get_field(self.data_dir, record, "answer") for _, _, record in units]
+                for batch in client.plan_enrichment_batches(answers):
+                    batch_units = [units[i] for i in batch]
+                    future = executor.submit(enrich_batch, self.data_dir, client, [record for _, _, record in batch_units],
+                                             self.hedge_client)
+                    futures[future] = batch_units
+            for future in concurrent.futures.as_completed(futures):
+                batch_units = futures[future]
+                self.batches += 1
+                try:
+                    patches, retried, hedged = future.result()
+                except Exception as e:
+                    print(f"      ⚠️ 补全分析失败: {e}")
+                    patches, retried, hedged = [None] * len(batch_units), 0, False
+                self.retried += retried
+                self.hedged += int(hedged)
+                for (day, rid, _), patch in zip(batch_units, patches):
+                    if patch is None:
+                        self.failed += 1
+                        continue
+                    day_patches = pending_patches.setdefault(day, {})
+                    day_patches[rid] = patch
+                    if len(day_patches) >= APPLY_BATCH:
+                        self.enriched += apply_patches(self.data_dir, day, pending_patches.pop(day))
+        for day, day_patches in pending_patches.items():
+            self.enriched += apply_patches(self.data_dir, day, day_patches)
+        return len(todo)
+
+    def _run(self, poll_interval):
+        while True:
+            try:
+                found = self.run_once()
+            except Exception as e:
+                print(f"      ⚠️ 补全任务异常: {e}")
+                found = 0
+            if self._stop.is_set() and found == 0:
+                return
+            if found == 0:
+                self._stop.wait(poll_interval)
+
+    def start(self, poll_interval=5):
+        """Keep enriching in a background thread until `finish` is called."""
+        self._thread = threading.Thread(target=self._run, args=(poll_interval,), name="EnrichmentWorker", daemon=True)
+        self._thread.start()
+        return self
+
+    def finish(self):
+        """
+        Stop polling once everything committed so far is enriched, and wait
+        for it. Flush the result writer first so the last answers are seen.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def build_clients(config, provider=None):
+    """GenericClients for every provider with an API key (or just `provider`)."""
+    clients = {}
+    for name, p_config in config.get('providers', {}).items():
+        if p_config.get('api_key') and (provider is None or name == provider):
+            clients[name] = GenericClient(name, p_config)
+    return clients
+
+
+def enrichment_options(config):
+    options = {"provider": None, "workers": DEFAULT_WORKERS, "days": DEFAULT_DAYS, "hedge_provider": None}
+    options.update({k: v for k, v in (config.get("enrichment") or {}).items() if v is not None})
+    return options
+
+
+def from_config(data_dir, config, provider=None, workers=None, days=None, hedge_provider=None):
+    """EnrichmentWorker set up from the "enrichment" config section; arguments override it."""
+    options = enrichment_options(config)
+    provider = provider or options["provider"]
+    hedge_provider = hedge_provider or options["hedge_provider"]
+    hedge_clients = build_clients(config, hedge_provider) if hedge_provider else {}
+    return EnrichmentWorker(data_dir, build_clients(config, provider),
+                            workers or options["workers"], provider,
+                            options["days"] if days is None else days,
+                            hedge_clients.get(hedge_provider))
+
+
+if __name__ == "__main__":
+    # Usage: python enrichment.py [--provider Kimi] [--workers 8] [--days 7] [--hedge-provider Deepseek]
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(base_dir, "config.json"), 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    parser = argparse.ArgumentParser(description="补全待分析记录的信源与 GEO 策略 (第二阶段)")
+    parser.add_argument('--provider', help="统一使用该平台做分析 (默认: 各记录所属平台)")
+    parser.add_argument('--workers', type=int, help="并行线程数")
+    parser.add_argument('--days', type=int, help="扫描最近多少天的数据 (0 为全部)")
+    parser.add_argument('--hedge-provider', help="分析请求超过 p95 延迟时，同时发给该平台，取先返回者")
+    args = parser.parse_args()
+
+    configure_response_cache(config.get('llm_cache'))
+    usage_ledger.get_ledger().start_run(f"enrichment-{datetime.now().strftime('%Y%m%d-%H%M%S')}", config)
+    worker = from_config(result_store.data_dir_for(base_dir), config, args.provider, args.workers, args.days,
+                         args.hedge_provider)
+    if not worker.clients:
+        print("❌ 没有可用的平台配置 (缺少 API Key)。")
+    else:
+        worker.run_once()
+        print(f"✅ 已补全 {worker.enriched} 条记录 ({worker.batches} 次批量请求，{worker.retried} 条单独重试，"
+              f"{worker.hedged} 次由备用平台先返回)，"
+              f"失败 {worker.failed} 条 (保留待下次补全)")
+        print(usage_ledger.format_run_usage())
@@ -0,0 +1,220 @@
+import re
+import threading
+from collections import deque
+
+try:
+    import ahocorasick  # pyahocorasick: the same automaton in C
+except ImportError:
+    ahocorasick = None
+
+# Entity kinds
+BRAND = "brand"
+COMPETITOR = "competitor"
+MEDIA = "media"
+DOMAIN = "domain"
+
+# The brand being monitored
+BRAND_NAME = "联想"
+
+# kind -> canonical name -> aliases. Matching ignores ASCII case; all-ASCII
+# aliases only match as whole words, where only letters make up words (so
+# "JD" does not hit "JDK", but "Xiaomi" still hits "Xiaomi14").
+DEFAULT_DICTIONARY = {
+    BRAND: {
+        "联想": ["联想", "Lenovo"]
+    },
+    COMPETITOR: {
+        "华为": ["华为", "Huawei"],
+        "小米": ["小米", "Xiaomi"],
+        "阿里": ["阿里", "Alibaba"],
+        "腾讯": ["腾讯", "Tencent"],
+        "百度": ["百度", "Baidu"],
+        "字节": ["字节", "ByteDance"],
+        "京东": ["京东", "JD"],
+        "海尔": ["海尔", "Haier"],
+        "美的": ["美的", "Midea"],
+        "比亚迪": ["比亚迪", "BYD"],
+        "大疆": ["大疆", "DJI"],
+        "宁德时代": ["宁德时代", "CATL"],
+        # Self, for comparison in the competitor stats
+        "联想": ["联想", "Lenovo"]
+    },
+    # Media named in the answer text
+    MEDIA: {name: [name] for name in ["36氪", "虎嗅", "财新", "澎湃", "界面", "晚点", "知乎", "维基百科"]},
+    # Media recognised from a cited URL; the first listed wins if several match
+    DOMAIN: {
+        "36氪": ["36kr.com"],
+        "虎嗅": ["huxiu.com"],
+        "新浪": ["sina.com"],
+        "网易": ["163.com"],
+        "搜狐": ["sohu.com"],
+        "财新": ["caixin.com"],
+        "澎湃": ["thepaper.cn"],
+        "界面": ["jiemian.com"],
+        "知乎": ["zhihu.com"],
+        "维基百科": ["wikipedia.org"]
+    }
+}
+
+OTHER_MEDIA = "其他媒体"
+URL_PATTERN = re.compile(r'(https?://[^\s\)]+)')
+
+
+def _fold(text):
+    """Lower-case ASCII letters only, so offsets in the folded text match the original."""
+    folded = text.lower()
+    if len(folded) == len(text):
+        return folded
+    return "".join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+
+def _is_word_char(c):
+    # Digits do not extend a word: model numbers follow brand names directly
+    return c.isascii() and c.isalpha()
+
+
+class EntityMatcher:
+    """
+    Aho-Corasick automaton over every alias in a dictionary ({kind: {name:
+    [aliases]}}): one pass over a text finds all hits, as (start, end, kind,
+    name, rank) with `rank` the entry's position in its kind. Build once and
+    share; scanning is thread-safe. Uses pyahocorasick when installed, else
+    an automaton in pure Python.
+    """
+
+    def __init__(self, dictionary=None):
+        # folded alias -> [(length, kind, name, rank, word_start, word_end)]
+        patterns = {}
+        for kind, entries in (dictionary or DEFAULT_DICTIONARY).items():
+            for rank, (name, aliases) in enumerate(entries.items()):
+                for alias in aliases:
+                    folded = _fold(alias)
+                    latin = alias.isascii()
+                    patterns.setdefault(folded, []).append(
+                        (len(folded), kind, name, rank, latin and _is_word_char(alias[0]), latin and _is_word_char(alias[-1])))
+        self._automaton = None
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for pattern, outputs in patterns.items():
+                self._automaton.add_word(pattern, outputs)
+            self._automaton.make_automaton()
+            return
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for pattern, outputs in patterns.items():
+            self._add(pattern, outputs)
+        self._build()
+
+    def _add(self, pattern, outputs):
+        state = 0
+        for c in pattern:
+            nxt = self._goto[state].get(c)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][c] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].extend(outputs)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and c not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(c, 0)
+                # Hits of the longest proper suffix are hits here too
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def scan(self, text):
+        """Every hit in `text`, in order of end offset."""
+        if not text:
+            return []
+        folded = _fold(text)
+        hits = []
+        for end, outputs in self._iter(folded):
+            for length, kind, name, rank, word_start, word_end in outputs:
+                start = end - length
+                if word_start and start > 0 and _is_word_char(folded[start - 1]):
+                    continue
+                if word_end and end < len(folded) and _is_word_char(folded[end]):
+                    continue
+                hits.append((start, end, kind, name, rank))
+        return hits
+
+    def _iter(self, folded):
+        """(end offset, outputs) for every position where some alias ends."""
+        if self._automaton is not None:
+            for last, outputs in self._automaton.iter(folded):
+                yield last + 1, outputs
+            return
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, c in enumerate(folded):
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            if out[state]:
+                yield i + 1, out[state]
+
+
+_MATCHER = None
+_MATCHER_LOCK = threading.Lock()
+
+
+def get_matcher():
+    """Process-wide matcher over DEFAULT_DICTIONARY, built on first use."""
+    global _MATCHER
+    with _MATCHER_LOCK:
+        if _MATCHER is None:
+            _MATCHER = EntityMatcher()
+        return _MATCHER
+
+
+def analyze(text, matcher=None):
+    """
+    Brand mention, competitors and cited media of a text from one scan.
+    Returns {"mentioned", "competitors" (in order of first appearance),
+    "sources" (sources_v2 entries: cited URLs first, then media only named
+    in the text), "hits"}.
+    """
+    text = text or ""
+    hits = (matcher or get_matcher()).scan(text)
+    competitors = []
+    media_named = {}
+    for start, end, kind, name, rank in hits:
+        if kind == COMPETITOR and name not in competitors:
+            competitors.append(name)
+        elif kind == MEDIA:
+            media_named.setdefault(name, rank)
+
+    sources = []
+    domains = sorted((start, end, name, rank) for start, end, kind, name, rank in hits if kind == DOMAIN)
+    for match in URL_PATTERN.finditer(text):
+        in_url = [(rank, name) for start, end, name, rank in domains if start >= match.start() and end <= match.end()]
+        sources.append({
+            "media": min(in_url)[1] if in_url else OTHER_MEDIA,
+            "url": match.group(1),
+            "title": "相关新闻/报告"
+        })
+    cited = set(s["media"] for s in sources)
+    for name in sorted(media_named, key=media_named.get):
+        if name not in cited:
+            sources.append({
+                "media": name,
+                "url": "参考回答文本",
+                "title": f"关于{name}的相关报道"
+            })
+
+    return {
+        "mentioned": any(kind == BRAND for _, _, kind, _, _ in hits),
+        "competitors": competitors,
+        "sources": sources,
+        "hits": hits
+    }
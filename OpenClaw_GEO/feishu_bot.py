@@ -4,12 +4,13 @@ from flask import Flask, request, jsonify
 from lark_oapi import Client, TokenState
 from lark_oapi.api.im.v1 import *
 import lark_oapi as lark
+import result_store
 from skills import SkillManager
 
 # --- Configuration ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CONFIG_PATH = os.path.join(BASE_DIR, "config.json")
-DATA_DIR = os.path.join(BASE_DIR, "data")
+DATA_DIR = result_store.data_dir_for(BASE_DIR)
 
 def load_config():
     with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
@@ -0,0 +1,169 @@
+import atexit
+import bisect
+import json
+import os
+import threading
+
+import result_store
+
+# Latency histograms per (provider, call type), kept next to the results (and
+# committed with them, like the usage ledger) so the next run, even from a
+# fresh checkout, starts with calibrated timeouts
+STATS_PATH = os.path.join(result_store.data_dir_for(os.path.dirname(os.path.abspath(__file__))), "latency_stats.json")
+
+# Log-spaced bucket bounds in seconds, 0.1s .. ~600s (+25% per bucket)
+BUCKET_BOUNDS = [round(0.1 * 1.25 ** i, 3) for i in range(40)]
+
+# Samples needed before a histogram is trusted for timeouts and hedging
+MIN_SAMPLES = 20
+# Once a histogram holds this many samples it is halved, so old runs fade out
+MAX_SAMPLES = 2000
+# New samples between saves (also saved at exit)
+SAVE_EVERY = 20
+
+DEFAULT_TIMEOUT = 120.0
+TIMEOUT_FLOOR = 30.0
+TIMEOUT_CEILING = 300.0
+# Head-room over the observed p99
+TIMEOUT_MARGIN = 1.5
+
+
+class LatencyHistogram:
+    def __init__(self, counts=None):
+        self.counts = list(counts) if counts else [0] * (len(BUCKET_BOUNDS) + 1)
+
+    @property
+    def total(self):
+        return sum(self.counts)
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self._trim()
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self._trim()
+
+    def _trim(self):
+        while self.total > MAX_SAMPLES:
+            self.counts = [c // 2 for c in self.counts]
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding quantile `q` (0-1), or None if empty."""
+        total = self.total
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else BUCKET_BOUNDS[-1]
+        return BUCKET_BOUNDS[-1]
+
+
+class LatencyStats:
+    """
+    Histograms of how long each (provider, call type) takes to answer:
+    time to first token for streamed calls, full latency otherwise. This is
+    what a socket timeout has to cover, so timeouts are derived from it.
+    Saves merge the samples taken since the last save into the file under
+    the data directory lock, so concurrent processes add up.
+    """
+
+    def __init__(self, path=None):
+        self.path = path = path or STATS_PATH
+        self._hists = self._load()
+        # Samples not yet in the file, per key
+        self._new = {}
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        hists = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                for key, counts in data.get("histograms", {}).items():
+                    if len(counts) == len(BUCKET_BOUNDS) + 1:
+                        hists[key] = LatencyHistogram(counts)
+            except (OSError, ValueError):
+                pass
+        return hists
+
+    @staticmethod
+    def _key(provider, call_type):
+        return f"{provider}/{call_type}"
+
+    def record(self, provider, call_type, seconds):
+        with self._lock:
+            key = self._key(provider, call_type)
+            self._hists.setdefault(key, LatencyHistogram()).add(seconds)
+            self._new.setdefault(key, LatencyHistogram()).add(seconds)
+            self._unsaved += 1
+            save = self._unsaved >= SAVE_EVERY
+        if save:
+            self.save()
+
+    def percentile(self, provider, call_type, q):
+        """Observed quantile in seconds, or None until MIN_SAMPLES are in."""
+        with self._lock:
+            hist = self._hists.get(self._key(provider, call_type))
+            if hist is None or hist.total < MIN_SAMPLES:
+                return None
+            return hist.percentile(q)
+
+    def timeout(self, provider, call_type):
+        """Socket timeout: p99 with head-room, within [TIMEOUT_FLOOR, TIMEOUT_CEILING]."""
+        p99 = self.percentile(provider, call_type, 0.99)
+        if p99 is None:
+            return DEFAULT_TIMEOUT
+        return min(TIMEOUT_CEILING, max(TIMEOUT_FLOOR, p99 * TIMEOUT_MARGIN))
+
+    def save(self):
+        with self._lock:
+            new, self._new = self._new, {}
+            self._unsaved = 0
+        if not new:
+            return
+        try:
+            with result_store.locked(os.path.dirname(self.path)):
+                hists = self._load()
+                for key, hist in new.items():
+                    hists.setdefault(key, LatencyHistogram()).merge(hist)
+                data = {"bounds": BUCKET_BOUNDS,
+                        "histograms": {key: hist.counts for key, hist in sorted(hists.items())}}
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"⚠️ 延迟统计保存失败: {e}")
+            return
+        with self._lock:
+            # Pick up what other processes saved, plus samples taken meanwhile
+            for key, hist in self._new.items():
+                hists.setdefault(key, LatencyHistogram()).merge(hist)
+            self._hists = hists
+
+    def summary(self):
+        """{key: {samples, p50, p95, p99}} for reporting."""
+        with self._lock:
+            hists = dict(self._hists)
+        return {key: {"samples": h.total, "p50": h.percentile(0.5), "p95": h.percentile(0.95), "p99": h.percentile(0.99)}
+                for key, h in sorted(hists.items())}
+
+
+_STATS = None
+_STATS_LOCK = threading.Lock()
+
+
+def get_latency_stats():
+    """Process-wide LatencyStats, loaded on first use and saved at exit."""
+    global _STATS
+    with _STATS_LOCK:
+        if _STATS is None:
+            _STATS = LatencyStats()
+            atexit.register(_STATS.save)
+        return _STATS
@@ -5,26 +5,41 @@ import datetime
 from datetime import timedelta
 import sys
 import time
+import argparse
+import functools
+import itertools
 import threading
 import concurrent.futures
-from api_client import GenericClient
+import uuid
+from api_client import GenericClient, format_pool_stats, format_cache_stats, configure_response_cache
 from check_network import run_diagnostics
 from analysis_engine import DeepInsightEngine
+import result_store
+import result_writer
+import rollups
+import blob_store
+import archive
+import run_manifest
+import provider_health
+import usage_ledger
+import question_bank
+import entity_matcher
 
 # Force unbuffered output for immediate feedback
 sys.stdout.reconfigure(line_buffering=True)
 
-# Global Lock for file writing to prevent race conditions
-FILE_LOCK = threading.Lock()
+# Global Lock for console output; result writes go through result_writer
 PRINT_LOCK = threading.Lock()
 
-import re
-from collections import Counter
-
 # Configuration Paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CONFIG_PATH = os.path.join(BASE_DIR, "config.json")
-DATA_DIR = os.path.join(BASE_DIR, "data")
+DATA_DIR = result_store.data_dir_for(BASE_DIR)
+
+# Parallel mode: pool size, and concurrent requests per provider unless the
+# provider config sets its own "max_in_flight"
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_IN_FLIGHT = 2
 
 def load_config():
     with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
@@ -34,111 +49,27 @@ def save_config(config):
     with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
         json.dump(config, f, ensure_ascii=False, indent=2)
 
-def extract_competitors(answer):
-    # Common Chinese tech companies/brands
-    competitors = [
-        "华为", "Huawei", "小米", "Xiaomi", "阿里", "Alibaba", 
-        "腾讯", "Tencent", "百度", "Baidu", "字节", "ByteDance",
-        "京东", "JD", "海尔", "Haier", "美的", "Midea",
-        "比亚迪", "BYD", "大疆", "DJI", "宁德时代", "CATL",
-        "联想", "Lenovo" # Include self for comparison
-    ]
-    found = []
-    for c in competitors:
-        if c in answer:
-            # Normalize english names to Chinese for stats
-            norm_name = c
-            if c in ["Huawei"]: norm_name = "华为"
-            if c in ["Xiaomi"]: norm_name = "小米"
-            if c in ["Alibaba"]: norm_name = "阿里"
-            if c in ["Tencent"]: norm_name = "腾讯"
-            if c in ["Baidu"]: norm_name = "百度"
-            if c in ["ByteDance"]: norm_name = "字节"
-            if c in ["JD"]: norm_name = "京东"
-            if c in ["Haier"]: norm_name = "海尔"
-            if c in ["Midea"]: norm_name = "美的"
-            if c in ["BYD"]: norm_name = "比亚迪"
-            if c in ["DJI"]: norm_name = "大疆"
-            if c in ["CATL"]: norm_name = "宁德时代"
-            if c in ["Lenovo"]: norm_name = "联想"
-            
-            found.append(norm_name)
-    return list(set(found))
-
-def extract_sources_v2(answer):
-    # 提取链接
-    urls = re.findall(r'(https?://[^\s\)]+)', answer)
-    
-    # 媒体名称映射
-    media_map = {
-        "36kr.com": "36氪",
-        "huxiu.com": "虎嗅",
-        "sina.com": "新浪",
-        "163.com": "网易",
-        "sohu.com": "搜狐",
-        "caixin.com": "财新",
-        "thepaper.cn": "澎湃",
-        "jiemian.com": "界面",
-        "zhihu.com": "知乎",
-        "wikipedia.org": "维基百科"
-    }
-    
-    sources = []
-    for url in urls:
-        media_name = "其他媒体"
-        for domain, name in media_map.items():
-            if domain in url:
-                media_name = name
-                break
-        
-        sources.append({
-            "media": media_name,
-            "url": url,
-            "title": "相关新闻/报告" 
-        })
-        
-    media_keywords = ["36氪", "虎嗅", "财新", "澎湃", "界面", "晚点", "知乎", "维基百科"]
-    for m in media_keywords:
-        if m in answer and not any(s['media'] == m for s in sources):
-            sources.append({
-                "media": m,
-                "url": "参考回答文本",
-                "title": f"关于{m}的相关报道"
-            })
-            
-    return sources
-
 def get_beijing_time():
     """Get current time in Beijing (UTC+8)"""
     return datetime.datetime.utcnow() + timedelta(hours=8)
 
-def save_result(intent_name, platform, question, result_obj, timestamp):
-    # Use Beijing time for filename
-    filename = f"{get_beijing_time().strftime('%Y%m%d')}_results.json"
-    filepath = os.path.join(DATA_DIR, filename)
+def save_result(intent_name, platform, question, result_obj, timestamp, on_commit=None):
+    # Use Beijing time for the day bucket
+    day = get_beijing_time().strftime('%Y%m%d')
     
     answer = result_obj.get('content', '')
     reasoning = result_obj.get('reasoning', '')
     
-    data = []
-    if os.path.exists(filepath):
-        with open(filepath, 'r', encoding='utf-8') as f:
-            try:
-                data = json.load(f)
-            except:
-                data = []
+    # Brand, competitors and media from one scan each of answer and reasoning
+    entities_answer = entity_matcher.analyze(answer)
+    entities_reasoning = entity_matcher.analyze(reasoning)
+    is_mentioned = entities_answer["mentioned"]
+    mentioned_in_reasoning = entities_reasoning["mentioned"]
     
-    # Check for Lenovo keywords in answer and reasoning
-    is_mentioned = "联想" in answer or "Lenovo" in answer or "lenovo" in answer
-    mentioned_in_reasoning = "联想" in reasoning or "Lenovo" in reasoning or "lenovo" in reasoning
+    all_competitors = list(dict.fromkeys(entities_answer["competitors"] + entities_reasoning["competitors"]))
     
-    # Extract competitors and sources from BOTH answer and reasoning
-    competitors_answer = extract_competitors(answer)
-    competitors_reasoning = extract_competitors(reasoning)
-    all_competitors = list(set(competitors_answer + competitors_reasoning))
-    
-    sources_answer = extract_sources_v2(answer)
-    sources_reasoning = extract_sources_v2(reasoning)
+    sources_answer = entities_answer["sources"]
+    sources_reasoning = entities_reasoning["sources"]
     # Combine source lists carefully (dictionaries cannot be put into set directly)
     # Strategy: Use URL as unique key
     seen_urls = set()
@@ -155,10 +86,12 @@ def save_result(intent_name, platform, question, result_obj, timestamp):
             seen_urls.add(key)
     
     record = {
+        "record_id": uuid.uuid4().hex,
         "timestamp": timestamp,
         "intent": intent_name,
         "platform": platform,
         "question": question,
+        "question_id": question_bank.question_id(question),
         "answer": answer,
         "reasoning": reasoning,
         "is_mentioned": is_mentioned,
@@ -173,31 +106,32 @@ def save_result(intent_name, platform, question, result_obj, timestamp):
         "answer_length": len(answer),
         "reasoning_length": len(reasoning)
     }
+    # Latency / TTFT / tokens per second, and whether a streamed answer was cut short
+    if result_obj.get('metrics'):
+        record["response_metrics"] = result_obj['metrics']
+    # Bulky text goes to the content-addressed blob store; the record keeps refs
+    record = blob_store.externalize(DATA_DIR, record)
     
-    data.append(record)
-    
-    with FILE_LOCK:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    result_writer.get_writer(DATA_DIR).write(record, day, on_commit=on_commit)
     
     return is_mentioned, mentioned_in_reasoning
 
 def generate_report():
-    # Find all result files
-    files = [f for f in os.listdir(DATA_DIR) if f.endswith('_results.json')]
-    all_records = []
-    for file in files:
-        with open(os.path.join(DATA_DIR, file), 'r', encoding='utf-8') as f:
-            all_records.extend(json.load(f))
+    # Make sure queued results are committed before reading the rollups
+    result_writer.get_writer(DATA_DIR).flush()
+    # Day rollups are caught up by streaming new records through the
+    # aggregators, so memory stays bounded however long the history gets
+    buckets = rollups.load_buckets(DATA_DIR)
+    overall = rollups.summarize(buckets)
             
-    if not all_records:
+    if not overall.total:
         print("\n⚠️  暂无数据，请先执行监测任务。")
         return
 
     # Calculate stats
-    total = len(all_records)
-    mentioned = sum(1 for r in all_records if r['is_mentioned'])
-    mentioned_cot = sum(1 for r in all_records if r.get('mentioned_in_reasoning') and not r['is_mentioned'])
+    total = overall.total
+    mentioned = overall.mentioned
+    mentioned_cot = overall.reasoning_only
     rate = (mentioned / total * 100) if total > 0 else 0
     
     print("\n" + "="*60)
@@ -213,14 +147,14 @@ def generate_report():
     all_providers = config.get('providers', {}).keys()
     
     # Existing data platforms
-    data_platforms = set(r['platform'] for r in all_records)
+    platform_stats = rollups.summarize(buckets, group_by='platform')
     
     # Merge and sort
-    platforms = sorted(list(set(list(all_providers) + list(data_platforms))))
+    platforms = sorted(list(set(list(all_providers) + list(platform_stats.keys()))))
     
     for p in platforms:
-        p_recs = [r for r in all_records if r['platform'] == p]
-        p_total = len(p_recs)
+        p_stats = platform_stats.get(p)
+        p_total = p_stats.total if p_stats else 0
         
         print(f"\n📱 平台: 【{p}】")
         
@@ -229,8 +163,8 @@ def generate_report():
              print("-" * 30)
              continue
         
-        p_ment = sum(1 for r in p_recs if r['is_mentioned'])
-        p_cot = sum(1 for r in p_recs if r.get('mentioned_in_reasoning') and not r['is_mentioned'])
+        p_ment = p_stats.mentioned
+        p_cot = p_stats.reasoning_only
         p_rate = (p_ment / p_total * 100)
         
         print(f"    - 提及率: {p_rate:.1f}% ({p_ment}/{p_total})")
@@ -239,28 +173,21 @@ def generate_report():
         print("-" * 30)
         
         # 1. Competitor Analysis for this platform
-        p_competitors = []
-        for r in p_recs:
-            if 'competitors' in r and isinstance(r['competitors'], list): p_competitors.extend(r['competitors'])
+        p_competitors = p_stats.competitors.most_common(5)
         
         print("  🔥 竞品/关联公司排行:")
         if p_competitors:
-            for name, count in Counter(p_competitors).most_common(5):
+            for name, count in p_competitors:
                 print(f"     - {name}: {count}")
         else:
             print("     (无数据)")
             
         # 2. Source Analysis for this platform
-        p_sources = []
-        for r in p_recs:
-            if 'sources_v2' in r and isinstance(r['sources_v2'], list):
-                p_sources.extend([s['media'] for s in r['sources_v2']])
-            elif 'sources' in r and isinstance(r['sources'], list):
-                p_sources.extend(r['sources'])
+        p_sources = p_stats.media.most_common(5)
             
         print("\n  📢 引用信源/媒体:")
         if p_sources:
-            for name, count in Counter(p_sources).most_common(5):
+            for name, count in p_sources:
                 print(f"     - {name}: {count}")
         else:
             print("     (无数据)")
@@ -269,25 +196,136 @@ def generate_report():
     
     # Global Source Recommendation
     print("\n🌟 优质信源推荐 (基于全平台引用权重)")
-    all_sources = []
-    for r in all_records:
-        if 'sources_v2' in r and isinstance(r['sources_v2'], list):
-            all_sources.extend([s['media'] for s in r['sources_v2']])
-        elif 'sources' in r and isinstance(r['sources'], list):
-            all_sources.extend(r['sources'])
-    
-    if all_sources:
-        top_sources = Counter(all_sources).most_common(5)
+    top_sources = overall.media.most_common(5)
+    
+    if top_sources:
         print("建议在以下高权重媒体增加内容投放：")
         for name, count in top_sources:
             print(f"  👉 {name} (被引用 {count} 次)")
     else:
         print("  (数据不足，暂无推荐)")
+    
+    # Cost of the latest run per provider, per answer collected (one mention-rate data point each)
+    latest_run = usage_ledger.latest_run_id(DATA_DIR)
+    if latest_run:
+        print(f"\n💰 成本 (最近一次任务 {latest_run}):")
+        for p, row in sorted(usage_ledger.run_costs(DATA_DIR, [latest_run]).items()):
+            per_point = f"¥{row['cost_per_point']:.4f}/条" if row['cost_per_point'] is not None else "-"
+            print(f"  - {p}: {row['tokens']} tokens / ¥{row['cost']:.2f} / {row['points']} 条数据 / 每个提及率数据点 {per_point}")
         
     print("="*60 + "\n")
 
-def run_auto_monitor_task():
+def log(message):
+    # Worker threads share the console; keep each line intact
+    with PRINT_LOCK:
+        print(message)
+
+def progress_printer():
+    """on_progress callback that redraws one console line, at most twice a second."""
+    state = {"last": 0.0, "shown": False}
+    def show(progress):
+        now = time.monotonic()
+        if now - state["last"] < 0.5:
+            return
+        state["last"] = now
+        state["shown"] = True
+        ttft = f" | 首字 {progress['ttft']:.1f}s" if progress['ttft'] is not None else ""
+        with PRINT_LOCK:
+            print(f"\r      ⏳ 已接收回答 {progress['content_chars']} 字 / 推理 {progress['reasoning_chars']} 字 | {progress['elapsed']:.1f}s{ttft}", end='', flush=True)
+    show.state = state
+    return show
+
+def ask_and_save(client, p_name, intent_label, q, manifest, prefix="", live=False, stop_after_chars=None):
+    """
+    Ask one question (with retries), save the answer and report the mention
+    status. With `live`, streamed answers show their progress on the console.
+    """
+    # Simple retry logic; pacing and 429/5xx backoff happen in the client's rate
+    # limiter, and retries stop as soon as the provider's circuit opens
+    result = None
+    for _ in range(3):
+        if not client.breaker.available():
+            break
+        progress = progress_printer() if live else None
+        result = client.chat([{"role": "user", "content": q}], on_progress=progress, stop_after_chars=stop_after_chars)
+        if progress and progress.state["shown"]:
+            log("")
+        if result:
+            break
+    
+    if not result:
+        log(f"   ❌  {prefix}提问失败，跳过。")
+        return False
+    
+    metrics = result.get('metrics') or {}
+    if metrics.get('streamed'):
+        speed = f" | {metrics['tokens_per_s']:.1f} tokens/s" if metrics.get('tokens_per_s') else ""
+        cut = " | 已提前截断" if metrics.get('truncated') else ""
+        ttft = f"{metrics['ttft']:.1f}s" if metrics.get('ttft') is not None else "-"
+        log(f"      {prefix}⏱️  首字 {ttft} | 总计 {metrics['latency']:.1f}s{speed}{cut}")
+        
+    timestamp = datetime.datetime.now().isoformat()
+    # Checkpoint the unit only once its record is on disk
+    mentioned, mentioned_in_cot = save_result(
+        intent_label, p_name, q, result, timestamp,
+        on_commit=functools.partial(manifest.mark_done, p_name, intent_label, q)
+    )
+    
+    if mentioned:
+        log(f"      {prefix}✅  发现提及！")
+    elif mentioned_in_cot:
+        log(f"      {prefix}🤔  仅在推理思考中提及 (未输出到结果)")
+    else:
+        log(f"      {prefix}❌  未提及")
+    return True
+
+def build_work_units(active_providers, intent_questions, manifest):
+    """
+    Pending (provider, intent, question) units, interleaved across providers
+    so that pool workers spread over all providers instead of queueing up
+    behind one provider's in-flight limit.
+    """
+    per_provider = [
+        [(p_name, intent_label, q) for intent_label, questions in intent_questions.items() for q in questions
+         if not manifest.is_done(p_name, intent_label, q)]
+        for p_name, _ in active_providers
+    ]
+    units = []
+    for batch in itertools.zip_longest(*per_provider):
+        units.extend(u for u in batch if u)
+    return units
+
+def run_units_parallel(active_providers, units, manifest, workers, stop_after_chars=None):
+    clients = {p_name: GenericClient(p_name, p_config) for p_name, p_config in active_providers}
+    # Per-provider cap on concurrent requests, independent of the pool size
+    limits = {
+        p_name: threading.BoundedSemaphore(max(1, int(p_config.get('max_in_flight', DEFAULT_MAX_IN_FLIGHT))))
+        for p_name, p_config in active_providers
+    }
+    
+    def work(n, unit):
+        p_name, intent_label, q = unit
+        with limits[p_name]:
+            if usage_ledger.get_ledger().exhausted():
+                return False
+            if not provider_health.is_available(p_name):
+                log(f"   ⛔ [{n}/{len(units)}] {p_name} 已熔断，跳过: {q}")
+                return False
+            log(f"   ➡️ [{n}/{len(units)}] {p_name} | {intent_label}: {q}")
+            return ask_and_save(clients[p_name], p_name, intent_label, q, manifest, prefix=f"[{p_name}] ",
+                                stop_after_chars=stop_after_chars)
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(work, n + 1, unit) for n, unit in enumerate(units)]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                log(f"   ❌  任务异常: {e}")
+
+def run_auto_monitor_task(resume=False, workers=DEFAULT_WORKERS, refresh_questions=False):
     config = load_config()
+    configure_response_cache(config.get('llm_cache'))
     providers = config.get('providers', {})
     intents = config['intents']
     
@@ -318,68 +356,86 @@ def run_auto_monitor_task():
         return
         
     save_config(config) # Save keys
+    platform_names = [p[0] for p in active_providers]
+    # Optional early stop of streamed answers once brand detection has enough text
+    stop_after_chars = config.get('monitoring', {}).get('stop_after_chars') or None
     
-    # 1. First, use Deepseek (or the first available robust model) to generate all questions
-    # We'll store them in a dictionary: {intent_label: [questions]}
-    print("\n" + "="*50)
-    print("🎨 正在统一生成监测问题集 (使用 Deepseek 保证质量)")
-    print("="*50)
-    
-    # Find a generator (prefer Deepseek)
-    generator_name = "Deepseek" if "Deepseek" in [p[0] for p in active_providers] else active_providers[0][0]
-    generator_config = next(p[1] for p in active_providers if p[0] == generator_name)
-    generator_client = GenericClient(generator_name, generator_config)
+    # Resume: reuse the question set of the unfinished run and skip committed units
+    manifest = run_manifest.find_resumable(DATA_DIR, kind='auto') if resume else None
+    if resume and not manifest:
+        print("ℹ️  没有可继续的未完成任务，将开始新的监测。")
     
-    intent_questions = {}
-    for intent in intents:
-        print(f"   ⏳ 正在为【{intent['label']}】生成问题...")
-        qs = generator_client.generate_questions(intent['label'], intent['keywords'], count=30)
-        if qs:
-            intent_questions[intent['label']] = qs
-            print(f"      ✅ 已生成 {len(qs)} 个问题")
-        else:
-            print(f"      ⚠️ 生成失败，将使用默认问题。")
-            intent_questions[intent['label']] = intent.get('questions', [])[:30]
-
-    # 2. Main Loop - Ask each platform the same set of questions
-    for p_name, p_config in active_providers:
-        print(f"\n" + "="*50)
-        print(f"📱 正在监测平台: {p_name}")
+    if manifest:
+        print(f"\n♻️  继续未完成的监测任务: {manifest.run_id} (已完成 {manifest.completed_count(platform_names)}/{manifest.total_units(platform_names)})")
+        intent_questions = manifest.intent_questions
+    else:
+        # 1. Question sets come from the bank; missing or expired ones are generated
+        # (by Deepseek or the first available robust model), all intents at once
+        print("\n" + "="*50)
+        print("🎨 正在准备监测问题集 (问题库中已有的直接复用)")
         print("="*50)
         
-        client = GenericClient(p_name, p_config)
+        generator_client = question_bank.generator_client(config, active_providers, default="Deepseek")
+        intent_questions, report = question_bank.get_question_sets(DATA_DIR, config, generator_client,
+                                                                   force=refresh_questions, intents=intents)
+        for label, info in report.items():
+            if info['status'] == question_bank.FALLBACK:
+                print(f"   ⚠️ 【{label}】生成失败，将使用默认问题。")
+            elif info['status'] == question_bank.GENERATED:
+                print(f"   ✅ 【{label}】已生成 {info['count']} 个问题 (v{info['version']})")
+            else:
+                print(f"   📚 【{label}】复用问题库 v{info['version']} ({info['count']} 个问题)")
         
-        for intent_label, questions in intent_questions.items():
-            print(f"\n📂 意图: {intent_label}")
+        manifest = run_manifest.RunManifest.create(DATA_DIR, 'auto', platform_names, intent_questions)
+
+    # Token usage of this run is attributed to it and checked against the budget
+    usage = usage_ledger.get_ledger()
+    usage.start_run(manifest.run_id, config)
+
+    # 2. Main Loop - Ask each platform the same set of questions
+    if workers > 1:
+        units = build_work_units(active_providers, intent_questions, manifest)
+        print(f"\n⚡️ 并行模式: {workers} 个线程，共 {len(units)} 个待提问任务")
+        run_units_parallel(active_providers, units, manifest, workers, stop_after_chars)
+    else:
+        for p_name, p_config in active_providers:
+            print(f"\n" + "="*50)
+            print(f"📱 正在监测平台: {p_name}")
+            print("="*50)
             
-            for idx, q in enumerate(questions):
-                print(f"   ➡️ 提问 ({idx+1}/{len(questions)}): {q}")
-                
-                # Simple retry logic
-                result = None
-                for _ in range(3):
-                    result = client.chat([{"role": "user", "content": q}])
-                    if result:
-                        break
-                    time.sleep(2)
-                
-                if not result:
-                    print("   ❌  提问失败，跳过。")
-                    continue
-                    
-                timestamp = datetime.datetime.now().isoformat()
-                mentioned, mentioned_in_cot = save_result(intent_label, p_name, q, result, timestamp)
+            client = GenericClient(p_name, p_config)
+            
+            for intent_label, questions in intent_questions.items():
+                print(f"\n📂 意图: {intent_label}")
                 
-                if mentioned:
-                    print("      ✅  发现提及！")
-                elif mentioned_in_cot:
-                     print("      🤔  仅在推理思考中提及 (未输出到结果)")
-                else:
-                    print("      ❌  未提及")
+                finished = sum(1 for q in questions if manifest.is_done(p_name, intent_label, q))
+                if finished:
+                    print(f"   ⏭️ 跳过已完成的 {finished} 个问题")
                 
-                time.sleep(0.5)
+                for idx, q in enumerate(questions):
+                    if manifest.is_done(p_name, intent_label, q):
+                        continue
+                    if usage.exhausted():
+                        break
+                    # Unhealthy platforms are skipped at once and probed again after the cool-down
+                    if not provider_health.is_available(p_name):
+                        print(f"   ⛔ {p_name} 已熔断，跳过 ({idx+1}/{len(questions)}): {q}")
+                        continue
+                    print(f"   ➡️ 提问 ({idx+1}/{len(questions)}): {q}")
+                    ask_and_save(client, p_name, intent_label, q, manifest, live=True, stop_after_chars=stop_after_chars)
             
-    print("\n🎉 所有平台任务执行完毕！正在生成深度分析报告...\n")
+    result_writer.get_writer(DATA_DIR).flush()
+    usage.finish_run({p: manifest.completed_count([p]) for p in platform_names})
+    if usage.exhausted():
+        print("\n💰  本次任务预算已用尽，已停止提问。")
+    if manifest.finish(platform_names) == 'completed':
+        print("\n🎉 所有平台任务执行完毕！正在生成深度分析报告...\n")
+    else:
+        print(f"\n⚠️  部分问题未成功 ({manifest.completed_count(platform_names)}/{manifest.total_units(platform_names)})，可稍后选择继续任务补齐。正在生成深度分析报告...\n")
+    print(format_pool_stats())
+    print(format_cache_stats())
+    print(provider_health.format_health_stats())
+    print(usage_ledger.format_run_usage(usage))
     generate_report()
 
 def update_api_keys():
@@ -457,7 +513,50 @@ def run_monitor_task():
             else:
                 print("❌  未提及。")
 
+def run_archive_task():
+    config = load_config()
+    options = archive.storage_options(config)
+    
+    print("\n🗄️  数据归档与保留策略")
+    print(f"   - 压缩 {options['compress_after_days']} 天前的数据文件 ({options['compression']})")
+    print(f"   - 删除 {options['retain_text_days']} 天前的回答/推理/策略原文 (保留汇总统计)")
+    
+    summary = archive.run_archive(DATA_DIR, options)
+    
+    print(f"✅  已清理原文: {summary['text_dropped']} 条记录")
+    print(f"✅  已压缩文件: {len(summary['compressed'])} 个")
+    for path in summary['compressed']:
+        print(f"     - {os.path.basename(path)}")
+    print(f"✅  已回收无引用文本块: {summary['blobs_removed']} 个")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="联想集团 GEO 优化系统 (OpenClaw Lite)")
+    parser.add_argument('command', nargs='?', choices=['monitor', 'archive'],
+                        help="直接执行指定任务后退出 (monitor: 全平台全自动监测; archive: 数据归档与保留策略)；不指定则进入交互菜单")
+    parser.add_argument('--resume', action='store_true',
+                        help="继续上次未完成的全自动监测 (复用问题集，跳过已完成的问题)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"全自动监测的并行线程数 (默认 {DEFAULT_WORKERS}；1 为逐个串行提问)")
+    parser.add_argument('--refresh-questions', action='store_true',
+                        help="重新生成问题集 (问题库新版本)，而不是复用已有问题")
+    return parser.parse_args()
+
+def ask_resume():
+    manifest = run_manifest.find_resumable(DATA_DIR, kind='auto')
+    if not manifest:
+        return False
+    print(f"\n♻️  检测到未完成的监测任务 {manifest.run_id} (已完成 {manifest.completed_count()}/{manifest.total_units()})")
+    return input("是否继续该任务? (Y/n): ").strip().lower() != 'n'
+
 def main():
+    args = parse_args()
+    if args.command == 'archive':
+        run_archive_task()
+        return
+    if args.command == 'monitor' or args.resume:
+        run_auto_monitor_task(resume=args.resume, workers=args.workers, refresh_questions=args.refresh_questions)
+        return
+    
     print("\n正在初始化系统，请稍候...", flush=True)
     while True:
         print("\n" + "#"*40)
@@ -469,12 +568,13 @@ def main():
         print("4. 🧠  深度洞察分析 (v2.3 新功能)")
         print("5. 🔍  网络环境诊断")
         print("6. 🔑  修改/设置 API Key")
-        print("7. ❌  退出")
+        print("7. 🗄️   数据归档与保留策略")
+        print("8. ❌  退出")
         
-        choice = input("\n请选择功能 (1-7): ")
+        choice = input("\n请选择功能 (1-8): ")
         
         if choice == '1':
-            run_auto_monitor_task()
+            run_auto_monitor_task(resume=ask_resume(), workers=args.workers, refresh_questions=args.refresh_questions)
         elif choice == '2':
             run_monitor_task()
         elif choice == '3':
@@ -487,6 +587,8 @@ def main():
         elif choice == '6':
             update_api_keys()
         elif choice == '7':
+            run_archive_task()
+        elif choice == '8':
             print("再见！")
             sys.exit(0)
         else:
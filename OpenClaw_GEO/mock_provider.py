@@ -0,0 +1,485 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from api_client import MOCK_PROVIDER_ENV, estimate_tokens, get_pool
+
+# Local OpenAI-compatible stand-in for the providers. Point the clients at
+# it with GEO_MOCK_PROVIDER=http://127.0.0.1:8765/v1 and run run_monitor.py,
+# main.py or the dashboard as usual. In record mode it forwards requests to
+# the real provider (found by model in config.json) and keeps the answers;
+# in replay mode it serves them back with simulated latency and failures.
+# Processes started with GEO_MOCK_PROVIDER set write to data/mock/run, not
+# to the real data directory.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CASSETTE_PATH = os.path.join(BASE_DIR, "data", "mock", "cassette.jsonl")
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# What to do with a request that has no recording: make up a plausible
+# answer, or fail it with HTTP 404
+MISS_SYNTHESIZE = "synthesize"
+MISS_ERROR = "error"
+
+SYNTH_BRANDS = ["联想", "华为", "小米", "戴尔", "惠普", "苹果"]
+SYNTH_MEDIA = ["36kr.com", "ithome.com", "zol.com.cn", "sina.com.cn", "163.com"]
+
+
+def request_key(model, messages, temperature):
+    raw = json.dumps([model, messages, temperature], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class Profile:
+    """
+    Simulated behaviour of one model. Latency (time to first token) is
+    log-normal around `latency` seconds; `error_rate`, `throttle_rate` and
+    `timeout_rate` are the shares of requests answered with HTTP 500,
+    HTTP 429 (with Retry-After) or no answer for `hang_seconds`. Streamed
+    answers arrive `chunk_chars` at a time every `chunk_interval` seconds.
+    """
+
+    FIELDS = ("latency", "latency_sigma", "error_rate", "throttle_rate", "timeout_rate", "hang_seconds",
+              "retry_after", "chunk_chars", "chunk_interval")
+
+    def __init__(self, latency=1.0, latency_sigma=0.5, error_rate=0.0, throttle_rate=0.0, timeout_rate=0.0,
+                 hang_seconds=600.0, retry_after=1.0, chunk_chars=20, chunk_interval=0.02):
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.retry_after = retry_after
+        self.chunk_chars = chunk_chars
+        self.chunk_interval = chunk_interval
+
+    @classmethod
+    def from_dict(cls, options, base=None):
+        values = {field: getattr(base or cls(), field) for field in cls.FIELDS}
+        values.update({k: v for k, v in (options or {}).items() if k in cls.FIELDS and v is not None})
+        return cls(**values)
+
+    def sample_latency(self, rng):
+        if self.latency <= 0:
+            return 0.0
+        return rng.lognormvariate(math.log(self.latency), self.latency_sigma)
+
+    def sample_outcome(self, rng):
+        """"ok", "error", "throttle" or "timeout"."""
+        roll = rng.random()
+        for outcome, rate in (("timeout", self.timeout_rate), ("throttle", self.throttle_rate),
+                              ("error", self.error_rate)):
+            if roll < rate:
+                return outcome
+            roll -= rate
+        return "ok"
+
+
+class Cassette:
+    """
+    Recorded answers, one JSON line per response, keyed on (model, messages,
+    temperature). A request recorded several times (answers at temperature
+    1.0 vary) is replayed round-robin.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or CASSETTE_PATH
+        self._entries = {}
+        self._next = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._entries.setdefault(entry["key"], []).append(entry)
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._entries.values())
+
+    def get(self, key):
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                return None
+            n = self._next.get(key, 0)
+            self._next[key] = n + 1
+            return entries[n % len(entries)]
+
+    def add(self, key, model, content, reasoning="", usage=None):
+        entry = {"key": key, "model": model, "content": content, "reasoning": reasoning or "", "usage": usage or {}}
+        with self._lock:
+            self._entries.setdefault(key, []).append(entry)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return entry
+
+
+def synthesize(messages, rng):
+    """A made-up answer shaped like what the calling method expects."""
+    prompt = messages[-1].get("content", "") if messages else ""
+    batch = re.search(r"下面有 (\d+) 条大模型回答", prompt)
+    if batch:
+        items = [{"index": i, "sources": [_synth_source(rng)], "strategy": "- 补充场景化评测内容\n- 提升权威媒体曝光"}
+                 for i in range(int(batch.group(1)))]
+        return json.dumps(items, ensure_ascii=False)
+    count = re.search(r"请生成 (\d+) 个搜索问题", prompt)
+    if count:
+        topic = re.search(r"【(.+?)】", prompt)
+        topic = topic.group(1) if topic else "这个领域"
+        return "\n".join(f"哪些公司在{topic}方面做得好？（角度 {rng.randint(1, 999)}）请附上参考链接"
+                         for _ in range(int(count.group(1))))
+    if "提取所有引用的信源" in prompt:
+        return json.dumps([_synth_source(rng) for _ in range(rng.randint(0, 3))], ensure_ascii=False)
+    if "GEO (生成式引擎优化) 专家" in prompt:
+        return "1. **原因分析**：缺少权威评测信源。\n2. **内容优化**：补充场景化关键词。\n3. **竞争占位**：突出差异化优势。"
+    brands = rng.sample(SYNTH_BRANDS, 3)
+    lines = [f"{i + 1}. **{brand}**：在该领域表现突出，产品与服务口碑较好。" for i, brand in enumerate(brands)]
+    lines.append("参考来源：")
+    lines.extend(f"- [{s['title']}]({s['url']})" for s in (_synth_source(rng) for _ in range(2)))
+    return "\n".join(lines)
+
+
+def _synth_source(rng):
+    media = rng.choice(SYNTH_MEDIA)
+    return {"title": f"行业报道 {rng.randint(1000, 9999)}", "url": f"https://www.{media}/article/{rng.randint(10000, 99999)}",
+            "media": media}
+
+
+class MockProvider:
+    """
+    The server state: cassette, per-model profiles and request counters.
+    With `upstreams` ({model: provider config}) it records: requests go to
+    the real provider and answers into the cassette, with no simulated
+    failures. Otherwise it replays, seeded by `seed` so runs repeat.
+    """
+
+    def __init__(self, cassette=None, profiles=None, default_profile=None, upstreams=None, seed=0,
+                 miss=MISS_SYNTHESIZE):
+        self.cassette = cassette if cassette is not None else Cassette()
+        self.default_profile = default_profile or Profile()
+        self.profiles = profiles or {}
+        self.upstreams = upstreams or {}
+        self.miss = miss
+        self.files = {}
+        self.batches = {}
+        self.counts = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def draw(self, profile):
+        """(outcome, latency) for one request, from the shared seeded generator."""
+        with self._lock:
+            return profile.sample_outcome(self._rng), profile.sample_latency(self._rng)
+
+    def profile_for(self, model):
+        return self.profiles.get(model, self.default_profile)
+
+    def answer(self, body):
+        """(content, reasoning, usage) for a chat request body, or None for a miss in strict mode."""
+        model = body.get("model", "")
+        messages = body.get("messages") or []
+        key = request_key(model, messages, body.get("temperature", 1.0))
+        if model in self.upstreams:
+            return self._record(key, body)
+        entry = self.cassette.get(key)
+        if entry is not None:
+            self.count("replayed")
+            return entry["content"], entry["reasoning"], entry["usage"]
+        if self.miss != MISS_SYNTHESIZE:
+            return None
+        self.count("synthesized")
+        with self._lock:
+            content = synthesize(messages, self._rng)
+        return content, "", {}
+
+    def _record(self, key, body):
+        config = self.upstreams[body["model"]]
+        base_url = config['base_url']
+        endpoint = base_url if base_url.endswith('/chat/completions') else f"{base_url.rstrip('/')}/chat/completions"
+        payload = dict(body, stream=False)
+        payload.pop("stream_options", None)
+        status, _, data = get_pool(endpoint).request(
+            "POST", urllib.parse.urlsplit(endpoint).path,
+            body=json.dumps(payload).encode('utf-8'),
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {config.get('api_key', '')}"})
+        if status != 200:
+            raise UpstreamError(status, data)
+        result = json.loads(data.decode('utf-8'))
+        message = result['choices'][0]['message']
+        self.count("recorded")
+        entry = self.cassette.add(key, body["model"], message.get('content') or '', message.get('reasoning_content') or '',
+                                  result.get('usage'))
+        return entry["content"], entry["reasoning"], entry["usage"]
+
+    def run_batch(self, input_file_id):
+        """Answer every line of an uploaded batch file; returns the output file id."""
+        lines = []
+        for line in self.files[input_file_id].decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            answer = self.answer(request["body"])
+            entry = {"id": uuid.uuid4().hex, "custom_id": request["custom_id"], "response": None, "error": None}
+            if answer is None:
+                entry["error"] = {"message": "no recording"}
+            else:
+                content, reasoning, usage = answer
+                entry["response"] = {"status_code": 200, "body": {
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+                    "usage": _usage(request["body"].get("messages") or [], content, usage)
+                }}
+            lines.append(json.dumps(entry, ensure_ascii=False))
+        file_id = f"file-{uuid.uuid4().hex[:12]}"
+        self.files[file_id] = ("\n".join(lines) + "\n").encode('utf-8')
+        return file_id
+
+    def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """Serve in a background thread; returns the base URL for GEO_MOCK_PROVIDER."""
+        self._server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://{host}:{self._server.server_port}/v1"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class UpstreamError(Exception):
+    def __init__(self, status, body):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.body = body
+
+
+def _usage(messages, content, recorded=None):
+    if recorded and recorded.get("prompt_tokens") is not None:
+        return recorded
+    prompt_tokens = estimate_tokens(messages)
+    completion_tokens = estimate_tokens([{"content": content}])
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+def _make_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status, obj, headers=None):
+            data = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+            self._send_bytes(status, data, "application/json", headers)
+
+        def _send_bytes(self, status, data, content_type, headers=None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _read_body(self):
+            return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        def do_GET(self):
+            path = self.path.split('?')[0]
+            if path.endswith("/batches"):
+                return self._send_json(200, {"object": "list", "data": list(mock.batches.values())[::-1]})
+            match = re.search(r"/batches/([^/]+)$", path)
+            if match and match.group(1) in mock.batches:
+                return self._send_json(200, mock.batches[match.group(1)])
+            match = re.search(r"/files/([^/]+)/content$", path)
+            if match and match.group(1) in mock.files:
+                return self._send_bytes(200, mock.files[match.group(1)], "application/jsonl")
+            if path.endswith("/stats"):
+                with mock._lock:
+                    return self._send_json(200, dict(mock.counts))
+            self._send_json(404, {"error": {"message": f"not found: {path}"}})
+
+        def do_POST(self):
+            path = self.path.split('?')[0]
+            raw = self._read_body()
+            if path.endswith("/chat/completions"):
+                return self._chat(json.loads(raw.decode('utf-8')))
+            if path.endswith("/files"):
+                return self._upload(raw)
+            if path.endswith("/batches"):
+                request = json.loads(raw.decode('utf-8'))
+                if request.get("input_file_id") not in mock.files:
+                    return self._send_json(400, {"error": {"message": "unknown input_file_id"}})
+                batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+                # Batches complete at once; pollers see "completed" on their first check
+                mock.batches[batch_id] = {"id": batch_id, "object": "batch", "endpoint": request.get("endpoint"),
+                                          "input_file_id": request["input_file_id"], "status": "completed",
+                                          "output_file_id": mock.run_batch(request["input_file_id"]),
+                                          "completion_window": request.get("completion_window"),
+                                          "metadata": request.get("metadata")}
+                mock.count("batches")
+                return self._send_json(200, mock.batches[batch_id])
+            self._send_json(404, {"error": {"message": f"not found: {path}"}})
+
+        def _upload(self, raw):
+            match = re.search(r"boundary=([^;]+)", self.headers.get("Content-Type", ""))
+            if not match:
+                return self._send_json(400, {"error": {"message": "expected multipart/form-data"}})
+            for part in raw.split(b"--" + match.group(1).strip('"').encode('utf-8')):
+                head, sep, content = part.partition(b"\r\n\r\n")
+                if sep and b'name="file"' in head:
+                    file_id = f"file-{uuid.uuid4().hex[:12]}"
+                    mock.files[file_id] = content[:-2] if content.endswith(b"\r\n") else content
+                    return self._send_json(200, {"id": file_id, "object": "file", "purpose": "batch",
+                                                 "bytes": len(mock.files[file_id])})
+            self._send_json(400, {"error": {"message": "no file part"}})
+
+        def _chat(self, body):
+            mock.count("requests")
+            model = body.get("model", "")
+            profile = mock.profile_for(model)
+            if model not in mock.upstreams:
+                outcome, latency = mock.draw(profile)
+                if outcome == "timeout":
+                    mock.count("timeouts")
+                    time.sleep(profile.hang_seconds)
+                    self.close_connection = True
+                    return
+                time.sleep(latency)
+                if outcome == "throttle":
+                    mock.count("throttled")
+                    return self._send_json(429, {"error": {"message": "rate limited (mock)"}},
+                                           {"Retry-After": str(profile.retry_after)})
+                if outcome == "error":
+                    mock.count("errors")
+                    return self._send_json(500, {"error": {"message": "server error (mock)"}})
+            try:
+                answer = mock.answer(body)
+            except UpstreamError as e:
+                mock.count("errors")
+                return self._send_bytes(e.status, e.body, "application/json")
+            except Exception as e:
+                mock.count("errors")
+                return self._send_json(502, {"error": {"message": f"upstream failed: {e}"}})
+            if answer is None:
+                mock.count("misses")
+                return self._send_json(404, {"error": {"message": "no recording for this request"}})
+            content, reasoning, usage = answer
+            usage = _usage(body.get("messages") or [], content, usage)
+            if body.get("stream"):
+                return self._stream(profile, content, reasoning, usage)
+            message = {"role": "assistant", "content": content}
+            if reasoning:
+                message["reasoning_content"] = reasoning
+            self._send_json(200, {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "object": "chat.completion",
+                                  "model": model, "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                                  "usage": usage})
+
+        def _stream(self, profile, content, reasoning, usage):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            size = max(1, int(profile.chunk_chars))
+            try:
+                for field, text in (("reasoning_content", reasoning), ("content", content)):
+                    for i in range(0, len(text), size):
+                        self._event({"choices": [{"index": 0, "delta": {field: text[i:i + size]}}]})
+                        if profile.chunk_interval:
+                            time.sleep(profile.chunk_interval)
+                self._event({"choices": [], "usage": usage})
+                self._chunk(b"data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # The client stopped reading early (stop_after_chars)
+                self.close_connection = True
+
+        def _event(self, obj):
+            self._chunk(f"data: {json.dumps(obj, ensure_ascii=False)}\n\n".encode('utf-8'))
+
+        def _chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+
+    return Handler
+
+
+def from_config(config, record=False, cassette_path=None, seed=None, miss=None, overrides=None):
+    """
+    MockProvider set up from the "mock" config section: "default" profile,
+    per-model "profiles", "seed" and "miss". `overrides` replace fields of
+    the default profile. In record mode every provider with an API key is
+    an upstream.
+    """
+    options = config.get("mock") or {}
+    default_profile = Profile.from_dict(overrides, Profile.from_dict(options.get("default")))
+    profiles = {model: Profile.from_dict(p, default_profile) for model, p in (options.get("profiles") or {}).items()}
+    upstreams = {}
+    if record:
+        for p_config in config.get("providers", {}).values():
+            if p_config.get("api_key") and p_config.get("model"):
+                upstreams[p_config["model"]] = p_config
+    return MockProvider(Cassette(cassette_path or options.get("cassette")), profiles, default_profile, upstreams,
+                        options.get("seed", 0) if seed is None else seed,
+                        miss or options.get("miss") or MISS_SYNTHESIZE)
+
+
+if __name__ == "__main__":
+    # Usage: python mock_provider.py replay [--port 8765] [--latency 1.0] [--error-rate 0.05] [--throttle-rate 0.05]
+    #        python mock_provider.py record [--port 8765]
+    # then, in another shell: GEO_MOCK_PROVIDER=http://127.0.0.1:8765/v1 python run_monitor.py
+    config_path = os.path.join(BASE_DIR, "config.json")
+    if not os.path.exists(config_path):
+        config_path = os.path.join(BASE_DIR, "config.example.json")
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    parser = argparse.ArgumentParser(description="本地模拟大模型平台 (录制 / 回放)")
+    parser.add_argument('mode', choices=["replay", "record"])
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--cassette', help=f"录制文件 (默认: {os.path.relpath(CASSETTE_PATH, BASE_DIR)})")
+    parser.add_argument('--seed', type=int, help="随机种子，相同种子的回放结果一致")
+    parser.add_argument('--strict', action='store_true', help="没有录制的请求返回 404，而不是生成模拟回答")
+    for field, help_text in (("latency", "首字延迟中位数 (秒)"), ("latency_sigma", "延迟对数正态分布的 sigma"),
+                             ("error_rate", "HTTP 500 比例"), ("throttle_rate", "HTTP 429 比例"),
+                             ("timeout_rate", "不响应 (超时) 比例"), ("hang_seconds", "超时请求挂起多久 (秒)")):
+        parser.add_argument('--' + field.replace('_', '-'), dest=field, type=float, help=help_text)
+    args = parser.parse_args()
+
+    # The recorder talks to the real providers itself
+    os.environ.pop(MOCK_PROVIDER_ENV, None)
+    overrides = {field: getattr(args, field) for field in Profile.FIELDS if getattr(args, field, None) is not None}
+    mock = from_config(config, args.mode == "record", args.cassette, args.seed,
+                       MISS_ERROR if args.strict else None, overrides)
+    if args.mode == "record" and not mock.upstreams:
+        print("❌ 录制模式需要至少一个配置了 API Key 的平台。")
+    else:
+        url = mock.start(args.host, args.port)
+        print(f"🧪 模拟平台已启动 ({args.mode}，已录制 {len(mock.cassette)} 条): {url}")
+        print(f"   在另一个终端运行: {MOCK_PROVIDER_ENV}={url} python run_monitor.py")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            mock.stop()
+            print(f"📊 请求统计: {json.dumps(mock.counts, ensure_ascii=False)}")
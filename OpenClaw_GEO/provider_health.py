@@ -0,0 +1,166 @@
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Rolling window of recent calls per provider
+WINDOW_SIZE = 20
+# Calls needed in the window before the error rate can trip the circuit
+MIN_CALLS = 5
+ERROR_RATE_THRESHOLD = 0.5
+# Failures in a row that trip the circuit regardless of the window
+MAX_CONSECUTIVE_FAILURES = 3
+# Cool-down before a probe request; doubled after each failed probe
+OPEN_SECONDS = 60.0
+MAX_OPEN_SECONDS = 600.0
+
+
+class CircuitBreaker:
+    """
+    Health of one provider. Closed: requests flow and outcomes go into a
+    rolling window. Open (after MAX_CONSECUTIVE_FAILURES in a row, or an
+    error rate over ERROR_RATE_THRESHOLD): requests are refused at once
+    until the cool-down ends. Half-open: a single probe request decides
+    whether to close again or stay open for a longer cool-down.
+
+    With "slow_call_seconds" in the provider config, successful calls slower
+    than that count as errors too.
+    """
+
+    def __init__(self, name, slow_call_seconds=None):
+        self.name = name
+        self.slow_call_seconds = float(slow_call_seconds) if slow_call_seconds else None
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.rejected = 0
+        self._window = deque(maxlen=WINDOW_SIZE)  # (ok, latency)
+        self._open_seconds = OPEN_SECONDS
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _cooled_down(self, now):
+        return now - self._opened_at >= self._open_seconds
+
+    def available(self):
+        """True if a request would be let through now. Does not take the probe slot."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return self._cooled_down(time.monotonic())
+            return not self._probing
+
+    def allow(self):
+        """Ask to send a request. In half-open state only one probe is let through."""
+        with self._lock:
+            if self.state == OPEN and self._cooled_down(time.monotonic()):
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def retry_in(self):
+        """Seconds until the next probe is allowed (0 if requests flow)."""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self._open_seconds - (time.monotonic() - self._opened_at))
+
+    def record_success(self, latency=None):
+        if self.slow_call_seconds and latency is not None and latency > self.slow_call_seconds:
+            self.record_failure(latency)
+            return
+        with self._lock:
+            if self.state == HALF_OPEN:
+                # The probe succeeded: start over with a clean window
+                self.state = CLOSED
+                self._probing = False
+                self._open_seconds = OPEN_SECONDS
+                self._window.clear()
+            self._window.append((True, latency))
+            self.consecutive_failures = 0
+
+    def record_failure(self, latency=None):
+        with self._lock:
+            self._window.append((False, latency))
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN:
+                # The probe failed: back off for longer
+                self._open_seconds = min(MAX_OPEN_SECONDS, self._open_seconds * 2)
+                self._trip()
+            elif self.state == CLOSED and (self.consecutive_failures >= MAX_CONSECUTIVE_FAILURES
+                                           or (len(self._window) >= MIN_CALLS
+                                               and self._error_rate() >= ERROR_RATE_THRESHOLD)):
+                self._trip()
+
+    def _trip(self):
+        self.state = OPEN
+        self.trips += 1
+        self._probing = False
+        self._opened_at = time.monotonic()
+        print(f"      ⛔ {self.name} 失败过多，熔断 {self._open_seconds:.0f}s 后再试探")
+
+    def _error_rate(self):
+        if not self._window:
+            return 0.0
+        return sum(1 for ok, _ in self._window if not ok) / len(self._window)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(lat for _, lat in self._window if lat is not None)
+            return {
+                "state": self.state,
+                "calls": len(self._window),
+                "error_rate": self._error_rate(),
+                "p50_latency": latencies[len(latencies) // 2] if latencies else None,
+                "max_latency": latencies[-1] if latencies else None,
+                "trips": self.trips,
+                "rejected": self.rejected
+            }
+
+
+_BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def get_breaker(provider_name, config=None):
+    """Process-wide breaker for a provider, shared by every client and loop."""
+    with _BREAKERS_LOCK:
+        breaker = _BREAKERS.get(provider_name)
+        if breaker is None:
+            breaker = _BREAKERS[provider_name] = CircuitBreaker(provider_name, (config or {}).get('slow_call_seconds'))
+        return breaker
+
+
+def is_available(provider_name):
+    """Whether work for a provider should be scheduled now."""
+    with _BREAKERS_LOCK:
+        breaker = _BREAKERS.get(provider_name)
+    return breaker is None or breaker.available()
+
+
+def health_stats():
+    with _BREAKERS_LOCK:
+        breakers = list(_BREAKERS.values())
+    return {b.name: b.stats() for b in breakers}
+
+
+def format_health_stats():
+    stats = health_stats()
+    if not stats:
+        return "🩺 平台健康: 暂无请求"
+    parts = []
+    for name, s in sorted(stats.items()):
+        p50 = f" / 中位延迟 {s['p50_latency']:.1f}s" if s['p50_latency'] is not None else ""
+        parts.append(f"{name} {s['state']} (错误率 {s['error_rate']:.0%}{p50} / 熔断 {s['trips']} 次 / 拒绝 {s['rejected']} 次)")
+    return "🩺 平台健康: " + "; ".join(parts)
@@ -0,0 +1,182 @@
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+import result_store
+from api_client import GenericClient, configure_response_cache
+
+# Generated question sets per intent, versioned, so runs reuse the same set
+# (comparable day to day) instead of regenerating it every time. The file is
+# committed with the results, like the usage ledger.
+BANK_FILENAME = "question_bank.json"
+DATA_DIR = result_store.data_dir_for(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_COUNT = 30
+# A set older than this is regenerated on the next run (0 = never, only on demand)
+DEFAULT_ROTATE_DAYS = 30
+# Versions kept per set; older ones are dropped
+DEFAULT_KEEP_VERSIONS = 5
+DEFAULT_WORKERS = 4
+
+# How a run got an intent's questions
+CACHED = "cached"
+GENERATED = "generated"
+FALLBACK = "fallback"
+
+
+def keywords_hash(keywords):
+    """Short hash of an intent's keywords; a set is only reused for the same keywords."""
+    raw = json.dumps(sorted(keywords or []), ensure_ascii=False)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:10]
+
+
+def question_id(question):
+    """Stable id of a question text, the same in every set and version that contains it."""
+    text = " ".join((question or "").split())
+    return "q" + hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+
+def bank_options(config):
+    options = {"count": DEFAULT_COUNT, "rotate_days": DEFAULT_ROTATE_DAYS, "keep_versions": DEFAULT_KEEP_VERSIONS,
+               "workers": DEFAULT_WORKERS, "generator": None}
+    options.update({k: v for k, v in ((config or {}).get("question_bank") or {}).items() if v is not None})
+    return options
+
+
+class QuestionBank:
+    """
+    data/question_bank.json: {intent: {keywords_hash: [version, ...]}}, each
+    version {"version", "created_at", "generated_by", "questions": [{"id",
+    "text"}]}. The newest version of the current keywords is what runs use.
+    Writes merge under the data directory lock.
+    """
+
+    def __init__(self, data_dir=None):
+        self.data_dir = data_dir = data_dir or DATA_DIR
+        self.path = os.path.join(data_dir, BANK_FILENAME)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f).get("sets", {})
+        except (OSError, ValueError):
+            return {}
+
+    def current(self, intent_label, keywords):
+        """Newest version of the intent's set for these keywords, or None."""
+        versions = self.load().get(intent_label, {}).get(keywords_hash(keywords)) or []
+        return versions[-1] if versions else None
+
+    def add_version(self, intent_label, keywords, questions, generated_by=None, keep_versions=DEFAULT_KEEP_VERSIONS):
+        """Store `questions` as the next version of the set; returns that version."""
+        with result_store.locked(self.data_dir):
+            sets = self.load()
+            versions = sets.setdefault(intent_label, {}).setdefault(keywords_hash(keywords), [])
+            version = {
+                "version": (versions[-1]["version"] + 1) if versions else 1,
+                "created_at": datetime.now().isoformat(),
+                "generated_by": generated_by,
+                "questions": [{"id": question_id(q), "text": q} for q in questions]
+            }
+            versions.append(version)
+            del versions[:-keep_versions]
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"sets": sets}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        return version
+
+
+def is_stale(version, rotate_days, now=None):
+    if version is None:
+        return True
+    if not rotate_days:
+        return False
+    created = datetime.fromisoformat(version["created_at"])
+    return (now or datetime.now()) - created >= timedelta(days=rotate_days)
+
+
+def get_question_sets(data_dir, config, client, force=False, intents=None):
+    """
+    Questions for every intent, from the bank where a current set exists.
+    Missing or stale sets (older than "rotate_days"), or all of them with
+    `force`, are generated with `client`, concurrently across intents. An
+    intent whose generation fails keeps its previous set, or falls back to
+    its configured questions without storing them.
+
+    Returns (intent_questions, report) where report is {intent: {"status":
+    cached / generated / fallback, "version", "count"}}.
+    """
+    options = bank_options(config)
+    bank = QuestionBank(data_dir)
+    intents = intents if intents is not None else config.get('intents', [])
+    current = {intent['label']: bank.current(intent['label'], intent.get('keywords')) for intent in intents}
+    todo = [intent for intent in intents if force or is_stale(current[intent['label']], options["rotate_days"])]
+
+    generated = {}
+    if todo and client is not None:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(options["workers"]))) as executor:
+            futures = {executor.submit(client.generate_questions, intent['label'], intent.get('keywords') or [],
+                                       count=options["count"]): intent for intent in todo}
+            for future in concurrent.futures.as_completed(futures):
+                intent = futures[future]
+                try:
+                    questions = future.result()
+                except Exception as e:
+                    print(f"      ⚠️ 【{intent['label']}】问题生成失败: {e}")
+                    questions = []
+                if questions:
+                    generated[intent['label']] = bank.add_version(intent['label'], intent.get('keywords'), questions,
+                                                                  client.provider_name, options["keep_versions"])
+
+    intent_questions = {}
+    report = {}
+    for intent in intents:
+        label = intent['label']
+        version = generated.get(label) or current[label]
+        if version is not None:
+            intent_questions[label] = [q["text"] for q in version["questions"]]
+            report[label] = {"status": GENERATED if label in generated else CACHED, "version": version["version"]}
+        else:
+            intent_questions[label] = intent.get('questions', [])[:options["count"]]
+            report[label] = {"status": FALLBACK, "version": None}
+        report[label]["count"] = len(intent_questions[label])
+    return intent_questions, report
+
+
+def generator_client(config, active_providers, default=None):
+    """Client for question generation: the "generator" provider (or `default`) if active, else the first one."""
+    preferred = bank_options(config)["generator"] or default
+    for name, p_config in active_providers:
+        if name == preferred:
+            return GenericClient(name, p_config)
+    name, p_config = active_providers[0]
+    return GenericClient(name, p_config)
+
+
+if __name__ == "__main__":
+    # Usage: python question_bank.py [--refresh] [--intent 笔记本]
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(base_dir, "config.json"), 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    parser = argparse.ArgumentParser(description="查看或更新监测问题库")
+    parser.add_argument('--refresh', action='store_true', help="强制重新生成问题集 (新版本)")
+    parser.add_argument('--intent', help="只处理该意图")
+    args = parser.parse_args()
+
+    configure_response_cache(config.get('llm_cache'))
+    intents = [i for i in config.get('intents', []) if args.intent is None or i['label'] == args.intent]
+    active = [(name, cfg) for name, cfg in config.get('providers', {}).items() if cfg.get('api_key')]
+    if args.refresh and not active:
+        print("❌ 没有可用的平台配置 (缺少 API Key)。")
+    else:
+        client = generator_client(config, active) if active else None
+        _, report = get_question_sets(DATA_DIR, config, client, args.refresh, intents)
+        for label, info in report.items():
+            version = f"v{info['version']}" if info['version'] else "默认问题"
+            print(f"【{label}】{version} / {info['count']} 个问题 ({info['status']})")
@@ -0,0 +1,306 @@
+import json
+import os
+import sqlite3
+import sys
+
+import result_store
+
+# Columns mirror the record dict written by save_result. List/dict fields are
+# stored as JSON text; unknown keys are kept in `extra` so records round-trip.
+SCALAR_FIELDS = [
+    "timestamp", "intent", "platform", "question", "answer", "reasoning",
+    "geo_strategy", "answer_length", "reasoning_length"
+]
+BOOL_FIELDS = ["is_mentioned", "mentioned_in_reasoning"]
+JSON_FIELDS = ["competitors", "sources", "sources_v2", "sources_breakdown"]
+RECORD_FIELDS = SCALAR_FIELDS + BOOL_FIELDS + JSON_FIELDS
+
+# Columns the dashboards need; excludes the bulky answer/reasoning bodies
+LIGHT_FIELDS = [
+    "timestamp", "intent", "platform", "question", "is_mentioned",
+    "mentioned_in_reasoning", "competitors", "sources", "sources_v2", "geo_strategy"
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    day TEXT NOT NULL,
+    timestamp TEXT,
+    intent TEXT,
+    platform TEXT,
+    question TEXT,
+    answer TEXT,
+    reasoning TEXT,
+    geo_strategy TEXT,
+    answer_length INTEGER,
+    reasoning_length INTEGER,
+    is_mentioned INTEGER,
+    mentioned_in_reasoning INTEGER,
+    competitors TEXT,
+    sources TEXT,
+    sources_v2 TEXT,
+    sources_breakdown TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_results_day ON results(day);
+CREATE INDEX IF NOT EXISTS idx_results_platform ON results(platform, day);
+CREATE INDEX IF NOT EXISTS idx_results_intent ON results(intent, day);
+CREATE INDEX IF NOT EXISTS idx_results_mentioned ON results(is_mentioned, day);
+CREATE INDEX IF NOT EXISTS idx_results_source ON results(source);
+CREATE TABLE IF NOT EXISTS ingested_files (
+    source TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER,
+    offset INTEGER,
+    sig TEXT
+);
+"""
+
+DB_FILENAME = "results.db"
+
+
+def _record_to_row(source, day, record):
+    row = {"source": source, "day": day}
+    for key in SCALAR_FIELDS:
+        row[key] = record.get(key)
+    for key in BOOL_FIELDS:
+        value = record.get(key)
+        row[key] = None if value is None else int(bool(value))
+    for key in JSON_FIELDS:
+        value = record.get(key)
+        row[key] = None if value is None else json.dumps(value, ensure_ascii=False)
+    extra = {k: v for k, v in record.items() if k not in RECORD_FIELDS}
+    row["extra"] = json.dumps(extra, ensure_ascii=False) if extra else None
+    return row
+
+
+def _row_to_record(row):
+    record = {}
+    keys = row.keys()
+    for key in keys:
+        value = row[key]
+        if key in BOOL_FIELDS:
+            record[key] = None if value is None else bool(value)
+        elif key in JSON_FIELDS:
+            record[key] = None if value is None else json.loads(value)
+        elif key == "extra":
+            if value:
+                record.update(json.loads(value))
+        elif key in ("id", "source"):
+            continue
+        else:
+            record[key] = value
+    return record
+
+
+class ResultDB:
+    """
+    SQLite index over the day files in DATA_DIR.
+
+    The day files stay the source of truth (they are what the daily workflow
+    commits); the database is a derived copy that `sync` keeps up to date by
+    importing only new or changed files, and only the appended tail of logs.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            # Databases created before log signatures were tracked
+            columns = [r["name"] for r in conn.execute("PRAGMA table_info(ingested_files)")]
+            if "sig" not in columns:
+                conn.execute("ALTER TABLE ingested_files ADD COLUMN sig TEXT")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # --- Import ---
+
+    def sync(self, data_dir):
+        """Import new/changed day files. Returns the number of records added."""
+        added = 0
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            known = {r["source"]: r for r in conn.execute("SELECT * FROM ingested_files")}
+            paths = result_store.list_result_files(data_dir)
+            present = set(os.path.basename(p) for p in paths)
+            for source in set(known) - present:
+                # File was removed or renamed; drop its rows
+                conn.execute("DELETE FROM results WHERE source = ?", (source,))
+                conn.execute("DELETE FROM ingested_files WHERE source = ?", (source,))
+            for path in paths:
+                source = os.path.basename(path)
+                st = os.stat(path)
+                prev = known.get(source)
+                if prev and prev["mtime"] == st.st_mtime and prev["size"] == st.st_size:
+                    continue
+                added += self._import_file(conn, path, source, prev, st)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return added
+
+    def _import_file(self, conn, path, source, prev, st):
+        day = result_store.file_day(source)
+        offset = 0
+        if result_store.is_appendable(path) and prev and result_store.log_extends(path, prev["offset"], prev["sig"], st.st_size):
+            # Append-only log: only parse what was written since last sync
+            offset = prev["offset"]
+        else:
+            conn.execute("DELETE FROM results WHERE source = ?", (source,))
+
+        if result_store.is_appendable(path):
+            records, offset = result_store.read_log_tail(path, offset)
+        else:
+            records = result_store.load_file(path)
+            offset = st.st_size
+
+        rows = [_record_to_row(source, day, r) for r in records]
+        if rows:
+            cols = list(rows[0].keys())
+            sql = f"INSERT INTO results ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)})"
+            conn.executemany(sql, [tuple(r[c] for c in cols) for r in rows])
+        sig = result_store.log_signature(path, offset) if result_store.is_appendable(path) else None
+        conn.execute(
+            "INSERT OR REPLACE INTO ingested_files (source, mtime, size, offset, sig) VALUES (?, ?, ?, ?, ?)",
+            (source, st.st_mtime, st.st_size, offset, sig)
+        )
+        return len(rows)
+
+    def rebuild(self, data_dir):
+        """Drop everything and re-import all day files."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM results")
+            conn.execute("DELETE FROM ingested_files")
+        return self.sync(data_dir)
+
+    # --- Queries ---
+
+    def _where(self, filters, extra=None):
+        clauses, params = list(extra or []), []
+        for key, value in filters.items():
+            if value is None:
+                continue
+            if key == "start_day":
+                clauses.append("day >= ?")
+            elif key == "end_day":
+                clauses.append("day <= ?")
+            elif key in ("day", "platform", "intent"):
+                clauses.append(f"{key} = ?")
+            elif key == "is_mentioned":
+                clauses.append("is_mentioned = ?")
+                value = int(bool(value))
+            else:
+                raise ValueError(f"Unknown filter: {key}")
+            params.append(value)
+        where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+        return where, params
+
+    def query(self, columns=None, order_by="timestamp", limit=None, **filters):
+        """
+        Return matching records as dicts. `columns` projects the result
+        (default: every column), e.g. LIGHT_FIELDS for dashboard use.
+        """
+        cols = ", ".join(columns) if columns else "*"
+        where, params = self._where(filters)
+        sql = f"SELECT {cols} FROM results{where}"
+        if order_by:
+            sql += f" ORDER BY {order_by}"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        with self._connect() as conn:
+            return [_row_to_record(r) for r in conn.execute(sql, params)]
+
+    def mention_stats(self, group_by=None, **filters):
+        """
+        Totals and mention counts, optionally grouped by 'platform', 'intent'
+        or 'day'. Each row: {group, total, mentioned, reasoning_only}.
+        """
+        if group_by not in (None, "platform", "intent", "day"):
+            raise ValueError(f"Unsupported group_by: {group_by}")
+        where, params = self._where(filters)
+        group_col = f"{group_by} AS grp, " if group_by else ""
+        sql = f"""
+            SELECT {group_col}COUNT(*) AS total,
+                   COALESCE(SUM(is_mentioned), 0) AS mentioned,
+                   COALESCE(SUM(CASE WHEN mentioned_in_reasoning = 1 AND is_mentioned = 0 THEN 1 ELSE 0 END), 0) AS reasoning_only
+            FROM results{where}
+        """
+        if group_by:
+            sql += " GROUP BY grp ORDER BY grp"
+        with self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        stats = [{
+            "group": r["grp"] if group_by else None,
+            "total": r["total"],
+            "mentioned": r["mentioned"],
+            "reasoning_only": r["reasoning_only"]
+        } for r in rows]
+        return stats if group_by else stats[0]
+
+    def top_competitors(self, limit=5, **filters):
+        where, params = self._where(filters, ["json_type(results.competitors) = 'array'"])
+        sql = f"""
+            SELECT j.value AS name, COUNT(*) AS cnt
+            FROM results, json_each(results.competitors) AS j{where}
+            GROUP BY name ORDER BY cnt DESC, name LIMIT ?
+        """
+        with self._connect() as conn:
+            return [(r["name"], r["cnt"]) for r in conn.execute(sql, params + [limit])]
+
+    def top_media(self, limit=5, **filters):
+        """Cited media counts, using sources_v2 and falling back to legacy `sources`."""
+        v2_where, params = self._where(filters, ["json_type(results.sources_v2) = 'array'"])
+        legacy_where, _ = self._where(filters, [
+            "json_type(results.sources) = 'array'",
+            "(results.sources_v2 IS NULL OR json_type(results.sources_v2) != 'array')"
+        ])
+        sql = f"""
+            SELECT name, COUNT(*) AS cnt FROM (
+                SELECT json_extract(j.value, '$.media') AS name
+                FROM results, json_each(results.sources_v2) AS j{v2_where}
+                UNION ALL
+                SELECT j.value AS name
+                FROM results, json_each(results.sources) AS j{legacy_where}
+            )
+            GROUP BY name ORDER BY cnt DESC, name LIMIT ?
+        """
+        with self._connect() as conn:
+            return [(r["name"], r["cnt"]) for r in conn.execute(sql, params + params + [limit])]
+
+    def distinct(self, column, **filters):
+        if column not in ("day", "platform", "intent"):
+            raise ValueError(f"Unsupported column: {column}")
+        where, params = self._where(filters)
+        with self._connect() as conn:
+            return [r[0] for r in conn.execute(f"SELECT DISTINCT {column} FROM results{where} ORDER BY {column}", params)]
+
+    def last_timestamp(self):
+        with self._connect() as conn:
+            row = conn.execute("SELECT MAX(timestamp) FROM results").fetchone()
+        return row[0] if row else None
+
+
+def open_result_db(data_dir, db_path=None):
+    """Open the store next to the day files and bring it up to date."""
+    db = ResultDB(db_path or os.path.join(data_dir, DB_FILENAME))
+    db.sync(data_dir)
+    return db
+
+
+if __name__ == "__main__":
+    # Usage: python result_db.py [import|rebuild]
+    data_dir = result_store.data_dir_for(os.path.dirname(os.path.abspath(__file__)))
+    db = ResultDB(os.path.join(data_dir, DB_FILENAME))
+    if len(sys.argv) > 1 and sys.argv[1] == "rebuild":
+        count = db.rebuild(data_dir)
+    else:
+        count = db.sync(data_dir)
+    print(f"✅ 已导入 {count} 条记录 -> {db.db_path}")
@@ -0,0 +1,403 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Day files are named YYYYMMDD_results.json (legacy pretty-printed array) or
+# YYYYMMDD_results.jsonl (append-only log, one record per line). Archived
+# days carry an extra .gz or .zst extension and are read transparently.
+LEGACY_SUFFIX = "_results.json"
+LOG_SUFFIX = "_results.jsonl"
+COMPRESSION_EXTS = {"gzip": ".gz", "zstd": ".zst"}
+RESULT_SUFFIXES = tuple(
+    base + ext for base in (LEGACY_SUFFIX, LOG_SUFFIX) for ext in [""] + list(COMPRESSION_EXTS.values())
+)
+
+# Shared by every process that writes into the data directory
+LOCK_FILENAME = ".results.lock"
+
+# Base URL of a mock_provider.py server. A process started with it set keeps
+# every store (day logs, ledger, question bank, latency stats, response cache)
+# under data/mock/run, so mock answers never reach the real data.
+MOCK_PROVIDER_ENV = "GEO_MOCK_PROVIDER"
+MOCK_DATA_DIR = os.path.join("mock", "run")
+
+# Bytes before a reader's offset that are fingerprinted to tell an append
+# from an in-place rewrite of a log
+SIGNATURE_BYTES = 256
+
+# Parsed day files, keyed by path and validated by (mtime, size). Live logs
+# that only grew are extended from the cached offset instead of re-parsed.
+CACHE_MAX_FILES = 64
+_CACHE = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+
+def is_result_file(filename):
+    return filename.endswith(RESULT_SUFFIXES)
+
+
+def compression_of(path):
+    """Return 'gzip', 'zstd' or None for a day file path."""
+    for codec, ext in COMPRESSION_EXTS.items():
+        if path.endswith(ext):
+            return codec
+    return None
+
+
+def strip_compression(path):
+    codec = compression_of(path)
+    return path[:-len(COMPRESSION_EXTS[codec])] if codec else path
+
+
+def is_log(path):
+    """True for line-delimited day files, compressed or not."""
+    return strip_compression(path).endswith(LOG_SUFFIX)
+
+
+def is_appendable(path):
+    """True for live (uncompressed) logs that can be read incrementally by offset."""
+    return path.endswith(LOG_SUFFIX)
+
+
+def open_text(path, mode='r', codec=None):
+    """
+    Open a day file for text I/O, transparently (de)compressing. The codec
+    defaults to the one implied by the file extension.
+    """
+    codec = codec or compression_of(path)
+    if codec == "gzip":
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError(f"读取 {os.path.basename(path)} 需要安装 zstandard (pip install zstandard)")
+        raw = open(path, mode + 'b')
+        if mode == 'r':
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        else:
+            stream = zstandard.ZstdCompressor(level=10).stream_writer(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def file_day(filename):
+    """Return the YYYYMMDD day bucket of a result file name."""
+    return os.path.basename(filename).split('_')[0]
+
+
+def record_id(record):
+    """
+    Stable identity of a record: its `record_id`, or for records saved
+    before ids existed a hash of when, where and what was asked.
+    """
+    if record.get("record_id"):
+        return record["record_id"]
+    key = "\t".join(str(record.get(k) or "") for k in ("timestamp", "platform", "intent", "question"))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def day_log_path(data_dir, day):
+    return os.path.join(data_dir, f"{day}{LOG_SUFFIX}")
+
+
+def list_result_files(data_dir):
+    """List result files (legacy and log), oldest day first."""
+    if not os.path.exists(data_dir):
+        return []
+    files = [f for f in os.listdir(data_dir) if is_result_file(f)]
+    files.sort()
+    return [os.path.join(data_dir, f) for f in files]
+
+
+def list_days(data_dir):
+    """Return the sorted list of days that have at least one result file."""
+    return sorted(set(file_day(p) for p in list_result_files(data_dir)))
+
+
+def load_file(path, use_cache=True):
+    """
+    Load records from a legacy array file or an append-only log. Cached
+    results are shared between callers and must be treated as read-only;
+    pass use_cache=False to get private copies that may be modified.
+    """
+    if not use_cache:
+        return _parse_file(path)
+    st = os.stat(path)
+    with _CACHE_LOCK:
+        entry = _CACHE.get(path)
+        if entry and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size:
+            _CACHE.move_to_end(path)
+            return list(entry["records"])
+    signature = ""
+    if is_appendable(path):
+        if entry and log_extends(path, entry["offset"], entry["signature"], st.st_size):
+            new_records, offset = read_log_tail(path, entry["offset"])
+            records = entry["records"] + new_records
+        else:
+            records, offset = read_log_tail(path, 0)
+        signature = log_signature(path, offset)
+    else:
+        records, offset = _parse_file(path), st.st_size
+    with _CACHE_LOCK:
+        _CACHE[path] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "offset": offset,
+                        "signature": signature, "records": records}
+        _CACHE.move_to_end(path)
+        while len(_CACHE) > CACHE_MAX_FILES:
+            _CACHE.popitem(last=False)
+    return list(records)
+
+
+def clear_cache():
+    with _CACHE_LOCK:
+        _CACHE.clear()
+
+
+def _parse_file(path):
+    records = []
+    with open_text(path) as f:
+        if is_log(path):
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # A torn last line from an interrupted writer; skip it
+                    continue
+        else:
+            try:
+                data = json.load(f)
+            except ValueError:
+                data = []
+            if isinstance(data, list):
+                records.extend(data)
+    return records
+
+
+def iter_log_tail(path, offset=0):
+    """
+    Yield (record, next_offset) for each complete line of a live log from
+    byte `offset`. next_offset points just past the line, so a consumer can
+    stop anywhere and resume from there later. record is None for blank or
+    unparsable lines, which still advance the offset.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for raw in f:
+            if not raw.endswith(b'\n'):
+                break  # Incomplete line from a writer still in progress
+            offset += len(raw)
+            line = raw.decode('utf-8').strip()
+            try:
+                record = json.loads(line) if line else None
+            except ValueError:
+                record = None
+            yield record, offset
+
+
+def log_signature(path, offset):
+    """
+    Fingerprint of the bytes just before `offset`. Appending to a log leaves
+    it unchanged; rewriting the log (enrichment, retention) shifts the
+    content and changes it. Unlike mtime or inode it survives a checkout.
+    """
+    if offset <= 0:
+        return ""
+    start = max(0, offset - SIGNATURE_BYTES)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(offset - start)
+    return hashlib.sha1(data).hexdigest()
+
+
+def log_extends(path, offset, signature, size=None):
+    """
+    True if a log was only appended to since it was read up to `offset`, so
+    an incremental reader may continue from there; False if it was
+    truncated or rewritten and must be read again from the start. Without a
+    recorded signature only truncation can be detected.
+    """
+    size = os.path.getsize(path) if size is None else size
+    if size < offset:
+        return False
+    return not signature or log_signature(path, offset) == signature
+
+
+def read_log_tail(path, offset=0):
+    """
+    Read complete lines of a log starting at byte `offset`. Returns the
+    records and the offset just past the last complete line, so callers can
+    resume from there later without re-parsing the start of the file.
+    """
+    records = []
+    for record, offset in iter_log_tail(path, offset):
+        if record is not None:
+            records.append(record)
+    return records, offset
+
+
+def iter_file(path):
+    """
+    Yield the records of one day file without materialising it. Logs are
+    read line by line; a legacy array file has to be parsed whole, but only
+    one such file is held at a time.
+    """
+    if not is_log(path):
+        for record in _parse_file(path):
+            yield record
+        return
+    with open_text(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def iter_records(data_dir, start_day=None, end_day=None):
+    """
+    Stream records of days in [start_day, end_day], oldest day first. Peak
+    memory is bounded by the largest legacy day file rather than by the
+    size of the history. Bypasses the parse cache.
+    """
+    for path in list_result_files(data_dir):
+        day = file_day(path)
+        if (start_day and day < start_day) or (end_day and day > end_day):
+            continue
+        for record in iter_file(path):
+            yield record
+
+
+def load_day(data_dir, day):
+    """Load all records of one day, from both the legacy file and the log."""
+    records = []
+    for path in list_result_files(data_dir):
+        if file_day(path) == day:
+            records.extend(load_file(path))
+    return records
+
+
+def load_records(data_dir, since_day=None):
+    """Load all records, optionally only from days >= since_day (YYYYMMDD)."""
+    return load_range(data_dir, start_day=since_day)
+
+
+def load_range(data_dir, start_day=None, end_day=None):
+    """Load records of days in [start_day, end_day] (inclusive, YYYYMMDD)."""
+    records = []
+    for path in list_result_files(data_dir):
+        day = file_day(path)
+        if (start_day and day < start_day) or (end_day and day > end_day):
+            continue
+        records.extend(load_file(path))
+    return records
+
+
+def load_latest(data_dir, n_days=1):
+    """Load records of the latest `n_days` days that have data."""
+    days = list_days(data_dir)[-n_days:]
+    return load_range(data_dir, start_day=days[0]) if days else []
+
+
+def latest_timestamp(data_dir):
+    """Newest record timestamp, looking only at the latest day."""
+    timestamps = [r.get('timestamp') for r in load_latest(data_dir) if r.get('timestamp')]
+    return max(timestamps) if timestamps else None
+
+
+def write_file(path, records):
+    """
+    Atomically (re)write a whole day file in the format its name implies:
+    array or log, compressed or not. Readers see either the old or the new
+    file, never a partial one.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open_text(tmp_path, 'w', codec=compression_of(path)) as f:
+        if is_log(path):
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        else:
+            json.dump(records, f, ensure_ascii=False, indent=2)
+    with open(tmp_path, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def data_dir_for(base_dir):
+    """The data directory under `base_dir`: data/, or data/mock/run in a mock run."""
+    data_dir = os.path.join(base_dir, "data")
+    if os.environ.get(MOCK_PROVIDER_ENV):
+        return os.path.join(data_dir, MOCK_DATA_DIR)
+    return data_dir
+
+
+class locked:
+    """
+    Exclusive OS-level lock on the data directory (flock, or msvcrt on
+    Windows). Serialises writers across threads *and* processes: the
+    Streamlit runner, run_monitor.py under cron and the CLI. Not re-entrant.
+    """
+
+    def __init__(self, data_dir):
+        self.path = os.path.join(data_dir, LOCK_FILENAME)
+        self._f = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._f = open(self.path, 'a+')
+        if fcntl:
+            fcntl.flock(self._f.fileno(), fcntl.LOCK_EX)
+        else:
+            self._f.seek(0)
+            msvcrt.locking(self._f.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if fcntl:
+                fcntl.flock(self._f.fileno(), fcntl.LOCK_UN)
+            else:
+                self._f.seek(0)
+                msvcrt.locking(self._f.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._f.close()
+            self._f = None
+
+
+def append_lines(data_dir, day, lines, sync=True):
+    """
+    Append already-serialised lines to the day's log in one write, under the
+    directory lock, with a single fsync for the whole batch.
+    """
+    with locked(data_dir):
+        with open(day_log_path(data_dir, day), 'a', encoding='utf-8') as f:
+            f.write(''.join(lines))
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+
+
+def append_record(data_dir, record, day):
+    """
+    Append one record to the day's log. Each write is a single line that is
+    flushed immediately, so the cost per record no longer grows with the day.
+    """
+    append_lines(data_dir, day, [json.dumps(record, ensure_ascii=False) + '\n'], sync=False)
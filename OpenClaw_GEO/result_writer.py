@@ -0,0 +1,240 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+
+import result_store
+import rollups
+
+_STOP = object()
+_FLUSH = object()
+
+# A day whose append fails is retried this many times, with exponential
+# backoff, before its lines are spilled to data/recovery/<day>.jsonl
+RETRY_ATTEMPTS = 3
+RETRY_BASE = 0.5
+RECOVERY_DIRNAME = "recovery"
+
+
+def recovery_path(data_dir, day):
+    return os.path.join(data_dir, RECOVERY_DIRNAME, f"{day}.jsonl")
+
+
+def spill_lines(data_dir, day, lines):
+    """Append lines that could not reach the day log to its recovery file."""
+    path = recovery_path(data_dir, day)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Under the lock, so a replay in another process never removes it mid-write
+    with result_store.locked(data_dir):
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(''.join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def replay_recovery(data_dir):
+    """
+    Move spilled lines into their day logs, each file in one locked append
+    that also removes it, so a line is never written twice. Returns the
+    days that got lines back.
+    """
+    root = os.path.join(data_dir, RECOVERY_DIRNAME)
+    if not os.path.isdir(root):
+        return []
+    days = []
+    for name in sorted(os.listdir(root)):
+        if not name.endswith(".jsonl"):
+            continue
+        day = name[:-len(".jsonl")]
+        path = os.path.join(root, name)
+        with result_store.locked(data_dir):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = f.read()
+            # Only whole lines; a torn last line from a crash mid-spill is dropped
+            data = data[:data.rfind('\n') + 1]
+            if data:
+                with open(result_store.day_log_path(data_dir, day), 'a', encoding='utf-8') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.remove(path)
+        if data:
+            days.append(day)
+    return days
+
+
+class ResultWriter:
+    """
+    Single writer for the day logs of one data directory.
+
+    Producers (monitor threads, the Streamlit runner) call `write`, which
+    only enqueues. A background thread drains the queue in batches and
+    group-commits each batch: one locked append and one fsync per day file,
+    then one rollup catch-up. The directory lock makes this safe against
+    other processes writing the same day file at the same time.
+
+    A failed append is retried per day (days already appended are not
+    written again); lines that still fail are spilled to a recovery file
+    and moved into the day log by the next writer that starts or commits.
+    """
+
+    def __init__(self, data_dir, batch_size=50, flush_interval=0.2):
+        self.data_dir = data_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.batches_committed = 0
+        self.records_committed = 0
+        self._queue = queue.Queue()
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._error = None
+        self._replay()
+        self._thread = threading.Thread(target=self._run, name="ResultWriter", daemon=True)
+        self._thread.start()
+
+    def write(self, record, day, on_commit=None):
+        """
+        Queue a record. `on_commit`, if given, is called on the writer
+        thread once the record is durably on disk (e.g. to checkpoint a run).
+        """
+        self._raise_error()
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._cond:
+            self._pending += 1
+        self._queue.put((day, line, on_commit))
+
+    def flush(self, timeout=None):
+        """Commit everything written so far and wait until it is on disk."""
+        self._queue.put(_FLUSH)
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending == 0, timeout=timeout)
+        self._raise_error()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [] if item is _FLUSH else [item]
+            if item is not _FLUSH:
+                # Gather whatever else arrives shortly, up to batch_size
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        nxt = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if nxt is _FLUSH:
+                        break
+                    if nxt is _STOP:
+                        stop = True
+                        break
+                    batch.append(nxt)
+            if batch:
+                self._commit(batch)
+
+    def _replay(self):
+        try:
+            days = replay_recovery(self.data_dir)
+        except Exception as e:
+            print(f"      ⚠️ 恢复未写入的结果失败: {e}")
+            return
+        for day in days:
+            self._update_rollup(day)
+
+    def _update_rollup(self, day):
+        try:
+            rollups.update_day(self.data_dir, day)
+        except Exception as e:
+            # Records are safe on disk; the rollup catches up on next read
+            print(f"      ⚠️ 汇总更新失败: {e}")
+
+    def _append(self, by_day):
+        """Append each day's lines, retrying failed days; returns {day: error} for those that never made it."""
+        failed = {}
+        for attempt in range(RETRY_ATTEMPTS):
+            if attempt:
+                time.sleep(RETRY_BASE * (2 ** (attempt - 1)))
+            for day in [d for d in by_day if attempt == 0 or d in failed]:
+                try:
+                    result_store.append_lines(self.data_dir, day, by_day[day], sync=True)
+                    failed.pop(day, None)
+                except Exception as e:
+                    failed[day] = e
+            if not failed:
+                break
+        return failed
+
+    def _commit(self, batch):
+        if os.path.isdir(os.path.join(self.data_dir, RECOVERY_DIRNAME)):
+            self._replay()
+        by_day = {}
+        for day, line, _ in batch:
+            by_day.setdefault(day, []).append(line)
+        try:
+            failed = self._append(by_day)
+            lost = set()
+            for day, error in failed.items():
+                try:
+                    spill_lines(self.data_dir, day, by_day[day])
+                    print(f"      ⚠️ 写入 {day} 结果失败 ({error})，{len(by_day[day])} 条已暂存待恢复")
+                except Exception as e:
+                    print(f"      ❌ 写入结果失败: {error}; 暂存也失败: {e}")
+                    self._error = error
+                    lost.add(day)
+            # Spilled records are durable too, so their runs can checkpoint them
+            self.batches_committed += 1
+            self.records_committed += sum(1 for day, _, _ in batch if day not in lost)
+            for day, _, on_commit in batch:
+                if on_commit is None or day in lost:
+                    continue
+                try:
+                    on_commit()
+                except Exception as e:
+                    print(f"      ⚠️ 进度记录失败: {e}")
+            for day in by_day:
+                if day not in failed:
+                    self._update_rollup(day)
+        finally:
+            with self._cond:
+                self._pending -= len(batch)
+                self._cond.notify_all()
+
+
+_WRITERS = {}
+_WRITERS_LOCK = threading.Lock()
+
+
+def get_writer(data_dir):
+    """Process-wide writer for `data_dir`; flushed and closed at interpreter exit."""
+    with _WRITERS_LOCK:
+        writer = _WRITERS.get(data_dir)
+        if writer is None:
+            writer = _WRITERS[data_dir] = ResultWriter(data_dir)
+        return writer
+
+
+@atexit.register
+def _close_all():
+    for writer in list(_WRITERS.values()):
+        try:
+            writer.close()
+        except Exception as e:
+            print(f"❌ 结果写入器关闭失败: {e}")
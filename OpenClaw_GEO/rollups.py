@@ -0,0 +1,246 @@
+import json
+import os
+import threading
+from collections import Counter
+
+import result_store
+
+# One small file per day, next to the day files: YYYYMMDD_rollup.json
+ROLLUP_SUFFIX = "_rollup.json"
+
+_LOCK = threading.Lock()
+
+
+def record_media(record):
+    """Cited media of a record: sources_v2 when present, else legacy `sources`."""
+    if isinstance(record.get('sources_v2'), list):
+        return [s.get('media') for s in record['sources_v2'] if isinstance(s, dict)]
+    if isinstance(record.get('sources'), list):
+        return list(record['sources'])
+    return []
+
+
+class RollupCounter:
+    """Counters for one (day, platform, intent) bucket, or a merge of several."""
+
+    def __init__(self):
+        self.total = 0
+        self.mentioned = 0
+        self.reasoning_only = 0
+        self.competitors = Counter()
+        self.media = Counter()
+
+    def add_record(self, record):
+        self.total += 1
+        if record.get('is_mentioned'):
+            self.mentioned += 1
+        elif record.get('mentioned_in_reasoning'):
+            self.reasoning_only += 1
+        if isinstance(record.get('competitors'), list):
+            self.competitors.update(record['competitors'])
+        self.media.update(m for m in record_media(record) if m is not None)
+
+    def merge(self, other):
+        self.total += other.total
+        self.mentioned += other.mentioned
+        self.reasoning_only += other.reasoning_only
+        self.competitors.update(other.competitors)
+        self.media.update(other.media)
+        return self
+
+    @property
+    def mention_rate(self):
+        return (self.mentioned / self.total * 100) if self.total else 0
+
+    def to_dict(self):
+        return {
+            "total": self.total,
+            "mentioned": self.mentioned,
+            "reasoning_only": self.reasoning_only,
+            "competitors": dict(self.competitors),
+            "media": dict(self.media)
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        counter = cls()
+        counter.total = data.get("total", 0)
+        counter.mentioned = data.get("mentioned", 0)
+        counter.reasoning_only = data.get("reasoning_only", 0)
+        counter.competitors = Counter(data.get("competitors", {}))
+        counter.media = Counter(data.get("media", {}))
+        return counter
+
+
+def rollup_path(data_dir, day):
+    return os.path.join(data_dir, f"{day}{ROLLUP_SUFFIX}")
+
+
+def _load_rollup(data_dir, day):
+    path = rollup_path(data_dir, day)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            try:
+                return json.load(f)
+            except ValueError:
+                pass
+    return {"day": day, "sources": {}, "buckets": []}
+
+
+def _save_rollup(data_dir, rollup):
+    path = rollup_path(data_dir, rollup["day"])
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(rollup, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+# What a day's rollup is bucketed by
+BUCKET_KEY = ("platform", "intent")
+
+
+def aggregate(records, group_by=None, into=None):
+    """
+    Streaming aggregator: fold any record iterable (e.g.
+    result_store.iter_records) into a RollupCounter, or into
+    {group: RollupCounter} keyed by the `group_by` field (a tuple of fields
+    gives tuple keys). `into` continues an earlier result. Only the
+    counters are kept in memory, never the records.
+    """
+    if group_by is None:
+        counter = into if into is not None else RollupCounter()
+        for r in records:
+            counter.add_record(r)
+        return counter
+    groups = into if into is not None else {}
+    for r in records:
+        key = tuple(r.get(f) for f in group_by) if isinstance(group_by, tuple) else r.get(group_by)
+        groups.setdefault(key, RollupCounter()).add_record(r)
+    return groups
+
+
+def _log_records(path, offset, position):
+    """Records of a log from `offset`; `position[0]` ends at the offset after the last one read."""
+    position[0] = offset
+    for record, position[0] in result_store.iter_log_tail(path, offset):
+        if record is not None:
+            yield record
+
+
+def update_day(data_dir, day):
+    """
+    Bring one day's rollup up to date with its result files. Logs are folded
+    in from the offset recorded last time, so calling this after every
+    save_result only reads the newly appended record. A changed legacy file
+    or a rewritten log (see result_store.log_extends) triggers a rebuild of
+    the day. Sources are tracked by size and content, not mtime,
+    because rollups are committed alongside the day files and a fresh
+    checkout resets mtimes. If a day's raw files are gone entirely
+    (retention), the counts already in the rollup are kept.
+    """
+    with _LOCK:
+        rollup = _load_rollup(data_dir, day)
+        paths = [p for p in result_store.list_result_files(data_dir) if result_store.file_day(p) == day]
+        if not paths:
+            return rollup
+
+        sources = rollup.get("sources", {})
+        present = set(os.path.basename(p) for p in paths)
+        rebuild = bool(set(sources) - present)
+        for path in paths:
+            prev = sources.get(os.path.basename(path))
+            if not prev:
+                continue
+            st = os.stat(path)
+            if result_store.is_appendable(path):
+                rebuild = rebuild or not result_store.log_extends(path, prev["offset"], prev.get("sig"), st.st_size)
+            else:
+                rebuild = rebuild or prev["size"] != st.st_size
+
+        if rebuild:
+            sources = {}
+            buckets = {}
+        else:
+            buckets = {(b["platform"], b["intent"]): RollupCounter.from_dict(b) for b in rollup.get("buckets", [])}
+
+        changed = rebuild
+        for path in paths:
+            source = os.path.basename(path)
+            st = os.stat(path)
+            prev = sources.get(source)
+            if prev and prev["size"] == st.st_size:
+                continue
+            # Records are folded as they are read, so even a full rebuild of
+            # a large day never holds the day's records in memory
+            if result_store.is_appendable(path):
+                position = [0]
+                aggregate(_log_records(path, prev["offset"] if prev else 0, position), BUCKET_KEY, buckets)
+                offset = position[0]
+            else:
+                aggregate(result_store.iter_file(path), BUCKET_KEY, buckets)
+                offset = st.st_size
+            sources[source] = {"size": st.st_size, "offset": offset}
+            if result_store.is_appendable(path):
+                sources[source]["sig"] = result_store.log_signature(path, offset)
+            changed = True
+
+        if changed:
+            rollup = {
+                "day": day,
+                "sources": sources,
+                "buckets": [dict(platform=p, intent=i, **c.to_dict()) for (p, i), c in sorted(buckets.items(), key=lambda kv: (str(kv[0][0]), str(kv[0][1])))]
+            }
+            _save_rollup(data_dir, rollup)
+        return rollup
+
+
+def list_rollup_days(data_dir):
+    if not os.path.exists(data_dir):
+        return []
+    return sorted(f[:-len(ROLLUP_SUFFIX)] for f in os.listdir(data_dir) if f.endswith(ROLLUP_SUFFIX))
+
+
+def load_buckets(data_dir, start_day=None, end_day=None, refresh=True):
+    """
+    Return (day, platform, intent, RollupCounter) tuples for the day range.
+    With `refresh`, days whose result files changed are caught up first.
+    """
+    days = set(list_rollup_days(data_dir))
+    if refresh:
+        days.update(result_store.list_days(data_dir))
+    buckets = []
+    for day in sorted(days):
+        if (start_day and day < start_day) or (end_day and day > end_day):
+            continue
+        rollup = update_day(data_dir, day) if refresh else _load_rollup(data_dir, day)
+        for b in rollup.get("buckets", []):
+            buckets.append((day, b["platform"], b["intent"], RollupCounter.from_dict(b)))
+    return buckets
+
+
+def summarize(buckets, group_by=None, **filters):
+    """
+    Merge bucket counters. `filters` match on day/platform/intent; with
+    `group_by` ('day', 'platform' or 'intent') returns {group: RollupCounter}.
+    """
+    fields = ("day", "platform", "intent")
+    if group_by is not None and group_by not in fields:
+        raise ValueError(f"Unsupported group_by: {group_by}")
+    result = {} if group_by else RollupCounter()
+    for bucket in buckets:
+        values = dict(zip(fields, bucket[:3]))
+        if any(values[k] != v for k, v in filters.items() if v is not None):
+            continue
+        if group_by:
+            result.setdefault(values[group_by], RollupCounter()).merge(bucket[3])
+        else:
+            result.merge(bucket[3])
+    return result
+
+
+if __name__ == "__main__":
+    # Usage: python rollups.py  -- (re)build rollups for every day file
+    data_dir = result_store.data_dir_for(os.path.dirname(os.path.abspath(__file__)))
+    for day in result_store.list_days(data_dir):
+        rollup = update_day(data_dir, day)
+        print(f"✅ {day}: {sum(b['total'] for b in rollup['buckets'])} 条记录")
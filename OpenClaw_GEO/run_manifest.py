@@ -0,0 +1,154 @@
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+# One manifest per monitoring run: data/runs/<run_id>.json
+RUNS_DIRNAME = "runs"
+
+# Finished manifests kept for reference; older ones are pruned
+KEEP_COMPLETED = 20
+
+
+def runs_dir(data_dir):
+    return os.path.join(data_dir, RUNS_DIRNAME)
+
+
+def _unit_key(platform, intent, question):
+    return "\t".join([platform, intent, question])
+
+
+class RunManifest:
+    """
+    On-disk record of one monitoring run: the generated question set and
+    every (platform, intent, question) unit whose result is committed. A run
+    that dies part-way can be resumed without regenerating questions or
+    asking finished units again.
+    """
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        self._done = set(_unit_key(*u) for u in data.get("completed", []))
+        self._lock = threading.Lock()
+
+    @property
+    def run_id(self):
+        return self.data["run_id"]
+
+    @property
+    def intent_questions(self):
+        return self.data["intent_questions"]
+
+    @classmethod
+    def create(cls, data_dir, kind, platforms, intent_questions):
+        now = datetime.now()
+        run_id = f"{kind}-{now.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        data = {
+            "run_id": run_id,
+            "kind": kind,
+            "status": "running",
+            "created_at": now.isoformat(),
+            "updated_at": now.isoformat(),
+            "platforms": list(platforms),
+            "intent_questions": intent_questions,
+            "completed": []
+        }
+        os.makedirs(runs_dir(data_dir), exist_ok=True)
+        # Starting afresh supersedes any unfinished run of the same kind
+        for old in list_manifests(data_dir, kind):
+            if old.data.get("status") in ("running", "partial"):
+                old.data["status"] = "abandoned"
+                old.save()
+        manifest = cls(os.path.join(runs_dir(data_dir), f"{run_id}.json"), data)
+        manifest.save()
+        prune(data_dir)
+        return manifest
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(path, json.load(f))
+
+    def total_units(self, platforms=None):
+        platforms = platforms if platforms is not None else self.data["platforms"]
+        return len(platforms) * sum(len(qs) for qs in self.intent_questions.values())
+
+    def completed_count(self, platforms=None):
+        if platforms is None:
+            return len(self._done)
+        return sum(1 for u in self.data["completed"] if u[0] in platforms)
+
+    def is_done(self, platform, intent, question):
+        return _unit_key(platform, intent, question) in self._done
+
+    def mark_done(self, platform, intent, question):
+        """Checkpoint a unit. Call only once its result is durably written."""
+        with self._lock:
+            key = _unit_key(platform, intent, question)
+            if key in self._done:
+                return
+            self._done.add(key)
+            self.data["completed"].append([platform, intent, question])
+            self._save_locked()
+
+    def finish(self, platforms=None):
+        """
+        Close the run. It stays resumable ('partial') while any unit for
+        `platforms` (default: the run's platforms) is still missing.
+        """
+        with self._lock:
+            pending = self.total_units(platforms) - self.completed_count(platforms)
+            self.data["status"] = "completed" if pending <= 0 else "partial"
+            self._save_locked()
+        return self.data["status"]
+
+    def save(self):
+        with self._lock:
+            self._save_locked()
+
+    def _save_locked(self):
+        self.data["updated_at"] = datetime.now().isoformat()
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def list_manifests(data_dir, kind=None):
+    """Manifests of the data directory, newest first."""
+    root = runs_dir(data_dir)
+    if not os.path.exists(root):
+        return []
+    manifests = []
+    for name in os.listdir(root):
+        if not name.endswith(".json"):
+            continue
+        try:
+            manifest = RunManifest.load(os.path.join(root, name))
+        except (OSError, ValueError):
+            continue
+        if kind is None or manifest.data.get("kind") == kind:
+            manifests.append(manifest)
+    manifests.sort(key=lambda m: m.data.get("created_at", ""), reverse=True)
+    return manifests
+
+
+def find_resumable(data_dir, kind=None, run_id=None):
+    """Latest unfinished run (or the given run_id), or None."""
+    for manifest in list_manifests(data_dir, kind):
+        if run_id and manifest.run_id != run_id:
+            continue
+        if run_id or manifest.data.get("status") in ("running", "partial"):
+            return manifest
+    return None
+
+
+def prune(data_dir, keep=KEEP_COMPLETED):
+    finished = [m for m in list_manifests(data_dir) if m.data.get("status") in ("completed", "abandoned")]
+    for manifest in finished[keep:]:
+        try:
+            os.remove(manifest.path)
+        except OSError:
+            pass
@@ -1,6 +1,9 @@
 import os
 import json
 import time
+import argparse
+import functools
+import uuid
 from datetime import datetime, timedelta
 import sys
 
@@ -8,12 +11,22 @@ import sys
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, current_dir)
 
-from api_client import GenericClient
+from api_client import pool_stats, get_response_cache, configure_response_cache
+from provider_health import health_stats
+import result_store
+import result_writer
+import blob_store
+import run_manifest
+import async_monitor
+import enrichment
+import usage_ledger
+import question_bank
+import entity_matcher
 
 # Configuration Paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CONFIG_PATH = os.path.join(BASE_DIR, "config.json")
-DATA_DIR = os.path.join(BASE_DIR, "data")
+DATA_DIR = result_store.data_dir_for(BASE_DIR)
 
 if not os.path.exists(DATA_DIR):
     os.makedirs(DATA_DIR)
@@ -42,51 +55,45 @@ def load_config():
                 
     return config
 
-def extract_competitors(answer):
-    competitors = ["华为", "小米", "阿里", "腾讯", "百度", "字节", "京东", "海尔", "美的", "比亚迪", "大疆", "宁德时代", "联想"]
-    found = []
-    for c in competitors:
-        if c.lower() in answer.lower():
-            found.append(c)
-    return list(set(found))
-
 def get_beijing_time():
     """Get current time in Beijing (UTC+8)"""
     return datetime.utcnow() + timedelta(hours=8)
 
-def save_result(intent_name, platform, question, answer, timestamp, strategy_analysis=None, structured_sources=None):
-    filename = f"{get_beijing_time().strftime('%Y%m%d')}_results.json"
-    filepath = os.path.join(DATA_DIR, filename)
-    data = []
-    if os.path.exists(filepath):
-        with open(filepath, 'r', encoding='utf-8') as f:
-            try: data = json.load(f)
-            except: data = []
-            
-    is_mentioned = "联想" in answer or "Lenovo" in answer or "lenovo" in answer
+def save_result(intent_name, platform, question, answer, timestamp, strategy_analysis=None, structured_sources=None, on_commit=None):
+    day = get_beijing_time().strftime('%Y%m%d')
+    # Brand and competitor mentions from one scan of the answer
+    entities = entity_matcher.analyze(answer)
+    is_mentioned = entities["mentioned"]
     
     # Check for duplicates to avoid appending same result if run multiple times
     # A simple check based on question and platform for today
     # (Optional, but good practice for scheduled tasks)
     
-    competitors = extract_competitors(answer)
+    competitors = entities["competitors"]
     
     record = {
+        "record_id": uuid.uuid4().hex,
         "timestamp": timestamp, "intent": intent_name, "platform": platform,
-        "question": question, "answer": answer, "is_mentioned": is_mentioned,
+        "question": question, "question_id": question_bank.question_id(question),
+        "answer": answer, "is_mentioned": is_mentioned,
         "competitors": competitors, 
         "sources_v2": structured_sources,
         "geo_strategy": strategy_analysis
     }
-    data.append(record)
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    if strategy_analysis is None:
+        # Raw answer only; sources and strategy are filled in by the enrichment worker
+        record["enrichment"] = enrichment.PENDING
+    # Bulky text goes to the content-addressed blob store; the record keeps refs
+    record = blob_store.externalize(DATA_DIR, record)
+    result_writer.get_writer(DATA_DIR).write(record, day, on_commit=on_commit)
     return is_mentioned
 
-def run_monitoring_task():
+def run_monitoring_task(resume=False, concurrency=async_monitor.DEFAULT_CONCURRENCY, enrich=True, enrich_provider=None,
+                        refresh_questions=False):
     print(f"▶️ Starting Monitoring Task at: {get_beijing_time().strftime('%Y-%m-%d %H:%M:%S')} (Beijing Time)")
     
     config = load_config()
+    configure_response_cache(config.get('llm_cache'))
     # Filter active providers (those with API keys)
     active_providers = [(name, cfg) for name, cfg in config['providers'].items() if cfg.get('api_key')]
     
@@ -94,78 +101,101 @@ def run_monitoring_task():
         print("❌ No active providers found (missing API keys). Exiting.")
         return
 
-    # 1. Generate Questions
-    print("🎨 Generating Questions...")
+    platform_names = [name for name, _ in active_providers]
+    manifest = run_manifest.find_resumable(DATA_DIR, kind='scheduled') if resume else None
+    if resume and not manifest:
+        print("ℹ️ No unfinished run to resume, starting a new one.")
+    
+    if manifest:
+        print(f"♻️ Resuming run {manifest.run_id} ({manifest.completed_count(platform_names)}/{manifest.total_units(platform_names)} done)")
+        intent_questions = manifest.intent_questions
+    else:
+        # 1. Questions: the banked set per intent, generated only when missing or due for rotation
+        print("🎨 Loading Questions...")
+        client = question_bank.generator_client(config, active_providers)
+        intent_questions, report = question_bank.get_question_sets(DATA_DIR, config, client, force=refresh_questions)
+        for label, info in report.items():
+            print(f"   {label}: {info['count']} questions ({info['status']}"
+                  f"{', v' + str(info['version']) if info['version'] else ''})")
+        
+        manifest = run_manifest.RunManifest.create(DATA_DIR, 'scheduled', platform_names, intent_questions)
     
-    # Use the first available provider for question generation
-    gen_name, gen_cfg = active_providers[0]
-    client = GenericClient(gen_name, gen_cfg)
-    intent_questions = {}
+    # Token usage of this run is attributed to it and checked against the budget
+    usage = usage_ledger.get_ledger()
+    usage.start_run(manifest.run_id, config)
     
-    for intent in config['intents']:
-        print(f"   Generating for intent: {intent['label']}")
-        qs = client.generate_questions(intent['label'], intent['keywords'], count=30) # Default to 30 as in app
-        intent_questions[intent['label']] = qs if qs else intent.get('questions', [])[:30]
+    # 2. Main Loop - all providers and questions concurrently, capped per provider
+    # Optional early stop of streamed answers once brand detection has enough text
+    stop_after_chars = config.get('monitoring', {}).get('stop_after_chars') or None
     
-    # 2. Main Loop
-    for p_name, p_config in active_providers:
-        print(f"📱 Monitoring Platform: {p_name}")
-        client = GenericClient(p_name, p_config)
-        consecutive_failures = 0
+    async def handle(client, p_name, intent_label, q):
+        print(f"      [{p_name}] Q: {q[:30]}...")
+        response = await client.chat([{"role": "user", "content": q}], stop_after_chars=stop_after_chars)
+        if not response:
+            print(f"      ❌ [{p_name}] No response.")
+            return False
         
-        for intent_label, questions in intent_questions.items():
-            if consecutive_failures >= 3:
-                print(f"⚠️ {p_name} failed too many times, skipping platform.")
-                break
-                
-            print(f"   Processing Intent: {intent_label}")
+        # Extract content from response (it might be a dict or string)
+        answer = ""
+        if isinstance(response, dict):
+            answer = response.get('content', '')
+        elif isinstance(response, str):
+            answer = response
             
-            for q in questions:
-                print(f"      Q: {q[:30]}...")
-                try:
-                    response = client.chat([{"role": "user", "content": q}])
-                    if response:
-                        consecutive_failures = 0
-                        
-                        # Extract content from response (it might be a dict or string)
-                        answer = ""
-                        reasoning = ""
-                        if isinstance(response, dict):
-                            answer = response.get('content', '')
-                            reasoning = response.get('reasoning', '')
-                        elif isinstance(response, str):
-                            answer = response
-                            
-                        if not answer:
-                            print("      ❌ Empty answer content.")
-                            consecutive_failures += 1
-                            continue
+        if not answer:
+            print(f"      ❌ [{p_name}] Empty answer content.")
+            return False
 
-                        competitors = extract_competitors(answer)
-                        structured_srcs = client.extract_structured_sources(answer)
-                        strategy = client.analyze_geo_strategy(intent_label, answer, competitors)
-                        
-                        # Note: save_result might need update if we want to save reasoning too, 
-                        # but for now we keep it simple to fix the crash.
-                        # If we want to save reasoning, we should update save_result signature or pass it in answer?
-                        # run_monitor.py's save_result is different from main.py's save_result.
-                        # Let's keep it compatible with existing run_monitor.py save_result for now.
-                        
-                        save_result(intent_label, p_name, q, answer, get_beijing_time().isoformat(), strategy, structured_srcs)
-                        print("      ✅ Saved.")
-                    else:
-                        print("      ❌ No response.")
-                        consecutive_failures += 1
-                        if consecutive_failures >= 3: break
-                except Exception as e:
-                    print(f"      ❌ Error: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    consecutive_failures += 1
-                
-                time.sleep(1) # Polite delay
+        save_result(intent_label, p_name, q, answer, get_beijing_time().isoformat(),
+                    on_commit=functools.partial(manifest.mark_done, p_name, intent_label, q))
+        print(f"      ✅ [{p_name}] Saved.")
+        return True
+
+    print(f"📱 Monitoring Platforms: {', '.join(platform_names)} (up to {concurrency} questions in flight each)")
+    started = time.time()
+    # Stage 2: sources and strategy analysis run in their own worker pool
+    # alongside collection, instead of on each question's critical path
+    enricher = enrichment.from_config(DATA_DIR, config, enrich_provider).start() if enrich else None
+    summary = async_monitor.run(active_providers, intent_questions, handle, concurrency=concurrency, is_done=manifest.is_done)
+    print(f"⏱️ {summary.succeeded} saved, {summary.failed} failed, {summary.skipped} skipped in {time.time() - started:.1f}s")
                 
+    result_writer.get_writer(DATA_DIR).flush()
+    if enricher is not None:
+        print("🧩 Waiting for enrichment to catch up...")
+        enricher.finish()
+        print(f"🧩 {enricher.enriched} records enriched, {enricher.failed} failed (left pending for enrichment.py)")
+    usage.finish_run({p: manifest.completed_count([p]) for p in platform_names})
+    totals = usage.run_totals()
+    print(f"💰 Usage: {totals['calls']} calls, {totals['prompt_tokens'] + totals['completion_tokens']} tokens, "
+          f"cost {totals['cost']:.2f} ({totals['estimated_calls']} calls estimated)")
+    if usage.exhausted():
+        print("💰 Budget exhausted; the run stopped early.")
+    if manifest.finish(platform_names) != 'completed':
+        print(f"⚠️ Run {manifest.run_id} is incomplete ({manifest.completed_count(platform_names)}/{manifest.total_units(platform_names)}); rerun with --resume to fill the gaps.")
+    for host, stats in pool_stats().items():
+        print(f"🔌 {host}: {stats['requests']} requests, {stats['handshakes']} handshakes, {stats['reused']} reused connections")
+    cache = get_response_cache()
+    if cache is not None:
+        stats = cache.stats()
+        print(f"🗃️ Response cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0f}% hit rate)")
+    for name, stats in health_stats().items():
+        print(f"🩺 {name}: circuit {stats['state']}, {stats['error_rate']:.0%} errors in last {stats['calls']} calls, "
+              f"{stats['trips']} trips, {stats['rejected']} requests rejected")
     print("✅ Monitoring Task Completed Successfully!")
 
 if __name__ == "__main__":
-    run_monitoring_task()
+    parser = argparse.ArgumentParser(description="GEO scheduled monitoring run")
+    parser.add_argument('--resume', action='store_true',
+                        help="Resume the latest unfinished run: reuse its questions and skip committed units")
+    parser.add_argument('--concurrency', type=int, default=async_monitor.DEFAULT_CONCURRENCY,
+                        help="Questions in flight per provider (1 = one at a time)")
+    parser.add_argument('--no-enrich', action='store_true',
+                        help="Only collect raw answers; run enrichment.py later to analyse them")
+    parser.add_argument('--enrich-provider',
+                        help="Provider used for all enrichment calls (default: each answer's own platform)")
+    parser.add_argument('--refresh-questions', action='store_true',
+                        help="Generate a new version of every question set instead of reusing the bank")
+    args = parser.parse_args()
+    run_monitoring_task(resume=args.resume, concurrency=max(1, args.concurrency),
+                        enrich=not args.no_enrich, enrich_provider=args.enrich_provider,
+                        refresh_questions=args.refresh_questions)
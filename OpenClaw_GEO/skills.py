@@ -1,8 +1,7 @@
-import os
-import json
-import pandas as pd
 from datetime import datetime, timedelta
 from api_client import GenericClient
+import rollups
+from columnar_store import open_columnar_store, ANALYTICS_COLUMNS
 
 class BaseSkill:
     def __init__(self, config):
@@ -25,56 +24,38 @@ class DataAnalysisSkill(BaseSkill):
         super().__init__(config)
         self.data_dir = data_dir
 
+    def _cutoff_day(self, days):
+        return (datetime.now() - timedelta(days=days)).strftime('%Y%m%d')
+
     def load_recent_data(self, days=7):
-        all_records = []
-        files = [f for f in os.listdir(self.data_dir) if f.endswith('_results.json')]
-        
-        # Sort by date to get recent ones
-        files.sort(reverse=True)
-        
-        cutoff_date = datetime.now() - timedelta(days=days)
-        
-        for file in files:
-            # File format: YYYYMMDD_results.json
-            try:
-                file_date = datetime.strptime(file.split('_')[0], '%Y%m%d')
-                if file_date < cutoff_date:
-                    continue
-            except:
-                pass
-                
-            with open(os.path.join(self.data_dir, file), 'r', encoding='utf-8') as f:
-                try:
-                    all_records.extend(json.load(f))
-                except:
-                    continue
-        
-        return pd.DataFrame(all_records)
+        store = open_columnar_store(self.data_dir)
+        return store.read_frame(ANALYTICS_COLUMNS, start_day=self._cutoff_day(days))
 
     def execute(self, query, context=None):
         if self.client is None:
             return "错误：未配置 AI 提供商，无法进行数据分析。"
 
-        df = self.load_recent_data()
-        if df.empty:
+        buckets = rollups.load_buckets(self.data_dir, start_day=self._cutoff_day(7))
+        overall = rollups.summarize(buckets)
+        if not overall.total:
             return "目前没有最近的监测数据可供分析。"
 
         # Prepare a summary of the data for the LLM
-        total_count = len(df)
-        mention_rate = (df['is_mentioned'].sum() / total_count * 100) if total_count > 0 else 0
+        total_count = overall.total
+        mention_rate = overall.mention_rate
         
         # Get platform breakdown
-        platform_stats = df.groupby('platform')['is_mentioned'].mean() * 100
-        platform_summary = platform_stats.to_string()
+        platform_summary = "\n".join(
+            f"{name}: {c.mention_rate:.1f}%" for name, c in rollups.summarize(buckets, group_by='platform').items()
+        )
         
         # Get top competitors
-        all_comps = [item for sublist in df['competitors'].tolist() if isinstance(sublist, list) for item in sublist]
-        from collections import Counter
-        top_comps = Counter(all_comps).most_common(5)
+        top_comps = overall.competitors.most_common(5)
         
         # Get intent breakdown
-        intent_stats = df.groupby('intent')['is_mentioned'].mean() * 100
-        intent_summary = intent_stats.to_string()
+        intent_summary = "\n".join(
+            f"{name}: {c.mention_rate:.1f}%" for name, c in rollups.summarize(buckets, group_by='intent').items()
+        )
 
         prompt = f"""
         你是一个数据分析专家，负责分析联想集团的 GEO (生成式引擎优化) 监测数据。
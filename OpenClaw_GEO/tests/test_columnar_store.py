@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import columnar_store
+import result_store
+
+
+def _record(i, platform):
+    return {
+        "timestamp": f"2026-10-17 10:00:{i % 60:02d}",
+        "intent": "推荐",
+        "platform": platform,
+        "question": f"q{i}",
+        "answer": "a",
+        "is_mentioned": i % 2 == 0,
+        "competitors": ["A"],
+    }
+
+
+def _parts(part_dir):
+    return [f for f in os.listdir(part_dir) if f.startswith("part-") and f.endswith(".parquet")]
+
+
+def test_export_compacts_partitions_past_threshold(tmp_path):
+    data_dir = str(tmp_path)
+    store = columnar_store.ColumnarStore(os.path.join(data_dir, columnar_store.COLUMNAR_DIRNAME), data_dir)
+    runs = columnar_store.COMPACT_PARTS * 2 + 3
+    for i in range(runs):
+        result_store.append_record(data_dir, _record(i, "Kimi"), "20261017")
+        assert store.export(data_dir) == 1
+
+    part_dir = store._partition_dir("20261017", "Kimi")
+    assert 1 <= len(_parts(part_dir)) <= columnar_store.COMPACT_PARTS
+    frame = store.read_frame(["question", "is_mentioned"], day="20261017", platform="Kimi")
+    assert sorted(frame["question"]) == sorted(f"q{i}" for i in range(runs))
+    assert int(frame["is_mentioned"].sum()) == (runs + 1) // 2
+
+
+def test_compact_merges_every_partition(tmp_path):
+    data_dir = str(tmp_path)
+    store = columnar_store.ColumnarStore(os.path.join(data_dir, columnar_store.COLUMNAR_DIRNAME), data_dir)
+    for i in range(3):
+        for platform in ("Kimi", "豆包"):
+            result_store.append_record(data_dir, _record(i, platform), "20261017")
+        store.export(data_dir)
+
+    assert store.compact() == 2
+    for platform in ("Kimi", "豆包"):
+        assert len(_parts(store._partition_dir("20261017", platform))) == 1
+    assert store.read_table(["question"]).num_rows == 6
@@ -0,0 +1,256 @@
+import atexit
+import json
+import os
+import threading
+from datetime import datetime
+
+import result_store
+import run_manifest
+
+# Token and cost totals per run / provider / call type, next to the results
+LEDGER_FILENAME = "usage_ledger.json"
+DATA_DIR = result_store.data_dir_for(os.path.dirname(os.path.abspath(__file__)))
+
+# Calls recorded between saves (also saved at exit and at the end of a run)
+SAVE_EVERY = 20
+# Runs kept in the ledger; older ones are dropped
+KEEP_RUNS = 200
+# Calls made outside any monitoring run
+UNATTRIBUTED = "unattributed"
+
+# Enrichment calls that can wait (their records stay pending) when a run
+# nears its budget, so what is left goes to collecting answers
+DEFERRABLE_CALL_TYPES = ("analysis", "extract", "enrich_batch")
+DEFAULT_SOFT_LIMIT = 0.8
+
+
+def _empty_totals():
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "estimated_calls": 0}
+
+
+def _add_totals(into, totals):
+    for key, value in totals.items():
+        into[key] = into.get(key, 0) + value
+
+
+class Budget:
+    """
+    Spending cap of one run from the "budget" config section: max_tokens
+    and/or max_cost (0 or missing = unlimited). Past `soft_limit` of either,
+    deferrable enrichment calls are refused; at the cap, every call is.
+    """
+
+    def __init__(self, max_tokens=None, max_cost=None, soft_limit=DEFAULT_SOFT_LIMIT):
+        self.max_tokens = max_tokens or None
+        self.max_cost = max_cost or None
+        self.soft_limit = soft_limit
+
+    @classmethod
+    def from_config(cls, config):
+        options = (config or {}).get("budget") or {}
+        return cls(options.get("max_tokens"), options.get("max_cost"), options.get("soft_limit") or DEFAULT_SOFT_LIMIT)
+
+    def used_fraction(self, totals):
+        fractions = [0.0]
+        if self.max_tokens:
+            fractions.append((totals["prompt_tokens"] + totals["completion_tokens"]) / self.max_tokens)
+        if self.max_cost:
+            fractions.append(totals["cost"] / self.max_cost)
+        return max(fractions)
+
+
+class UsageLedger:
+    """
+    Token usage of every chat call, attributed to the current run. Totals
+    are kept in memory and merged into data/usage_ledger.json under the data
+    directory lock, so concurrent processes add up instead of overwriting.
+    """
+
+    def __init__(self, data_dir=None):
+        self.data_dir = data_dir = data_dir or DATA_DIR
+        self.path = os.path.join(data_dir, LEDGER_FILENAME)
+        self.run_id = UNATTRIBUTED
+        self.budget = Budget()
+        self.prices = {}
+        self._run_totals = _empty_totals()
+        self._pending = {}  # run -> provider -> call_type -> totals not yet saved
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+    def set_price(self, provider, config):
+        """Prices per million tokens from the provider config (price_input / price_output)."""
+        self.prices[provider] = (float(config.get('price_input') or 0), float(config.get('price_output') or 0))
+
+    def start_run(self, run_id, config=None):
+        """Attribute calls to `run_id` from now on and apply the config's budget to it."""
+        self.save()
+        previous = self.load().get(run_id, {})
+        totals = _empty_totals()
+        for call_types in previous.get("providers", {}).values():
+            for call_totals in call_types.values():
+                _add_totals(totals, call_totals)
+        with self._lock:
+            self.run_id = run_id
+            self.budget = Budget.from_config(config)
+            # A resumed run keeps counting against what it already spent
+            self._run_totals = totals
+
+    def record(self, provider, call_type, prompt_tokens, completion_tokens, estimated=False):
+        price_in, price_out = self.prices.get(provider, (0.0, 0.0))
+        totals = {
+            "calls": 1,
+            "prompt_tokens": int(prompt_tokens or 0),
+            "completion_tokens": int(completion_tokens or 0),
+            "cost": (int(prompt_tokens or 0) * price_in + int(completion_tokens or 0) * price_out) / 1e6,
+            "estimated_calls": int(bool(estimated))
+        }
+        with self._lock:
+            call_types = self._pending.setdefault(self.run_id, {}).setdefault(provider, {})
+            _add_totals(call_types.setdefault(call_type, _empty_totals()), totals)
+            _add_totals(self._run_totals, totals)
+            self._unsaved += 1
+            save = self._unsaved >= SAVE_EVERY
+        if save:
+            self.save()
+
+    def allows(self, call_type):
+        """Whether the current run's budget leaves room for a call of this type."""
+        with self._lock:
+            used = self.budget.used_fraction(self._run_totals)
+        if used >= 1.0:
+            return False
+        return not (used >= self.budget.soft_limit and call_type in DEFERRABLE_CALL_TYPES)
+
+    def exhausted(self):
+        with self._lock:
+            return self.budget.used_fraction(self._run_totals) >= 1.0
+
+    def run_totals(self):
+        with self._lock:
+            return dict(self._run_totals)
+
+    def load(self):
+        """
+        Persisted ledger: {run_id: {"updated_at", "providers": {provider:
+        {call_type: totals}}, and once the run ends "finished_at" and
+        "points": {provider: answers collected}}}.
+        """
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f).get("runs", {})
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._unsaved = 0
+        if not pending:
+            return
+        try:
+            with result_store.locked(self.data_dir):
+                runs = self.load()
+                now = datetime.now().isoformat()
+                for run_id, providers in pending.items():
+                    run = runs.setdefault(run_id, {"providers": {}})
+                    run["updated_at"] = now
+                    for provider, call_types in providers.items():
+                        stored = run["providers"].setdefault(provider, {})
+                        for call_type, totals in call_types.items():
+                            _add_totals(stored.setdefault(call_type, _empty_totals()), totals)
+                self._write(runs)
+        except OSError as e:
+            print(f"⚠️ 用量账本保存失败: {e}")
+
+    def finish_run(self, points):
+        """
+        Save the current run and store its answers collected per provider
+        (its mention-rate data points) with it. The ledger is committed with
+        the results, unlike run manifests, so cost per data point stays
+        reportable for scheduled runs.
+        """
+        self.save()
+        with self._lock:
+            run_id = self.run_id
+        try:
+            with result_store.locked(self.data_dir):
+                runs = self.load()
+                run = runs.setdefault(run_id, {"providers": {}})
+                run["updated_at"] = run["finished_at"] = datetime.now().isoformat()
+                run["points"] = dict(points)
+                self._write(runs)
+        except OSError as e:
+            print(f"⚠️ 用量账本保存失败: {e}")
+
+    def _write(self, runs):
+        if len(runs) > KEEP_RUNS:
+            for run_id in sorted(runs, key=lambda r: runs[r].get("updated_at", ""))[:-KEEP_RUNS]:
+                del runs[run_id]
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"runs": runs}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+_LEDGER = None
+_LEDGER_LOCK = threading.Lock()
+
+
+def get_ledger():
+    """Process-wide UsageLedger, saved at exit."""
+    global _LEDGER
+    with _LEDGER_LOCK:
+        if _LEDGER is None:
+            _LEDGER = UsageLedger()
+            atexit.register(_LEDGER.save)
+        return _LEDGER
+
+
+def run_costs(data_dir, run_ids=None):
+    """
+    Cost per provider over the given runs (default: every finished run in
+    the ledger), with the number of answers collected, i.e. mention-rate
+    data points. Runs recorded before points were kept in the ledger take
+    them from their manifest, if it is still around. Returns {provider:
+    {tokens, cost, calls, points, cost_per_point}}.
+    """
+    runs = UsageLedger(data_dir).load()
+    manifests = {m.run_id: m for m in run_manifest.list_manifests(data_dir)}
+    rows = {}
+    for run_id in (run_ids if run_ids is not None else list(runs)):
+        manifest = manifests.get(run_id)
+        if run_id not in runs or ("points" not in runs[run_id] and manifest is None):
+            continue
+        points = runs[run_id].get("points")
+        for provider, call_types in runs[run_id].get("providers", {}).items():
+            row = rows.setdefault(provider, {"tokens": 0, "cost": 0.0, "calls": 0, "points": 0})
+            for totals in call_types.values():
+                row["tokens"] += totals["prompt_tokens"] + totals["completion_tokens"]
+                row["cost"] += totals["cost"]
+                row["calls"] += totals["calls"]
+            row["points"] += points.get(provider, 0) if points is not None else manifest.completed_count([provider])
+    for row in rows.values():
+        row["cost_per_point"] = row["cost"] / row["points"] if row["points"] else None
+    return rows
+
+
+def latest_run_id(data_dir):
+    """Newest finished run in the ledger, else the newest with a manifest."""
+    runs = UsageLedger(data_dir).load()
+    finished = [run_id for run_id, run in runs.items() if "points" in run]
+    if finished:
+        return max(finished, key=lambda r: runs[r]["finished_at"])
+    for manifest in run_manifest.list_manifests(data_dir):
+        if manifest.run_id in runs:
+            return manifest.run_id
+    return None
+
+
+def format_run_usage(ledger=None):
+    ledger = ledger or get_ledger()
+    totals = ledger.run_totals()
+    estimated = f"，其中 {totals['estimated_calls']} 次为估算" if totals['estimated_calls'] else ""
+    return (f"💰 本次用量: {totals['calls']} 次调用 / {totals['prompt_tokens'] + totals['completion_tokens']} tokens"
+            f" / ¥{totals['cost']:.2f}{estimated}")